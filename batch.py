@@ -0,0 +1,330 @@
+"""
+structure-of-arrays version of the 'Game' rules, stepping many independent games at once
+
+every game state is spread across numpy arrays with the game index as the first axis, cards are referenced
+by their id in 'CardCatalog' (position in 'cards.txt'), and -1 marks an empty slot.
+all of the action methods take one entry per game and return boolean mask of the games where the action
+was legal; games with illegal action (where scalar 'Game' would raise GameError) are left untouched
+"""
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from main import Card, CardCatalog, Game, GameError
+
+EMPTY = -1
+ROWS = 3
+ROW_SLOTS = 4
+RESERVE_SLOTS = 3
+TIER_BOUNDS = ((0, 40), (40, 70), (70, 90), (90, 100))
+MAX_DECK = max(end - start for start, end in TIER_BOUNDS)
+
+
+def _card_tables():
+    entries = CardCatalog.get().entries
+    cost = np.array([entry[4:] for entry in entries], dtype=np.int16)
+    color = np.array([Card.COLOR_IDS[entry[0]][1] for entry in entries], dtype=np.int16)
+    value = np.array([entry[2] for entry in entries], dtype=np.int16)
+    level = np.array([entry[3] for entry in entries], dtype=np.int16)
+    return entries, cost, color, value, level
+
+
+def deck_permutations(n_games: int, seed: Union[int, np.random.Generator, None] = None) -> Tuple[np.ndarray, ...]:
+    """
+    shuffles decks of many games in one vectorized call
+    :param seed: seed or already created numpy generator
+    :return: (l1, l2, l3, nobles) arrays of catalog ids, one shuffled row per game
+    """
+    rng = np.random.default_rng(seed)
+    tiers = []
+    for start, end in TIER_BOUNDS:
+        ids = np.broadcast_to(np.arange(start, end, dtype=np.int16), (n_games, end - start))
+        tiers.append(rng.permuted(ids, axis=1))
+    return tuple(tiers)
+
+
+def game_order(permutations: Tuple[np.ndarray, ...], n: int) -> List[List[int]]:
+    """
+    :return: deck order of the n-th game in the form accepted by 'Game.full_setup(order=...)'
+    """
+    return [tier[n].tolist() for tier in permutations]
+
+
+def best_payments(tokens: np.ndarray, power: np.ndarray, costs: np.ndarray,
+                  weights: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    batched 'Player.best_payment' for many (player, card) pairs
+    :param tokens: (n, 6) tokens of the players
+    :param power: (n, 5) discount of the players from their cards
+    :param costs: (n, 5) costs of the cards
+    :param weights: (6,) or (n, 6) value of keeping one token of every color, gold last
+    :return: (n, 6) payments (zeros where the card can't be bought) and the affordability mask
+    """
+    tokens = np.asarray(tokens)
+    need = np.maximum(np.asarray(costs) - power, 0)
+    paid = np.minimum(tokens[:, :5], need)
+    gold = need.sum(axis=1) - paid.sum(axis=1)
+    affordable = gold <= tokens[:, 5]
+    if weights is not None:
+        weights = np.broadcast_to(np.asarray(weights, dtype=float), (len(tokens), 6))
+        gain = weights[:, :5] - weights[:, 5:]
+        budget = np.maximum(tokens[:, 5] - gold, 0)
+        games = np.arange(len(tokens))
+        # most valued colors first, same order (ties included) as the scalar version
+        for color in np.argsort(-gain, axis=1, kind="stable").T:
+            swap = np.where(gain[games, color] > 0, np.minimum(budget, paid[games, color]), 0)
+            paid[games, color] -= swap
+            gold = gold + swap
+            budget = budget - swap
+    payments = np.concatenate([paid, gold[:, None]], axis=1)
+    payments[~affordable] = 0
+    return payments, affordable
+
+
+class BatchGame:
+    def __init__(self, n_games: int, player_count: int, seed: Optional[int] = None, setup: bool = True):
+        if not (1 < player_count < 5):
+            raise GameError("cant start game with improper number of players")
+        self.n_games = n_games
+        self.player_count = player_count
+        self.entries, self.card_cost, self.card_color, self.card_value, self.card_level = _card_tables()
+        self._card_index = {self._card_key(entry): cid for cid, entry in enumerate(self.entries)}
+        self._games = np.arange(n_games)
+        self.bank = np.zeros((n_games, 6), dtype=np.int16)
+        self.player_tokens = np.zeros((n_games, player_count, 6), dtype=np.int16)
+        self.owned = np.zeros((n_games, player_count, len(self.entries)), dtype=bool)
+        self.card_power = np.zeros((n_games, player_count, 5), dtype=np.int16)
+        self.reserved = np.full((n_games, player_count, RESERVE_SLOTS), EMPTY, dtype=np.int16)
+        self.open_cards = np.full((n_games, ROWS, ROW_SLOTS), EMPTY, dtype=np.int16)
+        self.nobles = np.full((n_games, player_count + 1), EMPTY, dtype=np.int16)
+        self.decks = np.full((n_games, ROWS, MAX_DECK), EMPTY, dtype=np.int16)
+        self.deck_sizes = np.zeros((n_games, ROWS), dtype=np.int16)
+        if setup:
+            self.setup(np.random.default_rng(seed))
+
+    @staticmethod
+    def _card_key(entry) -> tuple:
+        return entry[0], entry[2], entry[3], tuple(entry[4:])
+
+    def card_id(self, card: Optional[Card]) -> int:
+        if card is None:
+            return EMPTY
+        if card.id is not None:
+            return card.id
+        return self._card_index[(card.gem, card.value, card.level, tuple(card.cost))]
+
+    def setup(self, rng: Union[int, np.random.Generator, None] = None):
+        """
+        deals every game the same way 'Game.full_setup' does - top of the deck is its last element
+        and open cards are popped from it, only the deck order is drawn from 'rng' (see 'deck_permutations')
+        """
+        if self.player_count == 4:
+            self.bank[:] = [7] * 5 + [5]
+        elif self.player_count == 3:
+            self.bank[:] = [5] * 5 + [5]
+        else:
+            self.bank[:] = [4] * 5 + [5]
+        *decks, nobles = deck_permutations(self.n_games, rng)
+        for row, deck in enumerate(decks):
+            size = deck.shape[1]
+            self.decks[:, row, :size - ROW_SLOTS] = deck[:, :size - ROW_SLOTS]
+            self.decks[:, row, size - ROW_SLOTS:] = EMPTY
+            self.open_cards[:, row] = deck[:, ::-1][:, :ROW_SLOTS]
+            self.deck_sizes[:, row] = size - ROW_SLOTS
+        self.nobles[:] = nobles[:, ::-1][:, :self.player_count + 1]
+
+    @classmethod
+    def from_games(cls, games: Sequence[Game]) -> "BatchGame":
+        """
+        packs already existing scalar games into one batch, all of them need the same player count
+        """
+        player_count = games[0].player_count
+        if any(g.player_count != player_count for g in games):
+            raise GameError("games in one batch need the same number of players")
+        batch = cls(len(games), player_count, setup=False)
+        for n, game in enumerate(games):
+            batch.bank[n] = game.tokens
+            for p_id, player in enumerate(game.players):
+                batch.player_tokens[n, p_id] = player.tokens
+                for card in player.cards:
+                    cid = batch.card_id(card)
+                    batch.owned[n, p_id, cid] = True
+                    if card.color_id != 5:
+                        batch.card_power[n, p_id, card.color_id] += 1
+                for slot, card in enumerate(player.reserved):
+                    batch.reserved[n, p_id, slot] = batch.card_id(card)
+            for row in range(ROWS):
+                batch.open_cards[n, row] = [batch.card_id(c) for c in game.open_cards[row]]
+                deck = getattr(game, f"l{row + 1}_deck")
+                batch.decks[n, row, :len(deck)] = [batch.card_id(c) for c in deck]
+                batch.deck_sizes[n, row] = len(deck)
+            batch.nobles[n, :len(game.open_cards[3])] = [batch.card_id(c) for c in game.open_cards[3]]
+        return batch
+
+    def _active(self, active: Optional[np.ndarray]) -> np.ndarray:
+        if active is None:
+            return np.ones(self.n_games, dtype=bool)
+        return np.asarray(active, dtype=bool)
+
+    def player_draw_3(self, colors: np.ndarray, p_ids: np.ndarray, active: Optional[np.ndarray] = None):
+        """
+        :param colors: (n_games, k) array of color ids with k <= 3, unused places padded with -1
+        :param p_ids: id of the player drawing in every game
+        :param active: optional mask of the games that take part in this call
+        :return: mask of the games where tokens were drawn
+        """
+        colors = np.asarray(colors).reshape(self.n_games, -1)
+        p_ids = np.asarray(p_ids)
+        chosen = colors != EMPTY
+        picked = chosen.sum(axis=1)
+        valid = (0 < picked) & (picked < 4) & ((~chosen) | ((0 <= colors) & (colors <= 5))).all(axis=1)
+        counts = np.zeros((self.n_games, 6), dtype=np.int16)
+        for k in range(colors.shape[1]):
+            np.add.at(counts, (self._games, np.clip(colors[:, k], 0, 5)), chosen[:, k])
+        valid &= (counts <= self.bank).all(axis=1)
+        valid &= self._active(active)
+        counts[~valid] = 0
+        self.bank -= counts
+        self.player_tokens[self._games, p_ids] += counts
+        return valid
+
+    def player_draw_2_same(self, colors: np.ndarray, p_ids: np.ndarray, active: Optional[np.ndarray] = None):
+        colors = np.asarray(colors)
+        p_ids = np.asarray(p_ids)
+        safe = np.clip(colors, 0, 5)
+        valid = (0 <= colors) & (colors <= 5) & (self.bank[self._games, safe] > 2) & self._active(active)
+        games = self._games[valid]
+        self.bank[games, safe[valid]] -= 2
+        self.player_tokens[games, p_ids[valid], safe[valid]] += 2
+        return valid
+
+    def _selected_cards(self, rows: np.ndarray, slots: np.ndarray, p_ids: np.ndarray) -> np.ndarray:
+        """
+        resolves '(row, slot)' selections the same way 'Game.player_select' does, -1 when nothing is there
+        """
+        safe_rows = np.clip(rows, 0, ROWS - 1)
+        on_table = self.open_cards[self._games, safe_rows, np.clip(slots, 0, ROW_SLOTS - 1)]
+        in_reserve = self.reserved[self._games, p_ids, safe_rows]
+        deck_top = self.decks[self._games, safe_rows, np.maximum(self.deck_sizes[self._games, safe_rows] - 1, 0)]
+        deck_top = np.where(self.deck_sizes[self._games, safe_rows] > 0, deck_top, EMPTY)
+        selected = np.select([slots < 4, slots == 4, slots == 5], [on_table, deck_top, in_reserve], EMPTY)
+        proper = (0 <= rows) & (rows < ROWS) & (0 <= slots) & (slots <= 5)
+        return np.where(proper, selected, EMPTY)
+
+    def can_buy(self, card_ids: np.ndarray, p_ids: np.ndarray):
+        """
+        batched 'Player.can_buy' - affordability mask and the number of lacking tokens for every game
+        """
+        cost = self.card_cost[np.maximum(card_ids, 0)]
+        tokens = self.player_tokens[self._games, p_ids]
+        power = tokens[:, :5] + self.card_power[self._games, p_ids]
+        lacking = np.maximum(cost - power, 0).sum(axis=1)
+        return lacking <= tokens[:, 5], lacking
+
+    def payments(self, card_ids: np.ndarray, p_ids: np.ndarray, weights: Optional[np.ndarray] = None):
+        """
+        'best_payments' of the card in every game, see 'Player.best_payment'
+        """
+        tokens = self.player_tokens[self._games, p_ids]
+        return best_payments(tokens, self.card_power[self._games, p_ids], self.card_cost[np.maximum(card_ids, 0)],
+                             weights)
+
+    def player_buys(self, rows: np.ndarray, slots: np.ndarray, p_ids: np.ndarray,
+                    active: Optional[np.ndarray] = None, weights: Optional[np.ndarray] = None):
+        """
+        buying from the open rows (slots 0-3) or from reserve (slot 5, row is reserve position)
+        :param weights: payment preference like 'Strategy.payment_weights', (6,) or one row per game
+        :return: mask of the games where the card was bought
+        """
+        rows = np.asarray(rows)
+        slots = np.asarray(slots)
+        p_ids = np.asarray(p_ids)
+        card_ids = self._selected_cards(rows, slots, p_ids)
+        payments, affordable = self.payments(card_ids, p_ids, weights)
+        bought = (card_ids != EMPTY) & (slots != 4) & affordable & self._active(active)
+        bought &= self.card_level[np.maximum(card_ids, 0)] > 0
+        games = self._games[bought]
+        ids = card_ids[bought]
+        buyers = p_ids[bought]
+        paid = payments[bought].astype(np.int16)
+        self.player_tokens[games, buyers] -= paid
+        self.bank[games] += paid
+        self.owned[games, buyers, ids] = True
+        colors = self.card_color[ids]
+        regular = colors != 5
+        self.card_power[games[regular], buyers[regular], colors[regular]] += 1
+        from_table = slots[bought] < 4
+        self.open_cards[games[from_table], rows[bought][from_table], slots[bought][from_table]] = EMPTY
+        self._drop_reserved(games[~from_table], buyers[~from_table], rows[bought][~from_table])
+        return bought
+
+    def _drop_reserved(self, games: np.ndarray, p_ids: np.ndarray, positions: np.ndarray):
+        # every card behind the bought one moves one place forward, last place becomes empty
+        reserved = self.reserved[games, p_ids]
+        source = np.arange(RESERVE_SLOTS)[None, :] + (np.arange(RESERVE_SLOTS)[None, :] >= positions[:, None])
+        padded = np.concatenate([reserved, np.full((len(games), 1), EMPTY, dtype=np.int16)], axis=1)
+        self.reserved[games, p_ids] = np.take_along_axis(padded, source, axis=1)
+
+    def player_reserve(self, rows: np.ndarray, slots: np.ndarray, p_ids: np.ndarray,
+                       active: Optional[np.ndarray] = None):
+        """
+        reserving open card (slots 0-3) or top of the row's deck (slot 4); gold token is handed out
+        only while there is any left in the bank
+        :return: mask of the games where the card was reserved
+        """
+        rows = np.asarray(rows)
+        slots = np.asarray(slots)
+        p_ids = np.asarray(p_ids)
+        card_ids = self._selected_cards(rows, slots, p_ids)
+        has_space = (self.reserved[self._games, p_ids] == EMPTY).any(axis=1)
+        reserved = (card_ids != EMPTY) & (slots != 5) & has_space & self._active(active)
+        reserved &= self.card_level[np.maximum(card_ids, 0)] > 0
+        games = self._games[reserved]
+        takers = p_ids[reserved]
+        current = self.reserved[games, takers]
+        self.reserved[games, takers] = np.concatenate([card_ids[reserved][:, None], current[:, :2]], axis=1)
+        from_deck = slots[reserved] == 4
+        deck_games = games[from_deck]
+        self.deck_sizes[deck_games, rows[reserved][from_deck]] -= 1
+        self.decks[deck_games, rows[reserved][from_deck], self.deck_sizes[deck_games, rows[reserved][from_deck]]] = \
+            EMPTY
+        table_games = games[~from_deck]
+        self.open_cards[table_games, rows[reserved][~from_deck], slots[reserved][~from_deck]] = EMPTY
+        gold = self.bank[games, 5] > 0
+        self.bank[games[gold], 5] -= 1
+        self.player_tokens[games[gold], takers[gold], 5] += 1
+        return reserved
+
+    def replace_empty(self, active: Optional[np.ndarray] = None):
+        """
+        fills every empty open slot from the top of the row's deck, slot by slot in the same order
+        as the scalar version; running out of cards leaves the slot empty
+        """
+        active = self._active(active)
+        for row in range(ROWS):
+            for slot in range(ROW_SLOTS):
+                sizes = self.deck_sizes[:, row]
+                refill = active & (self.open_cards[:, row, slot] == EMPTY) & (sizes > 0)
+                games = self._games[refill]
+                top = sizes[refill] - 1
+                self.open_cards[games, row, slot] = self.decks[games, row, top]
+                self.decks[games, row, top] = EMPTY
+                self.deck_sizes[games, row] = top
+
+    def same_state(self, other: "BatchGame") -> np.ndarray:
+        """
+        per-game equality of two batches (decks compared only up to their current sizes)
+        """
+        in_deck = np.arange(MAX_DECK)[None, None, :] < self.deck_sizes[:, :, None]
+        return np.stack([
+            (self.bank == other.bank).all(axis=1),
+            (self.player_tokens == other.player_tokens).all(axis=(1, 2)),
+            (self.owned == other.owned).all(axis=(1, 2)),
+            (self.card_power == other.card_power).all(axis=(1, 2)),
+            (self.reserved == other.reserved).all(axis=(1, 2)),
+            (self.open_cards == other.open_cards).all(axis=(1, 2)),
+            (self.nobles == other.nobles).all(axis=1),
+            ((self.decks == other.decks) | ~in_deck).all(axis=(1, 2)),
+            (self.deck_sizes == other.deck_sizes).all(axis=1),
+        ]).all(axis=0)
+
@@ -0,0 +1,225 @@
+"""
+benchmarks of the engine hot paths, every one with fixed seed so two runs measure the same work
+
+    python bench.py                          - run everything and print the table
+    python bench.py --save baseline.json     - keep the results as a baseline
+    python bench.py --compare baseline.json  - flag benchmarks that got slower than the baseline (exit code 1)
+
+every call is timed on its own, state needed by the call is prepared outside of the measured time;
+garbage collector is off while measuring (like in 'timeit') and regressions are judged on the median latency,
+which is much less noisy than the mean
+"""
+import gc
+import sys
+import json
+import argparse
+from random import Random
+from time import perf_counter_ns
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from main import CardCatalog, Game, Player, RandomStrategy
+
+# relative slowdown still considered noise
+THRESHOLD = 0.15
+
+
+def _dealt_game(seed: int, player_count: int = 4) -> Game:
+    game = Game(player_count, verbose=False, seed=seed)
+    game.full_setup([RandomStrategy(seed + i) for i in range(player_count)])
+    return game
+
+
+def _random_player(rng: Random) -> Player:
+    cards = CardCatalog.get().cards
+    player = Player(0, verbose=False)
+    player.tokens = [rng.randint(0, 4) for _ in range(5)] + [rng.randint(0, 2)]
+    player.cards = [cards[rng.randrange(90)] for _ in range(rng.randint(0, 15))]
+    return player
+
+
+def bench_can_buy(rng: Random) -> Iterator[Tuple[Callable, tuple]]:
+    cards = CardCatalog.get().cards
+    players = [_random_player(rng) for _ in range(64)]
+    while True:
+        yield players[rng.randrange(64)].can_buy, (cards[rng.randrange(90)],)
+
+
+def bench_pay_tokens(rng: Random) -> Iterator[Tuple[Callable, tuple]]:
+    cards = CardCatalog.get().cards
+    player = Player(0, verbose=False)
+    while True:
+        player.tokens = [7] * 5 + [5]
+        player.cards = [cards[rng.randrange(90)] for _ in range(rng.randint(0, 10))]
+        card = cards[rng.randrange(90)]
+        yield player.pay_tokens, (player.can_buy(card), card)
+
+
+def bench_replace_empty(rng: Random) -> Iterator[Tuple[Callable, tuple]]:
+    game = _dealt_game(rng.randrange(2 ** 32))
+    previous = []
+    while True:
+        # put back what the previous call dealt, then empty a few slots again
+        for row, slot, card in previous:
+            game.decks[row].append(game.open_cards[row][slot])
+            game.open_cards[row][slot] = card
+        previous = []
+        for _ in range(rng.randint(1, 4)):
+            row, slot = rng.randrange(3), rng.randrange(4)
+            if game.open_cards[row][slot] is not None:
+                previous.append((row, slot, game.open_cards[row][slot]))
+                game.open_cards[row][slot] = None
+        yield game.replace_empty, ()
+
+
+def bench_setup_cards(rng: Random) -> Iterator[Tuple[Callable, tuple]]:
+    while True:
+        yield Game(rng.randint(2, 4), verbose=False, seed=rng.randrange(2 ** 32)).setup_cards, ()
+
+
+def bench_legal_mask(rng: Random) -> Iterator[Tuple[Callable, tuple]]:
+    game = _dealt_game(rng.randrange(2 ** 32))
+    records = []
+    while True:
+        # random walk through one game, rewound when it ends
+        if game.finished or len(records) > 200:
+            while records:
+                game.undo(records.pop())
+        p_id = game.current_player
+        records.append(game.apply(rng.choice(game.legal_actions(p_id))))
+        yield game.legal_mask, (game.current_player,)
+
+
+def bench_apply_undo(rng: Random) -> Iterator[Tuple[Callable, tuple]]:
+    game = _dealt_game(rng.randrange(2 ** 32))
+
+    def apply_undo(action: int):
+        game.undo(game.apply(action))
+
+    records = []
+    while True:
+        if game.finished or len(records) > 200:
+            while records:
+                game.undo(records.pop())
+        actions = game.legal_actions(game.current_player)
+        yield apply_undo, (rng.choice(actions),)
+        records.append(game.apply(rng.choice(actions)))
+
+
+def bench_clone(rng: Random) -> Iterator[Tuple[Callable, tuple]]:
+    game = _dealt_game(rng.randrange(2 ** 32))
+    while True:
+        if game.finished:
+            game = _dealt_game(rng.randrange(2 ** 32))
+        game.apply(rng.choice(game.legal_actions(game.current_player)))
+        yield game.clone, ()
+
+
+def bench_full_game(rng: Random) -> Iterator[Tuple[Callable, tuple]]:
+    while True:
+        game = _dealt_game(rng.randrange(2 ** 32), rng.randint(2, 4))
+        yield game.play, ()
+
+
+# name: (case generator, calls measured, calls not measured at the start)
+BENCHMARKS: Dict[str, Tuple[Callable[[Random], Iterator[Tuple[Callable, tuple]]], int, int]] = {
+    "Player.can_buy": (bench_can_buy, 50000, 1000),
+    "Player.pay_tokens": (bench_pay_tokens, 20000, 500),
+    "Game.replace_empty": (bench_replace_empty, 20000, 500),
+    "Game.setup_cards": (bench_setup_cards, 5000, 100),
+    "Game.legal_mask": (bench_legal_mask, 20000, 500),
+    "Game.apply+undo": (bench_apply_undo, 20000, 500),
+    "Game.clone": (bench_clone, 20000, 500),
+    "full game": (bench_full_game, 200, 5),
+}
+
+
+def percentile(ordered: List[int], fraction: float) -> int:
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(cases: Iterator[Tuple[Callable, tuple]], calls: int, warmup: int) -> Dict[str, float]:
+    """
+    :return: ops/sec and latency percentiles in microseconds
+    """
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for n, (call, args) in zip(range(warmup + calls), cases):
+            start = perf_counter_ns()
+            call(*args)
+            elapsed = perf_counter_ns() - start
+            if n >= warmup:
+                samples.append(elapsed)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    samples.sort()
+    return {
+        "ops_per_sec": len(samples) * 1e9 / sum(samples),
+        "p50_us": percentile(samples, 0.5) / 1000,
+        "p90_us": percentile(samples, 0.9) / 1000,
+        "p99_us": percentile(samples, 0.99) / 1000,
+    }
+
+
+def run(names: Optional[List[str]] = None, seed: int = 1234, scale: float = 1.0) -> Dict[str, Dict[str, float]]:
+    """
+    :param scale: multiplies the number of measured calls, e.g. 0.1 for quick run
+    """
+    CardCatalog.get()
+    results = {}
+    for name, (cases, calls, warmup) in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        results[name] = measure(cases(Random(seed)), max(1, int(calls * scale)), warmup)
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+    """
+    :return: relative change of the speed (by median latency) of every benchmark present in both,
+        negative is slower
+    """
+    return {
+        name: baseline[name]["p50_us"] / result["p50_us"] - 1
+        for name, result in results.items() if name in baseline
+    }
+
+
+def report(results: Dict[str, Dict[str, float]], changes: Optional[Dict[str, float]] = None,
+           threshold: float = THRESHOLD) -> str:
+    lines = [f"{'benchmark':<22}{'ops/sec':>12}{'p50 us':>10}{'p90 us':>10}{'p99 us':>10}"
+             + ("   vs baseline" if changes is not None else "")]
+    for name, result in results.items():
+        line = f"{name:<22}{result['ops_per_sec']:>12.0f}{result['p50_us']:>10.2f}" \
+               f"{result['p90_us']:>10.2f}{result['p99_us']:>10.2f}"
+        if changes is not None and name in changes:
+            line += f"   {changes[name]:+.1%}" + ("  REGRESSION" if changes[name] < -threshold else "")
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="benchmarks of the engine hot paths")
+    parser.add_argument("-b", "--benchmark", action="append", choices=sorted(BENCHMARKS))
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the number of measured calls")
+    parser.add_argument("--save", help="write results to this json file")
+    parser.add_argument("--compare", help="baseline json file to compare with")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed relative slowdown")
+    args = parser.parse_args(argv)
+    results = run(args.benchmark, args.seed, args.scale)
+    changes = None
+    if args.compare:
+        with open(args.compare) as baseline:
+            changes = compare(results, json.load(baseline))
+    print(report(results, changes, args.threshold))
+    if args.save:
+        with open(args.save, "w") as out:
+            json.dump(results, out, indent=2)
+    return int(changes is not None and any(change < -args.threshold for change in changes.values()))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
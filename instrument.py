@@ -0,0 +1,165 @@
+"""
+opt-in instrumentation of the engine - counts calls and wall time of public methods of 'Game' and 'Player'
+
+    with instrumented() as stats:
+        game.play(...)
+    print(stats.summary())
+    stats.export_chrome_trace("trace.json")     # chrome://tracing or https://ui.perfetto.dev
+
+methods are wrapped only while instrumentation is enabled, 'disable' puts the original functions back,
+so disabled instrumentation costs nothing. time is inclusive (time of nested instrumented calls counts
+in their callers too), 'Game.apply' is additionally split per action kind
+"""
+import json
+import inspect
+from functools import wraps
+from threading import get_ident
+from time import perf_counter_ns
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from main import Action, Game, Player
+
+# cap of the trace events kept for export, the summary counts every call regardless
+MAX_EVENTS = 1_000_000
+
+
+class Instrumentation:
+    def __init__(self):
+        # name: [calls, total ns, max ns]
+        self.stats: Dict[str, List[int]] = {}
+        self.events: List[Tuple[str, int, int, int]] = []
+        self.max_events = MAX_EVENTS
+        self._originals: List[Tuple[type, str, object]] = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._originals)
+
+    def reset(self):
+        self.stats.clear()
+        self.events.clear()
+
+    def _record(self, name: str, start: int, elapsed: int, traced: bool = True):
+        entry = self.stats.get(name)
+        if entry is None:
+            entry = self.stats[name] = [0, 0, 0]
+        entry[0] += 1
+        entry[1] += elapsed
+        if elapsed > entry[2]:
+            entry[2] = elapsed
+        if traced and len(self.events) < self.max_events:
+            self.events.append((name, start, elapsed, get_ident()))
+
+    def _wrap(self, name: str, function: Callable) -> Callable:
+        record = self._record
+        if inspect.iscoroutinefunction(function):
+            @wraps(function)
+            async def timed_async(*args, **kwargs):
+                start = perf_counter_ns()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    record(name, start, perf_counter_ns() - start)
+            return timed_async
+        if function is Game.apply:
+            @wraps(function)
+            def timed_apply(game, action, *args, **kwargs):
+                start = perf_counter_ns()
+                try:
+                    return function(game, action, *args, **kwargs)
+                finally:
+                    elapsed = perf_counter_ns() - start
+                    record(name, start, elapsed)
+                    with_kind = f"{name}[{Action.decode(action)[0]}]" if 0 <= action < Action.COUNT else name
+                    record(with_kind, start, elapsed, False)
+            return timed_apply
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, start, perf_counter_ns() - start)
+        return timed
+
+    def enable(self, classes: Sequence[type] = (Game, Player), methods: Optional[Sequence[str]] = None):
+        """
+        :param methods: names of the methods to instrument, every public method of 'classes' when not given
+        """
+        if self.enabled:
+            return
+        for cls in classes:
+            for attr, value in list(vars(cls).items()):
+                if attr.startswith("_") or (methods is not None and attr not in methods):
+                    continue
+                name = f"{cls.__name__}.{attr}"
+                if isinstance(value, staticmethod):
+                    wrapped = staticmethod(self._wrap(name, value.__func__))
+                elif isinstance(value, classmethod):
+                    wrapped = classmethod(self._wrap(name, value.__func__))
+                elif inspect.isfunction(value):
+                    wrapped = self._wrap(name, value)
+                else:
+                    # properties and class constants stay as they are
+                    continue
+                self._originals.append((cls, attr, value))
+                setattr(cls, attr, wrapped)
+
+    def disable(self):
+        while self._originals:
+            cls, attr, value = self._originals.pop()
+            setattr(cls, attr, value)
+
+    def summary(self, sort_by: str = "total") -> str:
+        """
+        :param sort_by: 'total', 'calls', 'mean' or 'max'
+        """
+        keys = {
+            "total": lambda row: row[1][1],
+            "calls": lambda row: row[1][0],
+            "mean": lambda row: row[1][1] / row[1][0],
+            "max": lambda row: row[1][2],
+        }
+        lines = [f"{'method':<36}{'calls':>10}{'total ms':>12}{'mean us':>10}{'max us':>10}"]
+        for name, (calls, total, longest) in sorted(self.stats.items(), key=keys[sort_by], reverse=True):
+            lines.append(f"{name:<36}{calls:>10}{total / 1e6:>12.3f}"
+                         f"{total / calls / 1e3:>10.2f}{longest / 1e3:>10.2f}")
+        return "\n".join(lines)
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {"calls": calls, "total_ms": total / 1e6, "mean_us": total / calls / 1e3, "max_us": longest / 1e3}
+            for name, (calls, total, longest) in self.stats.items()
+        }
+
+    def chrome_trace(self) -> dict:
+        """
+        trace in Chrome 'Trace Event Format' - one complete event per recorded call
+        """
+        return {
+            "traceEvents": [
+                {"name": name, "cat": name.split(".")[0], "ph": "X", "ts": start / 1e3, "dur": elapsed / 1e3,
+                 "pid": 0, "tid": thread}
+                for name, start, elapsed, thread in self.events
+            ],
+            "displayTimeUnit": "ns",
+        }
+
+    def export_chrome_trace(self, file: str):
+        with open(file, "w") as trace:
+            json.dump(self.chrome_trace(), trace)
+
+
+INSTRUMENTATION = Instrumentation()
+
+
+@contextmanager
+def instrumented(classes: Sequence[type] = (Game, Player),
+                 methods: Optional[Sequence[str]] = None) -> Iterator[Instrumentation]:
+    INSTRUMENTATION.enable(classes, methods)
+    try:
+        yield INSTRUMENTATION
+    finally:
+        INSTRUMENTATION.disable()
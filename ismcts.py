@@ -0,0 +1,142 @@
+"""
+information set Monte Carlo tree search - the search of 'mcts' without looking at what the player can't know
+
+hidden from the player on the move are the order of the decks and the cards the other players reserved from
+the top of a deck (only their level shows). every move 'Determinizer' deals a batch of worlds consistent with
+what the player sees - the unseen cards of every level are shuffled and dealt back into the decks and the
+opponents' blind reserves - and the search takes turns between them. all of the worlds share one tree: nodes
+are keyed by the hash of the information set (Zobrist hash with the opponents' blind reserves hashed only
+by their level), and since the legal actions of the other players may differ between the worlds, every
+action counts how many times it was available and UCB uses that instead of the visits of the node
+"""
+from math import log, sqrt
+from random import Random
+from typing import List, Optional
+
+from main import Action, Game, ZOBRIST
+from mcts import MCTSStrategy, Node
+
+
+class Determinizer:
+    def __init__(self, seed: Optional[int] = None):
+        self.rng = Random(seed)
+
+    def sample(self, game: Game, observer: int, count: int) -> List[Game]:
+        """
+        deals 'count' clones of the game that differ only in what the observer can't see
+        :param observer: id of the player whose knowledge the worlds keep
+        """
+        hidden = [(p_id, slot, card) for p_id, player in enumerate(game.players) if p_id != observer
+                  for slot, card in player.hidden]
+        # unseen cards of every level, in catalog order so the worlds depend only on what the observer knows
+        pools = [list(deck) for deck in game.decks]
+        for _, _, card in hidden:
+            pools[card.level - 1].append(card)
+        for pool in pools:
+            pool.sort(key=lambda card: card.id)
+        # blind ids without the hidden cards, the dealt ones are added per world
+        hidden_ids = {p_id: game.players[p_id].blind - {card.id for p, _, card in hidden if p == p_id}
+                      for p_id in {p_id for p_id, _, _ in hidden}}
+        keys = ZOBRIST.reserved
+        worlds = []
+        for _ in range(count):
+            world = game.clone()
+            taken = [0, 0, 0]
+            for pool in pools:
+                Game.shuffle_dek(pool, self.rng)
+            blind = {p_id: set(ids) for p_id, ids in hidden_ids.items()}
+            for p_id, slot, card in hidden:
+                row = card.level - 1
+                dealt = pools[row][taken[row]]
+                taken[row] += 1
+                player = world.players[p_id]
+                reserved = list(player.reserved)
+                reserved[slot] = dealt
+                player.reserved = tuple(reserved)
+                blind[p_id].add(dealt.id)
+                world.zobrist ^= keys[p_id][slot][card.id] ^ keys[p_id][slot][dealt.id]
+            for p_id, ids in blind.items():
+                world.players[p_id].blind = frozenset(ids)
+            world.l1_deck, world.l2_deck, world.l3_deck = (pool[start:] for pool, start in zip(pools, taken))
+            worlds.append(world)
+        return worlds
+
+
+class ISNode(Node):
+    __slots__ = ("available", "mask")
+
+    def __init__(self):
+        super().__init__()
+        self.available: List[int] = []
+        self.mask = 0
+
+    def reset(self, key: int, player: int, actions: List[int]):
+        super().reset(key, player, actions)
+        self.available = [0] * len(actions)
+        self.mask = sum(1 << action for action in actions)
+
+
+class ISMCTSStrategy(MCTSStrategy):
+    def __init__(self, seed: Optional[int] = None, iterations: int = 1000, time_limit: Optional[float] = None,
+                 max_nodes: int = 50000, exploration: float = 1.4, rollout_depth: int = 30,
+                 determinizations: int = 20):
+        """
+        :param determinizations: worlds dealt for every move, the iterations are spread evenly among them
+        """
+        super().__init__(seed, iterations, time_limit, max_nodes, exploration, rollout_depth)
+        self.determinizations = determinizations
+        self.determinizer = Determinizer(self.rng.getrandbits(64))
+        self.observer = 0
+
+    def key(self, game: Game) -> int:
+        """
+        hash of the information set of the observer
+        """
+        h = game.zobrist
+        for p_id, player in enumerate(game.players):
+            if p_id != self.observer and player.blind:
+                for slot, card in player.hidden:
+                    h ^= ZOBRIST.reserved[p_id][slot][card.id] ^ ZOBRIST.hidden[p_id][slot][card.level]
+        return h
+
+    def node(self, game: Game, key: int) -> ISNode:
+        node = self._free.pop() if self._free else ISNode()
+        actions = game.legal_actions(game.current_player)
+        self.rng.shuffle(actions)
+        node.reset(key, game.current_player, actions)
+        self.table[key] = node
+        return node
+
+    def select(self, node: ISNode, game: Game) -> int:
+        """
+        UCB1 among the actions legal in this world, untried actions first
+        """
+        mask = game.legal_mask(game.current_player)
+        if mask & ~node.mask:
+            for action in Action.from_mask(mask & ~node.mask):
+                node.actions.append(action)
+                node.visits.append(0)
+                node.values.append(0.0)
+                node.available.append(0)
+            node.mask |= mask
+        actions, visits, available = node.actions, node.visits, node.available
+        legal = [i for i, action in enumerate(actions) if mask >> action & 1]
+        untried = None
+        for i in legal:
+            available[i] += 1
+            if untried is None and visits[i] == 0:
+                untried = i
+        if untried is not None:
+            return untried
+        values, exploration = node.values, self.exploration
+        return max(legal, key=lambda i: values[i] / visits[i] + exploration * sqrt(log(available[i]) / visits[i]))
+
+    def worlds(self, game: Game) -> List[Game]:
+        self.observer = game.current_player
+        return self.determinizer.sample(game, self.observer, self.determinizations)
+
+    def choose_action(self, game: Game, p_id: int) -> int:
+        root = self.search(game)
+        mask = game.legal_mask(p_id)
+        return max((action for action in root.actions if mask >> action & 1),
+                   key=lambda action: root.visits[root.actions.index(action)])
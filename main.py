@@ -1,21 +1,147 @@
 import re
 import ast
+import mmap
+import struct
+import hashlib
+from os import path, replace
 from contextlib import suppress
-from random import randint
-from typing import Union, List, Tuple, Optional
+from itertools import chain, combinations, product
+from random import shuffle, getrandbits, Random
+from typing import Union, List, Tuple, Optional, Dict, Sequence, Callable, Iterator
+
+CARDS_FILE = path.join(path.dirname(path.abspath(__file__)), "cards.txt")
 
 
 class GameError(Exception):
     pass
 
 
-class Card:
+# gem vectors (costs, powers) packed into one integer - 16 bit lane per gem, highest bit of every lane
+# is a guard that absorbs borrows, so comparing all 5 gems at once takes a handful of integer operations
+LANE_BITS = 16
+LANE_LIMIT = 0x0FFF
+LANE_UNITS = tuple(1 << (LANE_BITS * lane) for lane in range(5)) + (0,)
+LANE_GUARDS = sum(0x8000 * unit for unit in LANE_UNITS)
+LANE_VALUES = sum(0x7FFF * unit for unit in LANE_UNITS)
+LANE_ONES = sum(LANE_UNITS)
+
+
+def pack_gems(values) -> int:
+    """
+    packs first 5 values (regular gems) into lanes; every value has to stay under LANE_LIMIT,
+    which is far over anything that can happen in a game
+    """
+    return values[0] | values[1] << 16 | values[2] << 32 | values[3] << 48 | values[4] << 64
+
+
+def unpack_gems(packed: int) -> List[int]:
+    return [(packed >> (LANE_BITS * lane)) & 0x7FFF for lane in range(5)]
+
+
+def packed_shortfall(power: int, cost: int) -> int:
+    """
+    lanes of 'max(cost - power, 0)' for every gem
+    """
+    # lane holds 0x8000 + cost - power, guard bit stays set only where cost >= power
+    diff = (cost | LANE_GUARDS) - power
+    keep = ((diff & LANE_GUARDS) >> 15) * 0xFFFF
+    return diff & keep & LANE_VALUES
+
+
+def packed_deficit(power: int, cost: int) -> int:
+    """
+    total number of gems missing from 'power' to cover 'cost', summed over lanes by one multiplication
+    """
+    return ((packed_shortfall(power, cost) * LANE_ONES) >> (LANE_BITS * 4)) & 0xFFFF
+
+
+def packed_covers(power: int, cost: int) -> bool:
+    return ((power | LANE_GUARDS) - cost) & LANE_GUARDS == LANE_GUARDS
+
+
+# rendered text of the cards, keyed on card content and printing mode, emptied when it grows past the size
+RENDER_CACHE_SIZE = 4096
+_RENDERED: Dict[tuple, str] = {}
+_RENDERED_LINES: Dict[tuple, Tuple[str, ...]] = {}
+
+
+class CardBase:
+    """
+    parts shared by every card representation - color tables and printing
+    """
+    __slots__ = ()
     COLOR_CODES = ['r', 'd', 'o', 'e', 's', 'x']
     COLOR_SHORT_NAMES = ["ruby ", "diamd", "onyx ", "emrld", "saphi", "artcr"]
     COLOR_IDS = {
         key: [value, cid] for key, value, cid in zip(COLOR_CODES, COLOR_SHORT_NAMES, range(len(COLOR_CODES)))
     }
 
+    def __str__(self):
+        return self.render(short=not self.printing_rules)
+
+    def render(self, short: bool = False) -> str:
+        """
+        text of the card, cached per card content and printing mode - cards with the same content look the same
+        """
+        key = (self.gem, self.value, self.level, self.cost, short)
+        try:
+            return _RENDERED[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable cost put in by hand, drawn every time
+            return self._draw(short)
+        if len(_RENDERED) >= RENDER_CACHE_SIZE:
+            _RENDERED.clear()
+        text = _RENDERED[key] = self._draw(short)
+        return text
+
+    def render_lines(self, short: bool = False) -> Tuple[str, ...]:
+        key = (self.gem, self.value, self.level, self.cost, short)
+        try:
+            return _RENDERED_LINES[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return tuple(self._draw(short).split("\n"))
+        if len(_RENDERED_LINES) >= RENDER_CACHE_SIZE:
+            _RENDERED_LINES.clear()
+        lines = _RENDERED_LINES[key] = tuple(self.render(short).split("\n"))
+        return lines
+
+    def _draw(self, short: bool) -> str:
+        # simplifying case
+        if short:
+            return str([self.gem, self.level, self.value, self.cost])
+        p = f' {self.value if self.value > 0 else " "} '
+        rank = ' R' + ''.join(['I' if i <= self.level - 1 else ' ' for i in range(3)]) + ' '
+        gem = self.COLOR_SHORT_NAMES[self.color_id]
+        return ''.join([
+            f"╔═════════════════╗\n",
+            f"║ {gem}       {p} ║\n",
+            f"║    +    {rank}  ║\n",
+            f"║   /_\\           ║\n",
+            f"║  :<_>:   %s rub ║\n" % (f' {self.cost[0]}',),
+            f"║ /=====\\  %s dia ║\n" % (f' {self.cost[1]}',),
+            f"║ :_[I]_:  %s onx ║\n" % (f' {self.cost[2]}',),
+            f"║::::::::: %s emd ║\n" % (f' {self.cost[3]}',),
+            f"║          %s sap ║\n" % (f' {self.cost[4]}',),
+            f"╚═════════════════╝"])
+
+    def can_be_bought(self, other):
+        """
+        for simplicity, invoking counterpart method from 'Player' class
+        """
+        if isinstance(other, Player):
+            return other.can_buy(self)
+        raise ValueError(f"can't compare object {other.__class__} to Card meaningfully")
+
+    def print_short(self):
+        return self.render(short=True)
+
+
+class Card(CardBase):
+
     def __init__(self, format_list: list = None, gem: int = None, level: int = None,
                  value: int = None, cost: list = None, printing_rules='e'):
         if format_list and len(format_list) == 9:
@@ -23,6 +149,8 @@ class Card:
                 raise ValueError("improper color code type in first format argument")
             if len(format_list[0]) != 1:
                 raise ValueError("code has exactly one character")
+            if format_list[0] not in self.COLOR_CODES:
+                raise ValueError(f"{format_list[0]} isn't valid color code")
             if any([(not isinstance(i, int)) for i in format_list[1:]]):
                 raise ValueError("improper type of format list argument; should be int")
             self.gem = format_list[0]
@@ -46,29 +174,14 @@ class Card:
             self.value = value
             self.level = level
             self.cost = tuple(cost)
+        self.color_id = self.COLOR_IDS[self.gem][1]
+        self.packed_cost = pack_gems(self.cost)
         self.printing_rules = printing_rules
-
-    def __str__(self):
-        # simplifying case
-        if not self.printing_rules:
-            return str([self.gem, self.level, self.value, self.cost])
-        p = f' {self.value if self.value > 0 else " "} '
-        rank = ' R' + ''.join(['I' if i <= self.level - 1 else ' ' for i in range(3)]) + ' '
-        gem = self.COLOR_SHORT_NAMES[self.color_id]
-        return ''.join([
-            f"╔═════════════════╗\n",
-            f"║ {gem}       {p} ║\n",
-            f"║    +    {rank}  ║\n",
-            f"║   /_\           ║\n",
-            f"║  :<_>:   %s rub ║\n" % (f' {self.cost[0]}',),
-            f"║ /=====\  %s dia ║\n" % (f' {self.cost[1]}',),
-            f"║ :_[I]_:  %s onx ║\n" % (f' {self.cost[2]}',),
-            f"║::::::::: %s emd ║\n" % (f' {self.cost[3]}',),
-            f"║          %s sap ║\n" % (f' {self.cost[4]}',),
-            f"╚═════════════════╝"])
+        # position in the card catalog, set only for cards that come from it
+        self.id: Optional[int] = None
 
     def __eq__(self, other):
-        if isinstance(other, self.__class__):
+        if isinstance(other, CardBase):
             if other is not self:
                 return [self.gem, self.level, self.value, self.cost] == \
                        [other.gem, other.level, other.value, other.cost]
@@ -80,35 +193,255 @@ class Card:
             return False
         raise TypeError(f"comparing {self.__class__} to {other.__class__} has no meaning in this context")
 
-    @property
-    def color_id(self):
-        return self.COLOR_IDS[self.gem][1]
 
-    def can_be_bought(self, other):
-        """
-        for simplicity, invoking counterpart method from 'Player' class
-        """
-        if isinstance(other, Player):
-            return other.can_buy(self)
-        raise ValueError(f"can't compare object {other.__class__} to Card meaningfully")
+class FrozenCard(CardBase):
+    """
+    immutable flyweight of a catalog card; there is exactly one instance per catalog id, so equality
+    is identity and the id doubles as the hash and as the position of the card's bit in card bitmasks
+    """
+    __slots__ = ('id', 'gem', 'value', 'level', 'cost', 'color_id', 'bit', 'packed_cost')
+    printing_rules = 'e'
 
-    def print_short(self):
-        p_r = self.printing_rules
-        self.printing_rules = None
-        s = str(self)
-        self.printing_rules = p_r
-        return s
+    def __init__(self, card_id: int, gem: str, value: int, level: int, cost: Tuple[int, ...]):
+        for name, val in zip(self.__slots__, (card_id, gem, value, level, tuple(cost),
+                                              self.COLOR_IDS[gem][1], 1 << card_id, pack_gems(cost))):
+            object.__setattr__(self, name, val)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, item):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __eq__(self, other):
+        if other is self:
+            return True
+        if isinstance(other, FrozenCard) or other is None:
+            return False
+        # comparing with regular 'Card' falls back to its content comparison
+        return NotImplemented
+
+    def __hash__(self):
+        return self.id
+
+    def __repr__(self):
+        return f"FrozenCard({self.id}, {self.gem!r}, {self.value}, {self.level}, {self.cost})"
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return _catalog_frozen_card, (self.id,)
+
+
+def _catalog_frozen_card(card_id: int) -> FrozenCard:
+    return CardCatalog.get().cards[card_id]
+
+
+class CardList(list):
+    """
+    list of cards owned by the player, that keeps running count of cards per color id as they are
+    added or removed; thanks to this 'Player' never has to walk the whole collection to know its power
+    """
+    __slots__ = ('counts', 'packed', 'points')
+
+    def __init__(self, cards=()):
+        super().__init__(cards)
+        self._recount()
+
+    def __reduce_ex__(self, protocol):
+        # counts are rebuilt from the cards, copying them together with the items would double them
+        return self.__class__, (list(self),)
+
+    def copy(self) -> "CardList":
+        # counts are taken over as they are instead of being counted again
+        copied = self.__class__.__new__(self.__class__)
+        list.extend(copied, self)
+        copied.counts = self.counts[:]
+        copied.packed = self.packed
+        copied.points = self.points
+        return copied
+
+    def _recount(self):
+        self.counts = [0] * 6
+        self.packed = 0
+        self.points = 0
+        for card in self:
+            self._add(card)
+
+    def _add(self, card):
+        self.counts[card.color_id] += 1
+        self.packed += LANE_UNITS[card.color_id]
+        self.points += card.value
+
+    def _drop(self, card):
+        self.counts[card.color_id] -= 1
+        self.packed -= LANE_UNITS[card.color_id]
+        self.points -= card.value
+
+    def append(self, card):
+        super().append(card)
+        self._add(card)
+
+    def insert(self, index, card):
+        super().insert(index, card)
+        self._add(card)
+
+    def extend(self, cards):
+        cards = list(cards)
+        super().extend(cards)
+        for card in cards:
+            self._add(card)
+
+    def __iadd__(self, cards):
+        self.extend(cards)
+        return self
+
+    def __imul__(self, times):
+        super().__imul__(times)
+        self._recount()
+        return self
+
+    def pop(self, index=-1):
+        card = super().pop(index)
+        self._drop(card)
+        return card
+
+    def remove(self, card):
+        super().remove(card)
+        self._drop(card)
+
+    def clear(self):
+        super().clear()
+        self._recount()
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._recount()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._recount()
+
+
+class Strategy:
+    """
+    decision maker behind a player - 'Player.select_card' and 'Game.player_select' ask it for a position
+    of a card, and the turn loop asks it for a whole action (id from 'Action'); bots answer in-process,
+    without any I/O, so subclasses override only the decisions they take part in
+    """
+    # how much the bot values keeping one token of each color (gold last) when it pays for a card,
+    # see 'Player.best_payment'; None pays with as few gold tokens as possible
+    payment_weights: Optional[Sequence[float]] = None
+
+    def select_position(self, player: "Player", open_cards: List[List[Optional[Card]]],
+                        deck_sizes: List[int]) -> Tuple[int, int]:
+        raise NotImplementedError(f"{self.__class__.__name__} doesn't select cards")
+
+    def choose_action(self, game: "Game", p_id: int) -> int:
+        raise NotImplementedError(f"{self.__class__.__name__} doesn't choose actions")
+
+
+class AsyncStrategy:
+    """
+    asynchronous counterpart of 'Strategy', for decisions that arrive from the outside (e.g. over network);
+    waiting for them suspends only the game that waits, not the whole thread
+    """
+
+    async def select_position(self, player: "Player", open_cards: List[List[Optional[Card]]],
+                              deck_sizes: List[int]) -> Tuple[int, int]:
+        raise NotImplementedError(f"{self.__class__.__name__} doesn't select cards")
+
+    async def choose_action(self, game: "Game", p_id: int) -> int:
+        raise NotImplementedError(f"{self.__class__.__name__} doesn't choose actions")
+
+
+class ConsoleStrategy(Strategy):
+    """
+    human player at the terminal, typing the row and the card with 'input()'
+    """
+
+    def select_position(self, player: "Player", open_cards: List[List[Optional[Card]]],
+                        deck_sizes: List[int]) -> Tuple[int, int]:
+        return player.provide_position()
+
+    def choose_action(self, game: "Game", p_id: int) -> int:
+        legal = game.legal_actions(p_id)
+        for action in legal:
+            kind, args = Action.decode(action)
+            print(f"{action:>3}: {kind} {' '.join(map(str, args))}")
+        while True:
+            try:
+                action = int(input(f"player {p_id}, choose action"))
+            except ValueError:
+                print("couldn't convert input into integer number, try again")
+                continue
+            if action in legal:
+                return action
+            print(f"{action} isn't one of the listed actions, try again")
+
+
+class RandomStrategy(Strategy):
+    """
+    bot picking uniformly at random among the legal options, seeded for reproducible games
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.rng = Random(seed)
+
+    def select_position(self, player: "Player", open_cards: List[List[Optional[Card]]],
+                        deck_sizes: List[int]) -> Tuple[int, int]:
+        positions = [(row, slot) for row in range(3) for slot in range(4) if open_cards[row][slot] is not None]
+        positions += [(row, 4) for row in range(3) if deck_sizes[row] > 0]
+        positions += [(slot, 5) for slot, card in enumerate(player.reserved) if card is not None]
+        if not positions:
+            raise GameError("there is no card to select")
+        return self.rng.choice(positions)
+
+    def choose_action(self, game: "Game", p_id: int) -> int:
+        return self.rng.choice(game.legal_actions(p_id))
+
+
+CONSOLE = ConsoleStrategy()
 
 
 class Player:
 
-    def __init__(self, p_id: int):
+    def __init__(self, p_id: int, strategy: Union[Strategy, AsyncStrategy, None] = None, verbose: bool = True):
         if not isinstance(p_id, int):
             raise ValueError(f'id of the player should be of class int, not {p_id.__class__}')
         self.id = p_id
         self.tokens = [0] * 6
-        self.cards = []
+        self.cards = CardList()
         self.reserved = (None, None, None,)
+        # catalog ids of the cards reserved from the top of a deck - the ones still in 'reserved'
+        # are hidden from the other players
+        self.blind = frozenset()
+        self.strategy = strategy if strategy is not None else CONSOLE
+        self.verbose = verbose
+
+    @property
+    def cards(self) -> CardList:
+        return self._cards
+
+    @cards.setter
+    def cards(self, cards: List[Card]):
+        # 'player.cards += [...]' assigns the very same collection back, no need to count it again
+        self._cards = cards if isinstance(cards, CardList) else CardList(cards)
+
+    def clone(self) -> "Player":
+        """
+        copy sharing the cards and the strategy, only tokens and the card collection are new
+        ('reserved' and 'blind' are immutable, they are replaced rather than changed)
+        """
+        player = Player.__new__(Player)
+        player.__dict__.update(self.__dict__)
+        player.tokens = self.tokens[:]
+        player._cards = self._cards.copy()
+        return player
 
     @staticmethod
     def provide_position() -> Tuple[int, int]:
@@ -127,19 +460,31 @@ class Player:
 
     @property
     def buying_power(self):
-        # this avoids deepcopy
-        power = [_ for _ in self.tokens]
-        for card in self.cards:
-            power[card.color_id] += 1
-        return power
+        # fresh list every time, so the callers can't overwrite tokens nor counts
+        return [tokens + owned for tokens, owned in zip(self.tokens, self._cards.counts)]
 
     @property
     def card_power(self):
-        power = [0] * 5
-        for card in self.cards:
-            if card.color_id != 5:
-                power[card.color_id] += 1
-        return power
+        return self._cards.counts[:5]
+
+    @property
+    def hidden(self) -> List[Tuple[int, Card]]:
+        """
+        (slot, card) of the reserved cards the other players don't know
+        """
+        return [(slot, card) for slot, card in enumerate(self.reserved)
+                if card is not None and card.id in self.blind]
+
+    @property
+    def points(self) -> int:
+        return self._cards.points
+
+    @property
+    def packed_buying_power(self) -> int:
+        """
+        tokens and cards of regular gems packed into lanes, see 'pack_gems'
+        """
+        return pack_gems(self.tokens) + self._cards.packed
 
     def check_selection(self, open_cards: List[List[Card]], deck_sizes: List[int], desired_card: tuple):
         if not (desired_card[0] in [0, 1, 2]) or not(desired_card[1] in [0, 1, 2, 3, 4, 5]):
@@ -166,7 +511,7 @@ class Player:
             except IndexError:
                 raise GameError("you haven't yet reserved a card")
 
-    def can_buy(self, other: Card) -> Tuple[bool, int]:
+    def can_buy(self, other: CardBase) -> Tuple[bool, int]:
         """
         this is used to calculate if a player can afford to buy a specific card most of the time
         first we calculate if player has enough combined regular tokens + card equivalents
@@ -176,7 +521,7 @@ class Player:
         :return: True if greater or equal, or not if there's not enough resources, and the nr of wildcards
         """
         # guard statements
-        if not isinstance(other, Card):
+        if not isinstance(other, CardBase):
             if isinstance(other, Player):
                 raise NotImplementedError("comparison between players isn't implemented yet")
             raise ValueError(f"can't compare object {other.__class__} to Player meaningfully")
@@ -184,12 +529,7 @@ class Player:
             raise GameError("can't buy aristocrat card! Aristocrats can only be invited")
         # compute the difference of the player 'buy-power' against card cost,
         # leave values only for tokens that matter
-        cids = Card.COLOR_IDS
-        difference = [
-            self.buying_power[cids[c_code][1]] - other.cost[cids[c_code][1]]
-            for c_code in Card.COLOR_CODES[:5]
-        ]
-        lacking = -sum([0 if d >= 0 else d for d in difference])
+        lacking = packed_deficit(self.packed_buying_power, other.packed_cost)
         if lacking > self.tokens[5]:
             return False, lacking
         return True, lacking
@@ -197,35 +537,90 @@ class Player:
     def get_token(self, color: int):
         self.tokens[color] += 1
 
-    def pay_tokens(self, debt: Tuple[bool, int], card: Card) -> List[int]:
+    def pay_tokens(self, debt: Tuple[bool, int], card: Card, payment: Optional[Sequence[int]] = None) -> List[int]:
+        """
+        :param payment: tokens of every color (gold last) to pay with, e.g. from 'best_payment'; by default
+            as many regular tokens as possible are paid and gold covers the rest
+        """
         if card.level == 0:
             raise GameError("aristocrat Card should not appear here")
-        to_pay = [
-                     min(tokens, max(cost - cs, 0)) if cost > 0 else 0
-                     for tokens, cs, cost in zip(self.tokens, self.card_power, card.cost)
-                 ] + [debt[1]]
+        if payment is None:
+            to_pay = [
+                         min(tokens, max(cost - cs, 0)) if cost > 0 else 0
+                         for tokens, cs, cost in zip(self.tokens, self._cards.counts, card.cost)
+                     ] + [debt[1]]
+        else:
+            to_pay = list(payment)
+            self.check_payment(card, to_pay)
         self.tokens = [tokens - pay_amount for tokens, pay_amount in zip(self.tokens, to_pay)]
         return to_pay
 
+    def payment_need(self, card: CardBase) -> List[int]:
+        """
+        :return: tokens of every regular color the card still takes after the discount from owned cards
+        """
+        return [max(cost - cs, 0) for cost, cs in zip(card.cost, self._cards.counts)]
+
+    def check_payment(self, card: CardBase, payment: Sequence[int]):
+        need = self.payment_need(card)
+        if len(payment) != 6 or any(paid < 0 or paid > tokens for paid, tokens in zip(payment, self.tokens)) or \
+                any(paid > n for paid, n in zip(payment, need)) or sum(need) - sum(payment[:5]) != payment[5]:
+            raise GameError(f"{list(payment)} isn't a proper payment for the card")
+
+    def payments(self, card: CardBase) -> Iterator[List[int]]:
+        """
+        every legal way to pay for the card - regular tokens of each color, from as many as possible down to none,
+        with gold covering the rest
+        """
+        need = self.payment_need(card)
+        total, gold = sum(need), self.tokens[5]
+        for regular in product(*[range(min(n, tokens), -1, -1) for n, tokens in zip(need, self.tokens)]):
+            if total - sum(regular) <= gold:
+                yield list(regular) + [total - sum(regular)]
+
+    def best_payment(self, card: CardBase, weights: Optional[Sequence[float]] = None) -> Optional[List[int]]:
+        """
+        the cheapest payment for the card, None if it can't be bought
+        :param weights: how much the player values keeping one token of each color (gold last); gold is
+            spent instead of a regular token wherever that token is worth more than gold - the same
+            as going over 'payments', but in one pass. By default gold is spent only when it has to be
+        """
+        need = self.payment_need(card)
+        paid = [min(n, tokens) for n, tokens in zip(need, self.tokens)]
+        gold = sum(need) - sum(paid)
+        if gold > self.tokens[5]:
+            return None
+        if weights is not None:
+            budget = self.tokens[5] - gold
+            for color in sorted(range(5), key=lambda c: weights[c], reverse=True):
+                if budget == 0 or weights[color] <= weights[5]:
+                    break
+                swap = min(budget, paid[color])
+                paid[color] -= swap
+                gold += swap
+                budget -= swap
+        return paid + [gold]
+
     def pay_token(self, color: int):
         if self.tokens[color] == 0:
             raise GameError("can't pay more, we have 0 tokens")
         self.tokens[color] -= 1
 
-    def buy_card(self, card: Card):
+    def buy_card(self, card: Card, payment: Optional[Sequence[int]] = None):
         if (cmp := self.can_buy(card))[0]:
+            # paying first, so the card being bought does not discount itself
+            paid = self.pay_tokens(cmp, card, payment)
             self.cards.append(card)
-            paid = self.pay_tokens(cmp, card)
             return True, paid
         return False, [0] * 6
 
-    def buy_reserve(self, desired_card: int):
+    def buy_reserve(self, desired_card: int, payment: Optional[Sequence[int]] = None):
         try:
             if (cmp := self.can_buy(card := self.reserved[desired_card]))[0]:
+                paid = self.pay_tokens(cmp, card, payment)
                 self.cards.append(self.reserved[desired_card])
                 r = [c for index, c in enumerate(self.reserved) if index != desired_card] + [None]
                 self.reserved = tuple(r)
-                paid = self.pay_tokens(cmp, card)
                 return True, paid
         except ValueError as ve:
             if self.reserved[desired_card] is None:
@@ -244,19 +639,25 @@ class Player:
             raise GameError("Can't reserve more than 3 cards, buy the reserved card out to free space")
 
     def select_card(self, open_cards: List[List[Card]], deck_sizes: List[int]) -> Tuple[int, int]:
-        desired_card = self.provide_position()
+        if isinstance(self.strategy, AsyncStrategy):
+            raise GameError("asynchronous strategy has to be asked with 'select_card_async'")
+        desired_card = self.strategy.select_position(self, open_cards, deck_sizes)
         # function call serving as guard statement
         self.check_selection(open_cards, deck_sizes, desired_card)
         return desired_card
 
-    def can_invite(self, card: Card):
-        if isinstance(card, Card):
+    async def select_card_async(self, open_cards: List[List[Card]], deck_sizes: List[int]) -> Tuple[int, int]:
+        if isinstance(self.strategy, AsyncStrategy):
+            desired_card = await self.strategy.select_position(self, open_cards, deck_sizes)
+        else:
+            desired_card = self.strategy.select_position(self, open_cards, deck_sizes)
+        self.check_selection(open_cards, deck_sizes, desired_card)
+        return desired_card
+
+    def can_invite(self, card: CardBase):
+        if isinstance(card, CardBase):
             if card.level == 0:
-                diff = [cp - cost for cp, cost in zip(self.card_power, card.cost)]
-                fulfilled_requirements = [True if d >= 0 else False for d in diff]
-                if all(fulfilled_requirements):
-                    return True
-                return False
+                return packed_covers(self._cards.packed, card.packed_cost)
             raise GameError("this is not aristocrat card!")
         elif card is None:
             return False
@@ -264,17 +665,235 @@ class Player:
 
     def invite(self, card: Card):
         if self.can_invite(card):
-            print("can invite")
-            print("inviting:\n", card)
+            if self.verbose:
+                print("can invite")
+                print("inviting:\n", card)
             self.cards.append(card)
             return card
 
 
+class CardCatalog:
+    """
+    immutable set of all the cards from the card file, parsed once per process and shared by every game;
+    decks of the game only hold references to its cards - 'FrozenCard' flyweights, so the cards every game
+    shares can't be changed by any of them - and 'id' of every card is its position in the file
+
+    parsed file can be stored in binary cache next to it, which is keyed by the hash of the source file
+    and read back through mmap, so other processes skip parsing altogether
+    """
+    CACHE_MAGIC = b"SPLC"
+    CACHE_HEADER = struct.Struct("<4s32sH")
+    # color index, power, points, level, 5 costs
+    CACHE_RECORD = struct.Struct("<9b")
+    _catalogs: Dict[str, "CardCatalog"] = {}
+
+    def __init__(self, entries: List[list], trusted: bool = False):
+        """
+        :param trusted: entries were already validated (e.g. they come from the cache), so they aren't
+            checked by building 'Card' from them first
+        """
+        self.entries = tuple(tuple(entry) for entry in entries)
+        if not trusted:
+            for entry in self.entries:
+                Card(list(entry))
+        self.cards: Tuple[FrozenCard, ...] = tuple(
+            FrozenCard(card_id, entry[0], entry[2], entry[3], entry[4:]) for card_id, entry in enumerate(self.entries)
+        )
+        self.tiers: Tuple[Tuple[int, ...], ...] = tuple(
+            tuple(tier) for tier in Game.dek_tiers(list(range(len(self.entries))))
+        )
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __getitem__(self, card_id: int) -> "FrozenCard":
+        return self.cards[card_id]
+
+    @classmethod
+    def get(cls, file: str = CARDS_FILE, cache_file: Optional[str] = None) -> "CardCatalog":
+        """
+        returns catalog of the given card file, parsing it (or reading the cache) only the first time
+        """
+        key = path.abspath(file)
+        if key not in cls._catalogs:
+            if cache_file is None:
+                cls._catalogs[key] = cls(Game.load_cards(file))
+            else:
+                cls._catalogs[key] = cls(cls._cached_entries(file, cache_file), trusted=True)
+        return cls._catalogs[key]
+
+    @classmethod
+    def _cached_entries(cls, file: str, cache_file: str) -> List[list]:
+        with open(file, "rb") as source:
+            digest = hashlib.sha256(source.read()).digest()
+        with suppress(OSError, ValueError, struct.error):
+            with open(cache_file, "rb") as cache, mmap.mmap(cache.fileno(), 0, access=mmap.ACCESS_READ) as mem:
+                magic, cached_digest, count = cls.CACHE_HEADER.unpack_from(mem, 0)
+                if magic == cls.CACHE_MAGIC and cached_digest == digest:
+                    records = cls.CACHE_RECORD.iter_unpack(
+                        mem[cls.CACHE_HEADER.size:cls.CACHE_HEADER.size + count * cls.CACHE_RECORD.size])
+                    return [[Card.COLOR_CODES[record[0]]] + list(record[1:]) for record in records]
+        entries = Game.load_cards(file)
+        # only validated entries get to the cache, cards read back from it are built without checks
+        for entry in entries:
+            Card(list(entry))
+        cls._write_cache(cache_file, digest, entries)
+        return entries
+
+    @classmethod
+    def _write_cache(cls, cache_file: str, digest: bytes, entries: List[list]):
+        temporary = cache_file + ".tmp"
+        with open(temporary, "wb") as cache:
+            cache.write(cls.CACHE_HEADER.pack(cls.CACHE_MAGIC, digest, len(entries)))
+            for entry in entries:
+                cache.write(cls.CACHE_RECORD.pack(Card.COLOR_IDS[entry[0]][1], *entry[1:]))
+        # other processes either see the old cache or the complete new one
+        replace(temporary, cache_file)
+
+
+class Action:
+    """
+    fixed integer action space - every decision a player can take on their turn has its own id,
+    grouped in consecutive blocks:
+     - drawing different colors, all 3-color sets first, then 2-color sets and single colors
+     - drawing 2 tokens of the same color, one per color
+     - buying open card, 'row * 4 + slot'
+     - buying card from the reserve, one per reserve slot
+     - reserving open card, 'row * 4 + slot'
+     - reserving top of the deck, one per row
+     - returning a token to the bank, one per color, when player ends the turn holding more than 10 tokens
+     - passing, when there is nothing else to do
+    """
+    DRAW_COLORS: Tuple[Tuple[int, ...], ...] = tuple(
+        colors for size in (3, 2, 1) for colors in combinations(range(5), size)
+    )
+    DRAW_IDS: Dict[Tuple[int, ...], int] = {colors: a_id for a_id, colors in enumerate(DRAW_COLORS)}
+    DRAW = 0
+    DRAW_2_SAME = len(DRAW_COLORS)
+    BUY = DRAW_2_SAME + 5
+    BUY_RESERVED = BUY + 12
+    RESERVE = BUY_RESERVED + 3
+    RESERVE_DECK = RESERVE + 12
+    RETURN_TOKEN = RESERVE_DECK + 3
+    PASS = RETURN_TOKEN + 6
+    COUNT = PASS + 1
+
+    @classmethod
+    def decode(cls, action: int) -> Tuple[str, tuple]:
+        """
+        translates action id into the name of the move and arguments in the form 'Game' methods take them;
+        positions are '(row, slot)' pairs the same as in 'Player.select_card'
+        """
+        if not 0 <= action < cls.COUNT:
+            raise GameError(f"action {action} is out of action space")
+        if action < cls.DRAW_2_SAME:
+            return "draw", cls.DRAW_COLORS[action]
+        if action < cls.BUY:
+            return "draw_2_same", (action - cls.DRAW_2_SAME,)
+        if action < cls.BUY_RESERVED:
+            return "buy", divmod(action - cls.BUY, 4)
+        if action < cls.RESERVE:
+            return "buy", (action - cls.BUY_RESERVED, 5)
+        if action < cls.RESERVE_DECK:
+            return "reserve", divmod(action - cls.RESERVE, 4)
+        if action < cls.RETURN_TOKEN:
+            return "reserve", (action - cls.RESERVE_DECK, 4)
+        if action < cls.PASS:
+            return "return", (action - cls.RETURN_TOKEN,)
+        return "pass", ()
+
+    @classmethod
+    def encode(cls, kind: str, args: Sequence[int] = ()) -> int:
+        """
+        reverse of 'decode'
+        """
+        try:
+            if kind == "draw":
+                return cls.DRAW_IDS[tuple(sorted(args))]
+            if kind == "pass":
+                return cls.PASS
+            if kind in ("draw_2_same", "return"):
+                (color,) = args
+                if 0 <= color < (5 if kind == "draw_2_same" else 6):
+                    return (cls.DRAW_2_SAME if kind == "draw_2_same" else cls.RETURN_TOKEN) + color
+            if kind in ("buy", "reserve"):
+                row, slot = args
+                if 0 <= row < 3 and 0 <= slot < 4:
+                    return (cls.BUY if kind == "buy" else cls.RESERVE) + row * 4 + slot
+                if kind == "buy" and slot == 5 and 0 <= row < 3:
+                    return cls.BUY_RESERVED + row
+                if kind == "reserve" and slot == 4 and 0 <= row < 3:
+                    return cls.RESERVE_DECK + row
+        except (KeyError, TypeError, ValueError):
+            pass
+        raise GameError(f"there is no {kind} {tuple(args)} action")
+
+    @staticmethod
+    def from_mask(mask: int) -> List[int]:
+        actions = []
+        while mask:
+            lowest = mask & -mask
+            actions.append(lowest.bit_length() - 1)
+            mask ^= lowest
+        return actions
+
+
+class ZobristKeys:
+    """
+    random 64-bit keys for every (feature, value) of the game state; hash of the state is xor of keys of its
+    features, so every change of the state updates the hash with a couple of xors. keys come from fixed seed,
+    which makes the hashes comparable between games and processes
+    """
+    TOKEN_COUNTS = 32
+    MAX_CARDS = 256
+    MAX_PLAYERS = 4
+
+    def __init__(self, seed: int = 0x5B1E4D0F):
+        rng = Random(seed)
+
+        def keys(*dims):
+            if len(dims) == 1:
+                return [rng.getrandbits(64) for _ in range(dims[0])]
+            return [keys(*dims[1:]) for _ in range(dims[0])]
+        self.bank = keys(6, self.TOKEN_COUNTS)
+        self.tokens = keys(self.MAX_PLAYERS, 6, self.TOKEN_COUNTS)
+        self.owned = keys(self.MAX_PLAYERS, self.MAX_CARDS)
+        self.reserved = keys(self.MAX_PLAYERS, 3, self.MAX_CARDS)
+        # rows of open cards and the nobles' row
+        self.open = keys(4, 5, self.MAX_CARDS)
+        self.to_move = keys(self.MAX_PLAYERS)
+        # reserved card seen only from the back (its level) - not part of 'Game.zobrist', it's there for
+        # hashing what the other players know, see 'ismcts'
+        self.hidden = keys(self.MAX_PLAYERS, 3, 4)
+
+
+ZOBRIST = ZobristKeys()
+TOKEN_KEY_MASK = ZobristKeys.TOKEN_COUNTS - 1
+
+
 class Game:
-    def __init__(self, player_count: int):
+    WINNING_POINTS = 15
+    TOKEN_LIMIT = 10
+    # snapshot: header, bank, then per player tokens, reserved ids, bits of reserved slots taken from the deck
+    # (since version 2), owned count and ids; deck sizes and ids, open cards (3 rows of 4) and nobles on the table;
+    # every card id is one byte, NO_CARD marks empty slot. since version 3 Zobrist hash follows the header,
+    # so restored game doesn't have to be hashed again
+    SNAPSHOT_MAGIC = b"SPLS"
+    SNAPSHOT_HEADER = struct.Struct("<4sBBBBBQ")
+    SNAPSHOT_HASH = struct.Struct("<Q")
+    SNAPSHOT_VERSION = 3
+    NO_CARD = 0xFF
+
+    def __init__(self, player_count: int, verbose: bool = True, seed: Optional[int] = None):
         if not (1 < player_count < 5):
             raise GameError("cant start game with improper number of players")
         self.player_count = player_count
+        # every game owns its RNG, the same seed deals the same game again; game without seed draws one,
+        # so that every game can be replayed and saved
+        self.seed = seed if seed is not None else getrandbits(64)
+        self._rng: Optional[Random] = None
+        # silent game (verbose=False) doesn't print anything, e.g. when bots play against each other
+        self.verbose = verbose
         self.l1_deck: List[Card] = []
         self.l2_deck: List[Card] = []
         self.l3_deck: List[Card] = []
@@ -282,6 +901,21 @@ class Game:
         self.players: List[Player] = []
         self.tokens: List[int] = []
         self.open_cards: List[List[Optional[Card]]] = []
+        self.current_player = 0
+        self.finished = False
+        # Zobrist hash of the state, kept up to date by every method changing the state
+        self.zobrist = 0
+        # per player affordability of the open and reserved slots, see '_afford_index'
+        self._afford: List[Optional[list]] = []
+        # per player cards missing to every open noble, see '_noble_index'
+        self._noble_needs: List[Optional[list]] = []
+
+    @property
+    def rng(self) -> Random:
+        # made on first use - games restored from snapshots mostly never deal again
+        if self._rng is None:
+            self._rng = Random(self.seed)
+        return self._rng
 
     @staticmethod
     def load_cards(file: str = "cards.txt"):
@@ -298,18 +932,24 @@ class Game:
         return [_cards[:40], _cards[40:70], _cards[70:90], _cards[90:]]
 
     @staticmethod
-    def shuffle_dek(_dek):
-        _d = _dek
-        for i in range(len(_d) * 7):
-            j = randint(0, len(_d) - 1)
-            k = randint(0, len(_d) - 1)
-            if k != j:
-                _d[j], _d[k] = _d[k], _d[j]
-        return _d
+    def shuffle_dek(_dek, rng: Optional[Random] = None):
+        """
+        shuffles the deck in place with single Fisher-Yates pass
+        :param rng: source of randomness, global 'random' module if not given
+        """
+        if rng is None:
+            shuffle(_dek)
+        else:
+            rng.shuffle(_dek)
+        return _dek
 
     @staticmethod
-    def shuffle(_decks):
-        return [Game.shuffle_dek(_d) for _d in _decks]
+    def shuffle(_decks, rng: Optional[Random] = None):
+        return [Game.shuffle_dek(_d, rng) for _d in _decks]
+
+    @property
+    def decks(self) -> Tuple[List[Card], List[Card], List[Card]]:
+        return self.l1_deck, self.l2_deck, self.l3_deck
 
     @property
     def deck_sizes(self):
@@ -324,12 +964,20 @@ class Game:
             return
         self.tokens = [4] * 5 + [5]
 
-    def setup_cards(self):
-        kards = Game.dek_tiers(Game.load_cards())
-        self.l1_deck = [Card(c) for c in kards[0]]
-        self.l2_deck = [Card(c) for c in kards[1]]
-        self.l3_deck = [Card(c) for c in kards[2]]
-        self.nobles = [Card(c) for c in kards[3]]
+    def setup_cards(self, order: Optional[Sequence[Sequence[int]]] = None):
+        """
+        :param order: already shuffled catalog ids of (l1, l2, l3, nobles) - e.g. one game of
+            'batch.deck_permutations', decks are shuffled with game RNG when not given
+        """
+        catalog = CardCatalog.get()
+        cards = catalog.cards
+        if order is None:
+            order = Game.shuffle([list(tier) for tier in catalog.tiers], self.rng)
+        l1, l2, l3, nobles = order
+        self.l1_deck = [cards[i] for i in l1]
+        self.l2_deck = [cards[i] for i in l2]
+        self.l3_deck = [cards[i] for i in l3]
+        self.nobles = [cards[i] for i in nobles]
         self.open_cards = [
             [self.l1_deck.pop() for _ in range(4)],
             [self.l2_deck.pop() for _ in range(4)],
@@ -337,18 +985,206 @@ class Game:
             [self.nobles.pop() for _ in range(self.player_count + 1)],
         ]
 
-    def setup_players(self):
-        self.players = [Player(p_id=i) for i in range(self.player_count)]
+    def setup_players(self, strategies: Optional[List[Union[Strategy, AsyncStrategy]]] = None):
+        if strategies is None:
+            strategies = [None] * self.player_count
+        if len(strategies) != self.player_count:
+            raise GameError("every player needs exactly one strategy")
+        self.players = [Player(p_id=i, strategy=strategy, verbose=self.verbose)
+                        for i, strategy in enumerate(strategies)]
 
-    def full_setup(self):
+    def full_setup(self, strategies: Optional[List[Union[Strategy, AsyncStrategy]]] = None,
+                   order: Optional[Sequence[Sequence[int]]] = None):
         self.setup_tokens()
-        self.setup_cards()
-        self.setup_players()
+        self.setup_cards(order)
+        self.setup_players(strategies)
+        self.current_player = 0
+        self.finished = False
+        self.rehash()
+
+    def to_bytes(self) -> bytes:
+        """
+        compact snapshot of the game state, strategies and RNG state aren't part of it
+        (game restored from snapshot gets fresh RNG from the same seed)
+        """
+        no_card = self.NO_CARD
+        out = bytearray(self.SNAPSHOT_HEADER.pack(
+            self.SNAPSHOT_MAGIC, self.SNAPSHOT_VERSION, self.player_count, self.current_player,
+            self.finished, self.seed is not None, self.snapshot_seed(self.seed)))
+        out += self.SNAPSHOT_HASH.pack(self.zobrist)
+        out += bytes(self.tokens)
+        # card without catalog id has id None, which 'bytes' refuses
+        try:
+            for player in self.players:
+                out += bytes(player.tokens)
+                out += bytes([no_card if card is None else card.id for card in player.reserved])
+                out.append(sum(1 << slot for slot, _ in player.hidden) if player.blind else 0)
+                out.append(len(player.cards))
+                out += bytes([card.id for card in player.cards])
+            for deck in (self.l1_deck, self.l2_deck, self.l3_deck, self.nobles):
+                out.append(len(deck))
+                out += bytes([card.id for card in deck])
+            for row in self.open_cards:
+                out += bytes([no_card if card is None else card.id for card in row])
+        except TypeError:
+            raise GameError("only catalog cards can be saved in snapshot")
+        return bytes(out)
+
+    @staticmethod
+    def snapshot_seed(seed) -> int:
+        """
+        :return: seed in the form the snapshot header keeps it, 0 for no seed
+        :raise GameError: seed isn't unsigned 64-bit integer, so game with it can't be saved
+        """
+        if seed is None:
+            return 0
+        if not isinstance(seed, int) or not 0 <= seed < 2 ** 64:
+            raise GameError(f"game with seed {seed!r} can't be saved, snapshot keeps unsigned 64-bit seeds only")
+        return seed
+
+    @classmethod
+    def from_bytes(cls, data: bytes, strategies: Optional[List[Union[Strategy, AsyncStrategy]]] = None,
+                   verbose: bool = True) -> "Game":
+        """
+        restores game saved with 'to_bytes', sharing catalog cards the same way 'setup_cards' does
+        :raise GameError: data isn't whole snapshot - wrong magic or version, cut short, unknown card
+            ids or anything left over after the last section
+        """
+        header = cls.SNAPSHOT_HEADER
+        size = len(data)
+        if size < header.size:
+            raise GameError("not a game snapshot")
+        magic, version, player_count, current_player, finished, has_seed, seed = header.unpack_from(data)
+        if magic != cls.SNAPSHOT_MAGIC or not 0 < version <= cls.SNAPSHOT_VERSION:
+            raise GameError("not a game snapshot")
+        cards = CardCatalog.get().cards
+        no_card = cls.NO_CARD
+        p = header.size
+        zobrist = None
+        if version > 2:
+            if size < p + cls.SNAPSHOT_HASH.size:
+                raise GameError("snapshot is cut short")
+            zobrist = cls.SNAPSHOT_HASH.unpack_from(data, p)[0]
+            p += cls.SNAPSHOT_HASH.size
+        game = cls(player_count, verbose, seed if has_seed else None)
+        if not 0 <= current_player < player_count:
+            raise GameError("snapshot of a game with player out of the game on the move")
+        game.setup_players(strategies)
+        # sections are read without checking every slice - short slice still moves 'p' by the whole section,
+        # so snapshot cut short either fails on reading a count or ends up with 'p' past its end
+        try:
+            game.tokens = list(data[p:p + 6])
+            p += 6
+            for player in game.players:
+                player.tokens = list(data[p:p + 6])
+                player.reserved = tuple([None if i == no_card else cards[i] for i in data[p + 6:p + 9]])
+                p += 9
+                if version > 1:
+                    hidden = data[p]
+                    p += 1
+                    if hidden:
+                        player.blind = frozenset(card.id for slot, card in enumerate(player.reserved)
+                                                 if hidden >> slot & 1 and card is not None)
+                count = data[p] + 1
+                player.cards = [None if i == no_card else cards[i] for i in data[p + 1:p + count]]
+                p += count
+            decks = []
+            for _ in range(4):
+                count = data[p] + 1
+                decks.append([None if i == no_card else cards[i] for i in data[p + 1:p + count]])
+                p += count
+            game.l1_deck, game.l2_deck, game.l3_deck, game.nobles = decks
+            game.open_cards = [[None if i == no_card else cards[i] for i in data[start:start + count]]
+                               for start, count in ((p, 4), (p + 4, 4), (p + 8, 4), (p + 12, player_count + 1))]
+            p += 13 + player_count
+        except IndexError:
+            raise GameError("snapshot is cut short or holds card that isn't in the catalog")
+        if p != size:
+            raise GameError("snapshot is cut short" if p > size else f"snapshot has {size - p} bytes left over")
+        game.current_player = current_player
+        game.finished = bool(finished)
+        if zobrist is None:
+            game.rehash()
+        else:
+            game.zobrist = zobrist
+        return game
+
+    def clone(self) -> "Game":
+        """
+        fast copy for search and simulations - cards are shared (the game never changes them) and only
+        the containers holding the state are copied, together with the warm affordability/noble indexes;
+        strategies and the RNG are shared as well, so clone shouldn't be dealt again with 'full_setup'
+        """
+        game = Game.__new__(Game)
+        game.__dict__.update(self.__dict__)
+        game.tokens = self.tokens[:]
+        game.l1_deck = self.l1_deck[:]
+        game.l2_deck = self.l2_deck[:]
+        game.l3_deck = self.l3_deck[:]
+        game.nobles = self.nobles[:]
+        game.open_cards = [row[:] for row in self.open_cards]
+        game.players = [player.clone() for player in self.players]
+        game._afford = [None if index is None else [index[0], index[1], index[2][:], index[3][:], index[4]]
+                        for index in self._afford]
+        game._noble_needs = [None if index is None else [index[0], index[1][:], index[2][:]]
+                             for index in self._noble_needs]
+        return game
+
+    def rehash(self) -> int:
+        """
+        computes Zobrist hash of the whole state from scratch - needed only after changing the state
+        by hand, the game methods keep it updated as they go; cards without catalog id aren't hashed
+        """
+        z = ZOBRIST
+        h = z.to_move[self.current_player]
+        for color, count in enumerate(self.tokens):
+            h ^= z.bank[color][count & TOKEN_KEY_MASK]
+        for p_id, player in enumerate(self.players):
+            for color, count in enumerate(player.tokens):
+                h ^= z.tokens[p_id][color][count & TOKEN_KEY_MASK]
+            for card in player.cards:
+                if card.id is not None:
+                    h ^= z.owned[p_id][card.id]
+            for slot, card in enumerate(player.reserved):
+                if card is not None and card.id is not None:
+                    h ^= z.reserved[p_id][slot][card.id]
+        for row, cards in enumerate(self.open_cards):
+            for index, card in enumerate(cards):
+                if card is not None and card.id is not None:
+                    h ^= z.open[row][index][card.id]
+        self.zobrist = h
+        return h
+
+    def _hash_tokens(self, color: int, p_id: int, in_bank: int, owned: int, amount: int):
+        # 'amount' tokens of the color move from the bank to the player (negative - other way),
+        # 'in_bank' and 'owned' are the counts from before the move
+        bank = ZOBRIST.bank[color]
+        tokens = ZOBRIST.tokens[p_id][color]
+        self.zobrist ^= bank[in_bank & TOKEN_KEY_MASK] ^ bank[(in_bank - amount) & TOKEN_KEY_MASK] ^ \
+            tokens[owned & TOKEN_KEY_MASK] ^ tokens[(owned + amount) & TOKEN_KEY_MASK]
+
+    def _hash_reserved(self, p_id: int, before: tuple, after: tuple):
+        keys = ZOBRIST.reserved[p_id]
+        for slot, card in enumerate(before):
+            if card is not None and card.id is not None:
+                self.zobrist ^= keys[slot][card.id]
+        for slot, card in enumerate(after):
+            if card is not None and card.id is not None:
+                self.zobrist ^= keys[slot][card.id]
+
+    def _hash_open(self, row: int, index: int, card: Optional[Card]):
+        if card is not None and card.id is not None:
+            self.zobrist ^= ZOBRIST.open[row][index][card.id]
+
+    def _hash_owned(self, p_id: int, card: Card):
+        if card.id is not None:
+            self.zobrist ^= ZOBRIST.owned[p_id][card.id]
 
     def give_token(self, color: int, p_id: int):
         if not 0 <= color <= 5:
             raise GameError('color does not exist')
         if self.tokens[color] > 0:
+            self._hash_tokens(color, p_id, self.tokens[color], self.players[p_id].tokens[color], 1)
             self.tokens[color] -= 1
             self.players[p_id].get_token(color)
             return
@@ -358,12 +1194,17 @@ class Game:
         if not 0 <= color <= 5:
             raise GameError('color does not exist')
         if self.players[p_id].tokens[color] > 0:
+            self._hash_tokens(color, p_id, self.tokens[color], self.players[p_id].tokens[color], -1)
             self.tokens[color] += 1
             self.players[p_id].pay_token(color)
             return
         raise GameError("can't take tokens when player has none")
 
-    def replace_empty(self):
+    def replace_empty(self) -> List[Tuple[int, int]]:
+        """
+        :return: positions that got new card, in the order they were filled
+        """
+        filled = []
         for deck, row in enumerate(self.open_cards):
             for index, slot in enumerate(row):
                 if not slot:
@@ -376,6 +1217,94 @@ class Game:
                             self.open_cards[deck][index] = self.l2_deck.pop()
                         elif deck == 2:
                             self.open_cards[deck][index] = self.l3_deck.pop()
+                        else:
+                            continue
+                        self._hash_open(deck, index, self.open_cards[deck][index])
+                        filled.append((deck, index))
+        return filled
+
+    def legal_mask(self, p_id: int) -> int:
+        """
+        bitmask of legal actions of the player, bit number is the action id from 'Action'; checks are done
+        directly on the state, so nothing is raised nor changed along the way
+        """
+        if self.finished:
+            return 0
+        player = self.players[p_id]
+        if sum(player.tokens) > self.TOKEN_LIMIT:
+            # turn can't end before returning the tokens over the limit
+            return sum(1 << (Action.RETURN_TOKEN + color) for color, count in enumerate(player.tokens) if count)
+        mask = 0
+        bank = self.tokens
+        available = tuple(color for color in range(5) if bank[color] > 0)
+        if len(available) >= 3:
+            for colors in combinations(available, 3):
+                mask |= 1 << Action.DRAW_IDS[colors]
+        elif available:
+            # less than 3 different colors can be drawn only if there is nothing more to choose from
+            mask |= 1 << Action.DRAW_IDS[available]
+        for color in range(5):
+            if bank[color] > 2:
+                mask |= 1 << (Action.DRAW_2_SAME + color)
+        mask |= self._afford_index(p_id)[4]
+        if None in player.reserved:
+            for row, deck in enumerate(self.decks):
+                for slot, card in enumerate(self.open_cards[row]):
+                    if card is not None:
+                        mask |= 1 << (Action.RESERVE + row * 4 + slot)
+                if deck:
+                    mask |= 1 << (Action.RESERVE_DECK + row)
+        return mask or 1 << Action.PASS
+
+    def _afford_index(self, p_id: int) -> list:
+        """
+        affordability of the 12 open and 3 reserved slots for the player, as
+        [packed buying power, gold, card of every slot, gold missing for every slot (-1 empty), buy action bits];
+        whole index is recomputed only after the player's tokens or cards changed, otherwise just the slots
+        holding other card than the one they were computed for (e.g. filled by 'replace_empty')
+        """
+        if len(self._afford) != len(self.players):
+            self._afford = [None] * len(self.players)
+        player = self.players[p_id]
+        power = player.packed_buying_power
+        gold = player.tokens[5]
+        index = self._afford[p_id]
+        if index is None or index[0] != power or index[1] != gold:
+            index = self._afford[p_id] = [power, gold, [None] * 15, [-1] * 15, 0]
+        cards, deficits, mask = index[2], index[3], index[4]
+        open_cards = self.open_cards
+        for i, card in enumerate(chain(open_cards[0], open_cards[1], open_cards[2], player.reserved)):
+            if card is cards[i]:
+                continue
+            cards[i] = card
+            # buy actions of open slots and reserve slots are consecutive, 'Action.BUY_RESERVED' follows the open ones
+            bit = 1 << (Action.BUY + i)
+            if card is None:
+                deficits[i] = -1
+                mask &= ~bit
+                continue
+            deficit = deficits[i] = packed_deficit(power, card.packed_cost)
+            if deficit <= gold:
+                mask |= bit
+            else:
+                mask &= ~bit
+        index[4] = mask
+        return index
+
+    def affordable(self, p_id: int) -> Dict[Tuple[int, int], int]:
+        """
+        cards the player can buy right now
+        :return: position (the same as in 'Player.select_card', reserve is '(slot, 5)'): gold tokens it would take
+        """
+        deficits = self._afford_index(p_id)[3]
+        gold = self.players[p_id].tokens[5]
+        return {
+            divmod(i, 4) if i < 12 else (i - 12, 5): deficit
+            for i, deficit in enumerate(deficits) if 0 <= deficit <= gold
+        }
+
+    def legal_actions(self, p_id: int) -> List[int]:
+        return Action.from_mask(self.legal_mask(p_id))
 
     def player_draw_3(self, colors: Union[list, tuple], p_id: int):
         if 0 < len(colors) < 4:
@@ -394,6 +1323,13 @@ class Game:
     def player_select(self, p_id: int):
         self.players[p_id]: Player
         desired_card = self.players[p_id].select_card(self.open_cards, self.deck_sizes)
+        return self.selected_card(p_id, desired_card), desired_card
+
+    async def player_select_async(self, p_id: int):
+        desired_card = await self.players[p_id].select_card_async(self.open_cards, self.deck_sizes)
+        return self.selected_card(p_id, desired_card), desired_card
+
+    def selected_card(self, p_id: int, desired_card: Tuple[int, int]) -> Card:
         # the necessary check were already performed in 'Player' by this point
         if desired_card[1] == 4:
             # reserve-only - selecting top of the corresponding deck
@@ -410,28 +1346,42 @@ class Game:
             card = self.players[p_id].reserved[desired_card[0]]
         else:
             card = self.open_cards[desired_card[0]][desired_card[1]]
-        return card, desired_card
+        return card
 
-    def player_buys(self, card: Card, desired_card: tuple, p_id: int):
+    def player_buys(self, card: Card, desired_card: tuple, p_id: int, payment: Optional[Sequence[int]] = None):
+        player = self.players[p_id]
+        reserved = player.reserved
         # traditional buy
         if desired_card[1] in [0, 1, 2, 3]:
-            bought, paid = self.players[p_id].buy_card(card)
+            bought, paid = player.buy_card(card, payment)
             if bought:
+                self._hash_open(desired_card[0], desired_card[1], card)
                 self.open_cards[desired_card[0]][desired_card[1]] = None
         elif desired_card[1] == 4:
             raise GameError("can't buy card from the top of the library directly!")
         # buy from reserve
         elif desired_card[1] == 5:
-            bought, paid = self.players[p_id].buy_reserve(desired_card[0])
+            bought, paid = player.buy_reserve(desired_card[0], payment)
+            if bought:
+                self._hash_reserved(p_id, reserved, player.reserved)
         try:
             for color, tokens in enumerate(paid):
+                if tokens:
+                    # player has already paid, count from before the payment is the current one plus paid tokens
+                    self._hash_tokens(color, p_id, self.tokens[color], player.tokens[color] + tokens, -tokens)
                 self.tokens[color] += tokens
         except UnboundLocalError:
             raise GameError("something went wrong with buying card")
+        if bought:
+            self._hash_owned(p_id, card)
+        return bought, paid
 
     def player_reserve(self, card: Card, desired_card: tuple, p_id: int):
+        reserved = self.players[p_id].reserved
         if desired_card[1] == 4:
             self.players[p_id].reserve(card)
+            if card.id is not None:
+                self.players[p_id].blind |= {card.id}
             if desired_card[0] == 0:
                 c = self.l1_deck.pop()
             if desired_card[0] == 1:
@@ -440,19 +1390,209 @@ class Game:
                 c = self.l3_deck.pop()
         else:
             self.players[p_id].reserve(card)
+            self._hash_open(desired_card[0], desired_card[1], card)
             self.open_cards[desired_card[0]][desired_card[1]] = None
             c = card
-        self.give_token(Card.COLOR_IDS['x'][1], p_id)
+        self._hash_reserved(p_id, reserved, self.players[p_id].reserved)
+        # gold is a bonus for reserving, reservation is still allowed when the bank has run out of it
+        if self.tokens[Card.COLOR_IDS['x'][1]] > 0:
+            self.give_token(Card.COLOR_IDS['x'][1], p_id)
         return c
 
+    @property
+    def scores(self) -> List[int]:
+        return [player.points for player in self.players]
+
+    def winners(self) -> List[int]:
+        """
+        ids of the players with the most points, ties broken by the fewest bought cards; empty until game ends
+        """
+        if not self.finished:
+            return []
+        best = max((p.points, -sum(p.card_power)) for p in self.players)
+        return [p.id for p in self.players if (p.points, -sum(p.card_power)) == best]
+
+    def apply(self, action: int) -> tuple:
+        """
+        plays the action (id from 'Action') for the player on the move, refills the open cards and ends
+        the turn - noble visits, end of the game after the round in which someone reached 'WINNING_POINTS',
+        passing the move to the next player; while the player holds more than 'TOKEN_LIMIT' tokens the turn
+        doesn't end and only returning tokens is legal. action is expected to be legal, check it with
+        'legal_mask' beforehand
+        :return: undo record - tuple of
+            (action, player id, card, paid tokens, reserve before the move, whether gold was given, refilled slots,
+             hash before the move, nobles before the visit or None) which 'undo' uses to restore the state
+             from before this call
+        """
+        zobrist = self.zobrist
+        p_id = self.current_player
+        player = self.players[p_id]
+        kind, args = Action.decode(action)
+        card, paid, reserved, gold, refilled, nobles = None, None, player.reserved, False, (), None
+        if kind == "draw":
+            self.player_draw_3(args, p_id)
+        elif kind == "draw_2_same":
+            self.player_draw_2_same(args[0], p_id)
+        elif kind == "return":
+            self.take_token(args[0], p_id)
+        elif kind == "pass":
+            pass
+        else:
+            row, slot = args
+            if slot == 4:
+                card = self.decks[row][-1]
+            elif slot == 5:
+                card = reserved[row]
+            else:
+                card = self.open_cards[row][slot]
+            if card is None:
+                raise GameError("there is no card at given position")
+            if kind == "buy":
+                weights = getattr(player.strategy, "payment_weights", None)
+                payment = None if weights is None else player.best_payment(card, weights)
+                bought, paid = self.player_buys(card, args, p_id, payment)
+                if not bought:
+                    raise GameError("player can't afford this card")
+            else:
+                gold = self.tokens[5] > 0
+                self.player_reserve(card, args, p_id)
+            refilled = tuple(self.replace_empty())
+        if sum(player.tokens) <= self.TOKEN_LIMIT:
+            visited = tuple(self.open_cards[3])
+            if self.player_aristocrat_inviting(p_id) is not None:
+                nobles = visited
+            if p_id == self.player_count - 1 and max(self.scores) >= self.WINNING_POINTS:
+                self.finished = True
+            self.current_player = (p_id + 1) % self.player_count
+            self.zobrist ^= ZOBRIST.to_move[p_id] ^ ZOBRIST.to_move[self.current_player]
+        return action, p_id, card, paid, reserved, gold, refilled, zobrist, nobles
+
+    def play(self, strategies: Optional[List[Strategy]] = None, max_actions: int = 10000,
+             on_action: Optional[Callable[[int, int], None]] = None) -> List[int]:
+        """
+        sets the game up with given strategies (or keeps current players when none are given) and lets
+        them choose actions until the game ends
+        :param max_actions: safety limit for games that can't end, e.g. when every bot only passes
+        :param on_action: called with (p_id, action) before every action is applied, e.g. replay log
+        :return: ids of the winners, empty when the game was cut by 'max_actions'
+        """
+        # asynchronous strategies and the ones only selecting cards can't play this loop, it's checked up front
+        seated = strategies if strategies is not None else [player.strategy for player in self.players]
+        for p_id, strategy in enumerate(seated):
+            if isinstance(strategy, AsyncStrategy) or (
+                    strategy is not None and type(strategy).choose_action is Strategy.choose_action):
+                raise GameError(f"{strategy.__class__.__name__} of player {p_id} can't choose actions")
+        if strategies is not None or not self.players:
+            self.full_setup(strategies)
+        for _ in range(max_actions):
+            if self.finished:
+                break
+            p_id = self.current_player
+            action = self.players[p_id].strategy.choose_action(self, p_id)
+            if self.verbose:
+                print(f"player {p_id}: {' '.join(map(str, Action.decode(action)))}")
+            if on_action is not None:
+                on_action(p_id, action)
+            self.apply(action)
+        return self.winners()
+
+    def undo(self, record: tuple):
+        """
+        reverts the move described by undo record from 'apply'; records have to be undone in reverse order
+        """
+        action, p_id, card, paid, reserved, gold, refilled, zobrist, nobles = record
+        player = self.players[p_id]
+        kind, args = Action.decode(action)
+        if nobles is not None:
+            player.cards.pop()
+            self.open_cards[3][:] = nobles
+        for row, slot in reversed(refilled):
+            self.decks[row].append(self.open_cards[row][slot])
+            self.open_cards[row][slot] = None
+        if kind == "draw":
+            for color in args:
+                self.tokens[color] += 1
+                player.tokens[color] -= 1
+        elif kind == "draw_2_same":
+            self.tokens[args[0]] += 2
+            player.tokens[args[0]] -= 2
+        elif kind == "return":
+            self.tokens[args[0]] -= 1
+            player.tokens[args[0]] += 1
+        elif kind == "reserve" or kind == "buy":
+            row, slot = args
+            if kind == "buy":
+                player.cards.pop()
+                for color, tokens in enumerate(paid):
+                    self.tokens[color] -= tokens
+                    player.tokens[color] += tokens
+            elif gold:
+                self.tokens[5] += 1
+                player.tokens[5] -= 1
+            player.reserved = reserved
+            if slot == 4:
+                player.blind -= {card.id}
+                self.decks[row].append(card)
+            elif slot < 4:
+                self.open_cards[row][slot] = card
+        self.current_player = p_id
+        self.finished = False
+        self.zobrist = zobrist
+
+    def _noble_index(self, p_id: int) -> list:
+        """
+        [packed card power, noble of every open slot, packed per-gem shortfall of every slot] of the player;
+        shortfalls are recomputed only after the player got or lost a card, and for slots whose noble
+        has changed - either way it's one 'packed_shortfall' per noble
+        """
+        if len(self._noble_needs) != len(self.players):
+            self._noble_needs = [None] * len(self.players)
+        power = self.players[p_id].cards.packed
+        nobles = self.open_cards[3]
+        index = self._noble_needs[p_id]
+        if index is None or index[0] != power or len(index[1]) != len(nobles):
+            index = self._noble_needs[p_id] = [power, [None] * len(nobles), [0] * len(nobles)]
+        seen, shortfalls = index[1], index[2]
+        for slot, noble in enumerate(nobles):
+            if noble is not seen[slot]:
+                seen[slot] = noble
+                shortfalls[slot] = 0 if noble is None else packed_shortfall(power, noble.packed_cost)
+        return index
+
+    def noble_deficits(self, p_id: int) -> List[Optional[List[int]]]:
+        """
+        :return: cards of every regular gem the player still needs for each open noble, None for empty slot
+        """
+        _, nobles, shortfalls = self._noble_index(p_id)
+        return [None if noble is None else unpack_gems(shortfall) for noble, shortfall in zip(nobles, shortfalls)]
+
+    def noble_distances(self) -> List[List[Optional[int]]]:
+        """
+        :return: for every player, total number of cards missing to each open noble (None for empty slot)
+        """
+        distances = []
+        for p_id in range(len(self.players)):
+            _, nobles, shortfalls = self._noble_index(p_id)
+            distances.append([
+                None if noble is None else (shortfall * LANE_ONES >> (LANE_BITS * 4)) & 0xFFFF
+                for noble, shortfall in zip(nobles, shortfalls)
+            ])
+        return distances
+
     def player_aristocrat_inviting(self, p_id):
         a_id = -1
-        for index, aristocrat in enumerate(self.open_cards[3]):
+        card = None
+        _, nobles, shortfalls = self._noble_index(p_id)
+        for index, aristocrat in enumerate(nobles):
+            if aristocrat is None or shortfalls[index]:
+                continue
             card = self.players[p_id].invite(aristocrat)
             if card:
                 a_id = index
                 break
         if a_id != -1:
+            self._hash_open(3, a_id, card)
+            self._hash_owned(p_id, card)
             self.open_cards[3][a_id] = None
         return card
 
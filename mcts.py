@@ -0,0 +1,192 @@
+"""
+Monte Carlo tree search bot - UCT over the 'Action' ids, played on a clone of the game with 'Game.apply'/'Game.undo'
+
+nodes are kept in a transposition table keyed by 'Game.zobrist', so positions reached by different move orders
+share their statistics, and the table outlives a single move - the search of the next turn starts from
+whatever the previous searches already know about the new position. the table holds at most 'max_nodes'
+nodes, least recently visited ones are dropped first and their objects are reused for new nodes, so memory
+stays flat over long games (and tournaments)
+
+the bot sees the whole 'Game', deck order included - see 'ismcts' for the search that doesn't peek
+"""
+from math import log, sqrt
+from random import Random
+from time import perf_counter
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from main import Action, Game, Strategy
+
+BUY_MASK = ((1 << (Action.RESERVE - Action.BUY)) - 1) << Action.BUY
+
+
+class Node:
+    """
+    position in the tree with statistics of every action taken from it; children aren't referenced
+    directly, they are looked up in the table by the hash of the position the action leads to
+    """
+    __slots__ = ("key", "player", "actions", "visits", "values", "total")
+
+    def __init__(self):
+        self.key = 0
+        self.player = 0
+        self.actions: List[int] = []
+        self.visits: List[int] = []
+        self.values: List[float] = []
+        self.total = 0
+
+    def reset(self, key: int, player: int, actions: List[int]):
+        self.key = key
+        self.player = player
+        self.actions = actions
+        self.visits = [0] * len(actions)
+        self.values = [0.0] * len(actions)
+        self.total = 0
+
+
+def evaluate(game: Game) -> List[float]:
+    """
+    reward of every player - share of the win for finished game, otherwise estimate from the lead in points
+    """
+    if game.finished:
+        winners = game.winners()
+        return [1 / len(winners) if p_id in winners else 0.0 for p_id in range(game.player_count)]
+    scores = game.scores
+    rewards = []
+    for p_id, points in enumerate(scores):
+        lead = points - max(s for other, s in enumerate(scores) if other != p_id)
+        rewards.append(min(1.0, max(0.0, 0.5 + lead / (2 * game.WINNING_POINTS))))
+    return rewards
+
+
+def rollout_action(game: Game, p_id: int, rng: Random, buy_rate: float = 0.8) -> int:
+    """
+    cheap playout policy - buys some affordable card most of the time, otherwise anything legal
+    """
+    mask = game.legal_mask(p_id)
+    if mask & BUY_MASK and rng.random() < buy_rate:
+        mask &= BUY_MASK
+    return rng.choice(Action.from_mask(mask))
+
+
+class MCTSStrategy(Strategy):
+    def __init__(self, seed: Optional[int] = None, iterations: int = 1000, time_limit: Optional[float] = None,
+                 max_nodes: int = 50000, exploration: float = 1.4, rollout_depth: int = 30):
+        """
+        :param iterations: search iterations per move, each adds at most one node to the table
+        :param time_limit: seconds per move, the search stops at whichever budget runs out first
+        :param max_nodes: size of the transposition table
+        :param rollout_depth: actions played out from the new node before the position is 'evaluate'd
+        """
+        self.rng = Random(seed)
+        self.iterations = iterations
+        self.time_limit = time_limit
+        self.max_nodes = max_nodes
+        self.exploration = exploration
+        self.rollout_depth = rollout_depth
+        self.table: "OrderedDict[int, Node]" = OrderedDict()
+        self._free: List[Node] = []
+
+    def key(self, game: Game) -> int:
+        return game.zobrist
+
+    def node(self, game: Game, key: int) -> Node:
+        """
+        new node for the position, made of a recycled one when there is any
+        """
+        node = self._free.pop() if self._free else Node()
+        actions = game.legal_actions(game.current_player)
+        self.rng.shuffle(actions)
+        node.reset(key, game.current_player, actions)
+        self.table[key] = node
+        return node
+
+    def select(self, node: Node, game: Game) -> int:
+        """
+        UCB1, untried actions first
+        :return: index of the action in the node
+        """
+        visits = node.visits
+        if 0 in visits:
+            return visits.index(0)
+        scale = self.exploration * sqrt(log(node.total))
+        values = node.values
+        return max(range(len(visits)), key=lambda i: values[i] / visits[i] + scale / sqrt(visits[i]))
+
+    def rollout(self, game: Game, records: list) -> List[float]:
+        for _ in range(self.rollout_depth):
+            if game.finished:
+                break
+            records.append(game.apply(rollout_action(game, game.current_player, self.rng)))
+        return evaluate(game)
+
+    def iterate(self, game: Game, root: Node):
+        """
+        one descent from the root - selection through the known nodes, expansion of one new node,
+        rollout and backing the rewards up; the game is restored afterwards
+        """
+        records = []
+        path: List[Tuple[Node, int]] = []
+        seen = {root.key}
+        node = root
+        while True:
+            self.table.move_to_end(node.key)
+            index = self.select(node, game)
+            path.append((node, index))
+            records.append(game.apply(node.actions[index]))
+            if game.finished:
+                rewards = evaluate(game)
+                break
+            key = self.key(game)
+            child = self.table.get(key)
+            if child is None or key in seen:
+                # new position, or the descent went round in a cycle (e.g. tokens drawn and returned)
+                if child is None:
+                    self.node(game, key)
+                rewards = self.rollout(game, records)
+                break
+            seen.add(key)
+            node = child
+        for node, index in path:
+            node.total += 1
+            node.visits[index] += 1
+            node.values[index] += rewards[node.player]
+        while records:
+            game.undo(records.pop())
+        self.trim(root)
+
+    def trim(self, root: Node):
+        # nodes are dropped only between the descents, so none of them is recycled while still on the path
+        self.table.move_to_end(root.key)
+        while len(self.table) > self.max_nodes:
+            self._free.append(self.table.popitem(last=False)[1])
+
+    def worlds(self, game: Game) -> List[Game]:
+        """
+        states the search runs on, taking turns - here just a clone of the game, this bot sees everything
+        """
+        return [game.clone()]
+
+    def search(self, game: Game) -> Node:
+        """
+        runs the search from the position of the game (which is left as it was) within the budget
+        :return: root node
+        """
+        worlds = self.worlds(game)
+        key = self.key(worlds[0])
+        root = self.table.get(key)
+        if root is None:
+            root = self.node(worlds[0], key)
+            self.trim(root)
+        if len(root.actions) == 1:
+            return root
+        deadline = None if self.time_limit is None else perf_counter() + self.time_limit
+        for n in range(self.iterations):
+            self.iterate(worlds[n % len(worlds)], root)
+            if deadline is not None and perf_counter() > deadline:
+                break
+        return root
+
+    def choose_action(self, game: Game, p_id: int) -> int:
+        root = self.search(game)
+        return root.actions[max(range(len(root.actions)), key=root.visits.__getitem__)]
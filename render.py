@@ -0,0 +1,110 @@
+"""
+terminal board of the game - nobles, three rows of open cards with deck sizes, and every player's tokens
+and reserve, composed side by side from cached card renders
+
+'BoardRenderer.render' gives the whole board as text, 'BoardRenderer.diff' gives ANSI escape sequences
+redrawing only the parts of the board that changed since the previous frame
+"""
+from typing import Dict, List, Optional, Tuple
+
+from main import Card, CardBase, Game
+
+CARD_WIDTH = 19
+CARD_HEIGHT = 10
+SHORT_WIDTH = 30
+LABEL_WIDTH = 8
+GAP = 1
+
+Region = Tuple[tuple, int, int, Tuple[str, ...]]
+
+
+class BoardRenderer:
+    def __init__(self, short: bool = False):
+        """
+        :param short: one line per card instead of the box
+        """
+        self.short = short
+        self.card_width = SHORT_WIDTH if short else CARD_WIDTH
+        self.card_height = 1 if short else CARD_HEIGHT
+        self._blank = (" " * self.card_width,) * self.card_height
+        # region key: (top, left, lines) of the last frame
+        self.previous: Dict[tuple, Tuple[int, int, Tuple[str, ...]]] = {}
+
+    def card(self, card: Optional[CardBase]) -> Tuple[str, ...]:
+        if card is None:
+            return self._blank
+        if self.short:
+            return (card.render(True)[:self.card_width].ljust(self.card_width),)
+        return card.render_lines()
+
+    def regions(self, game: Game) -> List[Region]:
+        """
+        every independently redrawn part of the board: (key, top line, left column, lines)
+        """
+        regions = []
+        step = self.card_width + GAP
+        top = 0
+        for index, noble in enumerate(game.open_cards[3]):
+            regions.append((("noble", index), top, LABEL_WIDTH + index * step, self.card(noble)))
+        top += self.card_height + GAP
+        sizes = game.deck_sizes
+        for row in (2, 1, 0):
+            if self.short:
+                label = (f"L{row + 1}[{sizes[row]:>2}]".ljust(LABEL_WIDTH),)
+            else:
+                label = (f"L{row + 1}".ljust(LABEL_WIDTH), f"[{sizes[row]:>3}]".ljust(LABEL_WIDTH))
+            regions.append((("deck", row), top, 0, label))
+            for slot, card in enumerate(game.open_cards[row]):
+                regions.append((("open", row, slot), top, LABEL_WIDTH + slot * step, self.card(card)))
+            top += self.card_height + GAP
+        for player in game.players:
+            marker = ">" if player.id == game.current_player and not game.finished else " "
+            counts = player.cards.counts
+            summary = f"{marker}player {player.id}  points {player.points:>2}  tokens " + \
+                " ".join(f"{code}{count}" for code, count in zip(Card.COLOR_CODES, player.tokens)) + \
+                "  cards " + " ".join(f"{code}{count}" for code, count in zip(Card.COLOR_CODES[:5], counts))
+            regions.append((("player", player.id), top, 0, (summary.ljust(LABEL_WIDTH + 4 * step),)))
+            top += 1
+            for slot, card in enumerate(player.reserved):
+                regions.append((("reserved", player.id, slot), top, LABEL_WIDTH + slot * step, self.card(card)))
+            top += self.card_height + GAP
+        return regions
+
+    def render(self, game: Game) -> str:
+        """
+        whole board as text, it also becomes the frame 'diff' compares with
+        """
+        regions = self.regions(game)
+        canvas: List[str] = []
+        for _, top, left, lines in regions:
+            while len(canvas) < top + len(lines):
+                canvas.append("")
+            for n, line in enumerate(lines):
+                current = canvas[top + n]
+                if len(current) < left:
+                    current = current.ljust(left)
+                canvas[top + n] = current[:left] + line + current[left + len(line):]
+        self.previous = {key: (top, left, lines) for key, top, left, lines in regions}
+        return "\n".join(line.rstrip() for line in canvas)
+
+    def diff(self, game: Game) -> str:
+        """
+        ANSI escape sequences turning the previous frame into the current one; the first frame (or frame
+        after the layout changed) clears the screen and draws everything
+        """
+        regions = self.regions(game)
+        if self.previous.keys() != {key for key, *_ in regions}:
+            return "\x1b[2J\x1b[H" + self.render(game) + "\n"
+        out = []
+        for key, top, left, lines in regions:
+            before = self.previous[key]
+            if before[2] == lines and before[:2] == (top, left):
+                continue
+            for n, line in enumerate(lines):
+                if before[2][n:n + 1] != (line,):
+                    # terminal rows and columns count from 1
+                    out.append(f"\x1b[{top + n + 1};{left + 1}H{line}")
+            self.previous[key] = (top, left, lines)
+        if out:
+            out.append(f"\x1b[{max(top + len(lines) for _, top, _, lines in regions) + 1};1H")
+        return "".join(out)
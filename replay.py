@@ -0,0 +1,221 @@
+"""
+compact append-only replay log of many games
+
+game is fully described by its seed (deal) and the list of actions, so the log stores only that:
+    file    - MAGIC, then games one after another
+    game    - header (GAME_TAG, player count, seed, Zobrist hash of the dealt game),
+              2 bytes (p_id, action id) per action, END_TAG with finished flag at the end
+offsets of game headers go to '<log>.idx' (INDEX_MAGIC + one u64 per game), so game K is one seek away.
+index is brought up to date by scanning only the games after its last entry (e.g. after a crash)
+"""
+import struct
+from os import path
+from typing import BinaryIO, Iterator, List, NamedTuple, Tuple
+
+from main import Game, GameError
+
+MAGIC = b"SPLR\x01"
+INDEX_MAGIC = b"SPLI\x01"
+GAME_TAG = 0xFE
+END_TAG = 0xFF
+HEADER = struct.Struct("<BBQQ")
+STEP = struct.Struct("<BB")
+OFFSET = struct.Struct("<Q")
+
+
+class GameRecord(NamedTuple):
+    index: int
+    seed: int
+    player_count: int
+    zobrist: int
+    steps: List[Tuple[int, int]]
+    # False when the game has been cut short, either by 'max_actions' or the writer didn't finish it
+    finished: bool
+
+
+class ReplayWriter:
+    def __init__(self, file: str):
+        self.file = file
+        new = not path.exists(file) or path.getsize(file) == 0
+        if not new and not sync_index(file):
+            # game left unfinished by the writer that crashed, closing it so new games can be appended
+            with open(file, "ab") as log:
+                log.write(STEP.pack(END_TAG, False))
+        self._log: BinaryIO = open(file, "ab")
+        self._index: BinaryIO = open(file + ".idx", "ab")
+        if new:
+            self._log.write(MAGIC)
+            self._index.truncate(0)
+            self._index.write(INDEX_MAGIC)
+        self._in_game = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._log.close()
+        self._index.close()
+
+    def start(self, game: Game):
+        """
+        writes the header of freshly dealt game - it has to be dealt by the first 'full_setup' of 'Game(seed=...)'
+        """
+        if game.seed is None:
+            raise GameError("game without seed can't be replayed")
+        # header keeps the seed the same way snapshots do, checked before anything is written
+        seed = Game.snapshot_seed(game.seed)
+        if self._in_game:
+            raise GameError("previous game wasn't finished")
+        self._index.write(OFFSET.pack(self._log.tell()))
+        self._log.write(HEADER.pack(GAME_TAG, game.player_count, seed, game.zobrist))
+        self._in_game = True
+
+    def action(self, p_id: int, action: int):
+        self._log.write(STEP.pack(p_id, action))
+
+    def finish(self, game: Game):
+        self._log.write(STEP.pack(END_TAG, game.finished))
+        self._log.flush()
+        self._index.flush()
+        self._in_game = False
+
+    def play(self, game: Game, max_actions: int = 10000) -> List[int]:
+        """
+        plays already dealt game with its players' strategies, logging it as it goes
+        """
+        self.start(game)
+        winners = game.play(max_actions=max_actions, on_action=self.action)
+        self.finish(game)
+        return winners
+
+
+def _check_magic(stream: BinaryIO, magic: bytes):
+    if stream.read(len(magic)) != magic:
+        raise GameError(f"{stream.name} isn't a replay file")
+
+
+def _read_steps(log: BinaryIO) -> Tuple[List[Tuple[int, int]], bool, bool]:
+    """
+    reads actions of one game, log has to be positioned right after the game header
+    :return: (steps, finished flag, whether the game has its end tag)
+    """
+    steps = []
+    while len(step := log.read(STEP.size)) == STEP.size:
+        if step[0] == END_TAG:
+            return steps, bool(step[1]), True
+        if step[0] == GAME_TAG:
+            # next game right after unfinished one
+            log.seek(-STEP.size, 1)
+            return steps, False, False
+        steps.append(STEP.unpack(step))
+    return steps, False, False
+
+
+def _scan(log: BinaryIO) -> Iterator[Tuple[int, bool]]:
+    # yields (offset, terminated) of every game header from the current position
+    while True:
+        offset = log.tell()
+        header = log.read(HEADER.size)
+        if not header:
+            return
+        if header[0] != GAME_TAG or len(header) < HEADER.size:
+            raise GameError(f"corrupted replay log at {offset}")
+        yield offset, _read_steps(log)[2]
+
+
+def sync_index(file: str) -> bool:
+    """
+    brings '<file>.idx' up to date - only games after the last indexed one are scanned, whole log
+    is scanned only when the index doesn't exist
+    :return: whether the last game in the log is terminated
+    """
+    index_file = file + ".idx"
+    with open(file, "rb") as log, open(index_file, "ab+") as index:
+        _check_magic(log, MAGIC)
+        index.seek(0)
+        if index.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            index.truncate(0)
+            index.write(INDEX_MAGIC)
+        size = index.seek(0, 2)
+        if size > len(INDEX_MAGIC):
+            index.seek(size - OFFSET.size)
+            last = OFFSET.unpack(index.read(OFFSET.size))[0]
+            log.seek(last)
+            games = _scan(log)
+            # the last indexed game itself
+            terminated = next(games)[1]
+        else:
+            games = _scan(log)
+            terminated = True
+        for offset, terminated in games:
+            index.write(OFFSET.pack(offset))
+        return terminated
+
+
+class ReplayReader:
+    def __init__(self, file: str):
+        self.file = file
+        sync_index(file)
+        self._index_file = file + ".idx"
+
+    def __len__(self):
+        return (path.getsize(self._index_file) - len(INDEX_MAGIC)) // OFFSET.size
+
+    def offset(self, game_index: int) -> int:
+        with open(self._index_file, "rb") as index:
+            index.seek(len(INDEX_MAGIC) + game_index * OFFSET.size)
+            data = index.read(OFFSET.size)
+        if len(data) < OFFSET.size:
+            raise IndexError("no such game in the log")
+        return OFFSET.unpack(data)[0]
+
+    def records(self, start: int = 0) -> Iterator[GameRecord]:
+        """
+        reads games one at a time, starting from 'start'-th game of the log
+        """
+        if start >= len(self):
+            return
+        with open(self.file, "rb") as log:
+            log.seek(self.offset(start))
+            index = start
+            while header := log.read(HEADER.size):
+                tag, player_count, seed, zobrist = HEADER.unpack(header)
+                if tag != GAME_TAG:
+                    raise GameError(f"corrupted replay log at game {index}")
+                steps, finished, _ = _read_steps(log)
+                yield GameRecord(index, seed, player_count, zobrist, steps, finished)
+                index += 1
+
+    def replay(self, start: int = 0) -> Iterator[Tuple[GameRecord, Game]]:
+        """
+        replays games turn by turn, yields the same 'Game' after the deal and after every action
+        """
+        for record in self.records(start):
+            for game in replay_record(record):
+                yield record, game
+
+
+def replay_record(record: GameRecord) -> Iterator[Game]:
+    game = Game(record.player_count, verbose=False, seed=record.seed)
+    game.full_setup()
+    if game.zobrist != record.zobrist:
+        raise GameError(f"game {record.index} was dealt differently than logged")
+    yield game
+    for p_id, action in record.steps:
+        if p_id != game.current_player:
+            raise GameError(f"game {record.index}: action of player {p_id} on turn of {game.current_player}")
+        game.apply(action)
+        yield game
+
+
+def load_game(record: GameRecord) -> Game:
+    """
+    :return: the final state of logged game
+    """
+    game = None
+    for game in replay_record(record):
+        pass
+    return game
@@ -0,0 +1,287 @@
+"""
+asyncio game server - many 'Game' sessions hosted by one event loop over plain TCP
+
+protocol is JSON lines, every request gets exactly one response ({"ok": true, ...} or {"ok": false, "error": ...}),
+other players' moves are pushed to the session clients as {"event": "move", ...} lines in between:
+    {"op": "create", "players": 2, "seed": 1}       -> {"ok": true, "session": "1"}
+    {"op": "join", "session": "1"}                  -> {"ok": true, "seat": 0, "state": {...}}
+    {"op": "state"}                                 -> {"ok": true, "state": {...}}
+    {"op": "draw", "colors": [0, 1, 2]}             - 'player_draw_3'
+    {"op": "draw_2_same", "color": 3}               - 'player_draw_2_same'
+    {"op": "buy", "row": 0, "slot": 2}              - 'player_buys', slot 5 buys from the reserve (row = reserve slot)
+    {"op": "reserve", "row": 1, "slot": 4}          - 'player_reserve', slot 4 is top of the deck
+    {"op": "return", "color": 2} / {"op": "pass"}   - token limit / nothing else to do
+    {"op": "leave"} / {"op": "stats"}               - 'stats' gives counters of the session store
+                                                      and method timings when started with --instrument
+sessions don't run any task of their own - idle session is just its seats and the 'Game' kept by 'SessionStore'
+(which moves idle games to disk), the only tasks are the connections; line length and the unsent output
+of every client are capped, slow clients get dropped. finished session is dropped once everyone has left it,
+session nobody sits in (left unfinished, or never joined) is dropped after 'idle_timeout' seconds
+"""
+import json
+import asyncio
+import argparse
+from time import monotonic
+from itertools import count
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from main import Action, Game, GameError
+from store import SessionStore
+from instrument import INSTRUMENTATION
+
+MAX_LINE = 4096
+MAX_BUFFER = 64 * 1024
+MAX_SESSIONS = 100000
+IDLE_TIMEOUT = 600.0
+
+
+class Session:
+    __slots__ = ("id", "store", "seats")
+
+    def __init__(self, s_id: str, store: SessionStore, player_count: int, seed: Optional[int] = None):
+        self.id = s_id
+        self.store = store
+        game = Game(player_count, verbose=False, seed=seed)
+        game.full_setup()
+        store.put(s_id, game)
+        self.seats: List[Optional[asyncio.StreamWriter]] = [None] * player_count
+
+    @property
+    def game(self) -> Game:
+        # idle game may have been moved to disk by the store, it's loaded back here
+        return self.store.get(self.id)
+
+    def state(self, viewer: Optional[int] = None) -> dict:
+        """
+        :param viewer: seat the state is for - cards the other players reserved from the top of a deck
+            show only their level ({"level": 3}), None hides them from everyone
+        """
+        game = self.game
+
+        def ids(cards):
+            return [None if card is None else card.id for card in cards]
+
+        def reserved(p_id, player):
+            cards = ids(player.reserved)
+            if p_id != viewer:
+                for slot, card in player.hidden:
+                    cards[slot] = {"level": card.level}
+            return cards
+
+        return {
+            "tokens": game.tokens,
+            "players": [{"tokens": player.tokens, "cards": ids(player.cards), "reserved": reserved(p_id, player),
+                         "points": player.points} for p_id, player in enumerate(game.players)],
+            "open_cards": [ids(row) for row in game.open_cards],
+            "deck_sizes": game.deck_sizes,
+            "current_player": game.current_player,
+            "legal": game.legal_actions(game.current_player),
+            "finished": game.finished,
+            "winners": game.winners(),
+        }
+
+
+def action_of(message: dict) -> int:
+    """
+    translates action request into id of 'Action'
+    """
+    op = message.get("op")
+    if op == "draw":
+        return Action.encode("draw", message.get("colors", ()))
+    if op in ("draw_2_same", "return"):
+        return Action.encode(op, (message.get("color"),))
+    if op in ("buy", "reserve"):
+        return Action.encode(op, (message.get("row"), message.get("slot")))
+    if op == "pass":
+        return Action.PASS
+    raise GameError(f"unknown operation {op}")
+
+
+class GameServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, max_sessions: int = MAX_SESSIONS,
+                 store: Optional[SessionStore] = None, idle_timeout: float = IDLE_TIMEOUT):
+        """
+        :param idle_timeout: seconds session may stay without anyone sitting in it before it's dropped
+        """
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.store = store if store is not None else SessionStore()
+        # store made here is closed with the server, store passed in belongs to the caller
+        self._own_store = store is None
+        self.sessions: Dict[str, Session] = {}
+        # sessions nobody sits in, with the time they became empty - oldest first
+        self._idle: "OrderedDict[str, float]" = OrderedDict()
+        self._ids = count(1)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> asyncio.AbstractServer:
+        self._server = await asyncio.start_server(self.handle, self.host, self.port, limit=MAX_LINE)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._own_store:
+            self.store.close()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        seat: Optional[Tuple[Session, int]] = None
+        try:
+            while line := await reader.readline():
+                try:
+                    response, seat = self.request(json.loads(line), seat, writer)
+                except (GameError, ValueError, TypeError, KeyError, AttributeError) as error:
+                    response = {"ok": False, "error": str(error)}
+                if not self.send(writer, response):
+                    break
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, asyncio.IncompleteReadError, ValueError):
+            # ValueError - line longer than MAX_LINE
+            pass
+        finally:
+            self.leave(seat)
+            writer.close()
+
+    def request(self, message: dict, seat: Optional[Tuple[Session, int]],
+                writer: asyncio.StreamWriter) -> Tuple[dict, Optional[Tuple[Session, int]]]:
+        self.drop_idle()
+        op = message.get("op")
+        if op == "create":
+            if len(self.sessions) >= self.max_sessions:
+                raise GameError("server is full")
+            seed = message.get("seed")
+            if seed is not None and not (isinstance(seed, int) and 0 <= seed < 2 ** 64):
+                raise GameError("seed has to be unsigned 64-bit integer")
+            s_id = str(next(self._ids))
+            self.sessions[s_id] = Session(s_id, self.store, int(message.get("players", 2)), seed)
+            self._idle[s_id] = monotonic()
+            return {"ok": True, "session": s_id}, seat
+        if op == "join":
+            if seat is not None:
+                raise GameError("already sitting in a session")
+            session = self.sessions.get(str(message.get("session")))
+            if session is None:
+                raise GameError("no such session")
+            if None not in session.seats:
+                raise GameError("session is full")
+            p_id = session.seats.index(None)
+            session.seats[p_id] = writer
+            self._idle.pop(session.id, None)
+            return {"ok": True, "seat": p_id, "state": session.state(p_id)}, (session, p_id)
+        if seat is None:
+            raise GameError("join a session first")
+        session, p_id = seat
+        if op == "state":
+            return {"ok": True, "state": session.state(p_id)}, seat
+        if op == "stats":
+            stats = self.store.stats()
+            if INSTRUMENTATION.enabled:
+                stats["timings"] = INSTRUMENTATION.as_dict()
+            return {"ok": True, "stats": stats}, seat
+        if op == "leave":
+            self.leave(seat)
+            return {"ok": True}, None
+        return self.move(session, p_id, action_of(message)), seat
+
+    def move(self, session: Session, p_id: int, action: int) -> dict:
+        game = session.game
+        if p_id != game.current_player:
+            raise GameError("it's not your turn")
+        if not game.legal_mask(p_id) >> action & 1:
+            raise GameError("illegal move")
+        game.apply(action)
+        decoded = Action.decode(action)
+        for other, writer in enumerate(session.seats):
+            if other != p_id and writer is not None:
+                event = {"event": "move", "player": p_id, "action": decoded, "state": session.state(other)}
+                if not self.send(writer, event):
+                    writer.close()
+        return {"ok": True, "state": session.state(p_id)}
+
+    @staticmethod
+    def send(writer: asyncio.StreamWriter, message: dict) -> bool:
+        """
+        queues message for the client, False for the client that doesn't read its messages
+        """
+        if writer.is_closing() or writer.transport.get_write_buffer_size() > MAX_BUFFER:
+            return False
+        writer.write(json.dumps(message, separators=(",", ":")).encode() + b"\n")
+        return True
+
+    def leave(self, seat: Optional[Tuple[Session, int]]):
+        if seat is None:
+            return
+        session, p_id = seat
+        session.seats[p_id] = None
+        if any(session.seats) or session.id not in self.sessions:
+            return
+        # finished game is dropped as soon as everyone has left, unfinished one waits for players to come back
+        # until 'drop_idle' runs out of patience
+        if session.game.finished:
+            self.drop(session.id)
+        else:
+            self._idle[session.id] = monotonic()
+            self._idle.move_to_end(session.id)
+
+    def drop_idle(self):
+        """
+        drops sessions nobody has sat in for 'idle_timeout' seconds
+        """
+        expired = monotonic() - self.idle_timeout
+        while self._idle and next(iter(self._idle.values())) <= expired:
+            self.drop(next(iter(self._idle)))
+
+    def drop(self, s_id: str):
+        self.sessions.pop(s_id, None)
+        self._idle.pop(s_id, None)
+        self.store.pop(s_id)
+
+
+class Client:
+    """
+    minimal client, mostly for testing - events pushed by the server wait in 'events'
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.events: List[dict] = []
+
+    @classmethod
+    async def connect(cls, host: str, port: int) -> "Client":
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, op: str, **kwargs) -> dict:
+        self.writer.write(json.dumps(dict(op=op, **kwargs)).encode() + b"\n")
+        await self.writer.drain()
+        while True:
+            message = json.loads(await self.reader.readline())
+            if "event" not in message:
+                return message
+            self.events.append(message)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def serve(host: str, port: int):
+    server = GameServer(host, port)
+    async with await server.start() as tcp:
+        print(f"serving on {host}:{server.port}")
+        await tcp.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Splendor game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--instrument", action="store_true", help="time engine methods, see 'stats' op")
+    args = parser.parse_args()
+    if args.instrument:
+        INSTRUMENTATION.enable()
+    asyncio.run(serve(args.host, args.port))
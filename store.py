@@ -0,0 +1,120 @@
+"""
+store of hosted games - recently used games stay in memory, the rest waits on disk as 'Game.to_bytes' snapshot
+
+games are evicted in least-recently-used order whenever the store holds more than 'max_games' games or
+their estimated size goes over 'max_bytes', and come back on the next 'get'. 'close' (or leaving the store
+used as context manager) removes the snapshots, together with the temporary directory the store made for them
+"""
+import tempfile
+from os import path, remove, replace
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from main import Game
+
+# rough resident size of one dealt game with its players and card lists, measured with tracemalloc
+GAME_BYTES = 7 * 1024
+
+
+class SessionStore:
+    def __init__(self, directory: Optional[str] = None, max_games: int = 10000, max_bytes: Optional[int] = None):
+        """
+        :param directory: where the evicted games go, new temporary directory (made at the first eviction,
+            removed by 'close') if not given
+        :param max_bytes: memory budget, counted as GAME_BYTES per game in memory
+        """
+        if max_games < 1:
+            raise ValueError("store has to hold at least one game in memory")
+        self.directory = directory
+        self._temporary: Optional[tempfile.TemporaryDirectory] = None
+        self.max_games = max_games if max_bytes is None else min(max_games, max(1, max_bytes // GAME_BYTES))
+        self._hot: "OrderedDict[str, Game]" = OrderedDict()
+        self._spilled: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        forgets all the games and removes their snapshots
+        """
+        for s_id in list(self._spilled):
+            self._discard_spilled(s_id)
+        self._hot.clear()
+        if self._temporary is not None:
+            self._temporary.cleanup()
+            self._temporary = None
+            self.directory = None
+
+    def __len__(self):
+        return len(self._hot) + len(self._spilled)
+
+    def __contains__(self, s_id: str):
+        return s_id in self._hot or s_id in self._spilled
+
+    def _file(self, s_id: str) -> str:
+        if self.directory is None:
+            self._temporary = tempfile.TemporaryDirectory(prefix="splendor-sessions-")
+            self.directory = self._temporary.name
+        return path.join(self.directory, f"{s_id}.snap")
+
+    def put(self, s_id: str, game: Game):
+        # game that couldn't be moved to disk is turned away here rather than at its eviction
+        Game.snapshot_seed(game.seed)
+        self._discard_spilled(s_id)
+        self._hot[s_id] = game
+        self._hot.move_to_end(s_id)
+        self._evict(s_id)
+
+    def get(self, s_id: str) -> Game:
+        game = self._hot.get(s_id)
+        if game is not None:
+            self.hits += 1
+            self._hot.move_to_end(s_id)
+            return game
+        if s_id not in self._spilled:
+            raise KeyError(s_id)
+        self.misses += 1
+        with open(self._file(s_id), "rb") as snapshot:
+            game = Game.from_bytes(snapshot.read(), verbose=False)
+        self._discard_spilled(s_id)
+        self._hot[s_id] = game
+        self._evict(s_id)
+        return game
+
+    def pop(self, s_id: str):
+        self._hot.pop(s_id, None)
+        self._discard_spilled(s_id)
+
+    def _discard_spilled(self, s_id: str):
+        if s_id in self._spilled:
+            self._spilled.discard(s_id)
+            remove(self._file(s_id))
+
+    def _evict(self, keep: str):
+        """
+        :param keep: game being handed out, it stays in memory - moves applied to it would be lost otherwise
+        """
+        while len(self._hot) > self.max_games and next(iter(self._hot)) != keep:
+            s_id, game = self._hot.popitem(last=False)
+            file = self._file(s_id)
+            with open(file + ".tmp", "wb") as snapshot:
+                snapshot.write(game.to_bytes())
+            replace(file + ".tmp", file)
+            self._spilled.add(s_id)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "in_memory": len(self._hot),
+            "on_disk": len(self._spilled),
+        }
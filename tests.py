@@ -4,17 +4,37 @@ Linux bash's '1>>', meanwhile the unittest specific output can be captured to an
 stderr redirect '2>>' in another place, to another file, while invoking test running scripts from terminal
 """
 import sys
+import asyncio
 import unittest
-from random import choice, randint, shuffle
+from random import choice, randint, shuffle, Random
 from re import match, findall, search
 from ast import literal_eval
-from copy import deepcopy
-from os import remove
+from copy import deepcopy, copy
+from pickle import dumps, loads
+from os import remove, path, listdir
+from tempfile import TemporaryDirectory
 from io import StringIO, TextIOWrapper, FileIO
 from contextlib import suppress
 from typing import Union
 
-from main import Card, Player, Game, GameError
+import bench
+from render import BoardRenderer
+from instrument import instrumented
+from server import Client, GameServer
+from store import SessionStore
+from replay import ReplayReader, ReplayWriter, load_game, HEADER, STEP, GAME_TAG
+from tournament import Tournament, wilson_interval
+from mcts import MCTSStrategy
+from ismcts import Determinizer, ISMCTSStrategy
+from main import Action, Card, CardBase, CardCatalog, FrozenCard, Player, Game, GameError
+from main import Strategy, AsyncStrategy, RandomStrategy
+from main import pack_gems, unpack_gems, packed_shortfall, packed_deficit, packed_covers
+
+try:
+    import numpy as np
+    from batch import BatchGame, EMPTY, best_payments, deck_permutations, game_order
+except ImportError:
+    np = None
 
 
 class SimpleStdOutInRedirect:
@@ -191,6 +211,130 @@ class CardTest(unittest.TestCase):
         self.assertEqual(len(costs), 5)
 
 
+class CardCatalogTest(unittest.TestCase):
+    def test_shared_catalog(self):
+        catalog = CardCatalog.get()
+        self.assertIs(catalog, CardCatalog.get())
+        self.assertEqual(len(Game.load_cards()), len(catalog))
+        for card_id, (card, entry) in enumerate(zip(catalog.cards, Game.load_cards())):
+            self.assertEqual(card_id, card.id)
+            self.assertEqual(Card(entry), card)
+        self.assertEqual([40, 30, 20, 10], [len(tier) for tier in catalog.tiers])
+
+    def test_games_share_cards(self):
+        game1, game2 = Game(2), Game(4)
+        game1.setup_cards()
+        game2.setup_cards()
+        catalog = CardCatalog.get()
+        for game in [game1, game2]:
+            in_game = game.l1_deck + game.l2_deck + game.l3_deck + game.nobles + sum(game.open_cards, [])
+            self.assertEqual(len(catalog), len(in_game))
+            for card in in_game:
+                self.assertIs(catalog[card.id], card)
+
+    def test_binary_cache(self):
+        with TemporaryDirectory() as directory:
+            source = path.join(directory, "cards.txt")
+            cache = path.join(directory, "cards.cache")
+            with open("cards.txt", "r") as original, open(source, "w") as copied:
+                copied.write(original.read())
+            parsed = CardCatalog.get(source, cache_file=cache)
+            self.assertTrue(path.exists(cache))
+            self.assertEqual(list(parsed.entries), [tuple(e) for e in Game.load_cards()])
+            # a fresh process would read entries straight from the cache
+            self.assertEqual(parsed.entries, tuple(tuple(e) for e in CardCatalog._cached_entries(source, cache)))
+            # changing source file invalidates cache
+            with open(source, "a") as copied:
+                copied.write('\n["r", 1, 5, 3, 0, 0, 0, 0, 7]\n')
+            entries = CardCatalog._cached_entries(source, cache)
+            self.assertEqual(len(parsed) + 1, len(entries))
+            self.assertEqual(entries, CardCatalog._cached_entries(source, cache))
+
+
+class FrozenCardTest(unittest.TestCase):
+    def setUp(self):
+        self.catalog = CardCatalog.get()
+        self.card_id = randint(0, len(self.catalog) - 1)
+        self.frozen = self.catalog[self.card_id]
+        self.card = Card(list(self.catalog.entries[self.card_id]))
+
+    def test_flyweight(self):
+        self.assertEqual(self.card_id, self.frozen.id)
+        self.assertEqual(self.card.color_id, self.frozen.color_id)
+        self.assertEqual(1 << self.card_id, self.frozen.bit)
+        self.assertFalse(hasattr(self.frozen, '__dict__'))
+        self.assertRaises(AttributeError, setattr, self.frozen, 'value', 4)
+        self.assertRaises(AttributeError, setattr, self.frozen, 'marker', 1)
+        self.assertIs(self.frozen, copy(self.frozen))
+        self.assertIs(self.frozen, deepcopy(self.frozen))
+        self.assertIs(self.frozen, loads(dumps(self.frozen)))
+
+    def test_hash_eq(self):
+        self.assertEqual(1, len({self.frozen, self.catalog[self.card_id]}))
+        self.assertEqual(len(self.catalog), len(set(self.catalog.cards)))
+        self.assertEqual({self.frozen: 1}[self.catalog[self.card_id]], 1)
+        other = self.catalog[(self.card_id + 1) % len(self.catalog)]
+        self.assertNotEqual(self.frozen, other)
+        self.assertNotEqual(self.frozen, None)
+        # content comparison with regular cards still works both ways
+        self.assertEqual(self.frozen, self.card)
+        self.assertEqual(self.card, self.frozen)
+
+    def test_dealt_cards(self):
+        # games deal the flyweights, so cards on the table work as set members and as bits of a mask
+        game = Game(2, verbose=False)
+        game.full_setup()
+        table = [card for row in game.open_cards for card in row]
+        self.assertTrue(all(isinstance(card, FrozenCard) for card in table + game.l1_deck))
+        self.assertEqual(len(table), len(set(table)))
+        mask = 0
+        for card in table:
+            mask |= card.bit
+        self.assertEqual(len(table), bin(mask).count("1"))
+        self.assertRaises(AttributeError, setattr, table[0], 'value', 9)
+
+    def test_print_and_player(self):
+        card = self.card
+        self.assertEqual(str(card), str(self.frozen))
+        self.assertEqual(card.print_short(), self.frozen.print_short())
+        player = Player(0)
+        player.tokens = [randint(0, 4) for _ in range(6)]
+        if card.level:
+            self.assertEqual(player.can_buy(card), player.can_buy(self.frozen))
+        else:
+            self.assertEqual(player.can_invite(card), player.can_invite(self.frozen))
+
+
+class PackedGemsTest(unittest.TestCase):
+    def test_pack_roundtrip(self):
+        values = [randint(0, 4095) for _ in range(5)]
+        self.assertEqual(values, unpack_gems(pack_gems(values)))
+        self.assertEqual(values, unpack_gems(pack_gems(values + [randint(0, 5)])))
+
+    def test_shortfall_and_deficit(self):
+        for _ in range(200):
+            power = [randint(0, 12) for _ in range(5)]
+            cost = [randint(0, 12) for _ in range(5)]
+            shortfall = [max(c - p, 0) for p, c in zip(power, cost)]
+            self.assertEqual(shortfall, unpack_gems(packed_shortfall(pack_gems(power), pack_gems(cost))))
+            self.assertEqual(sum(shortfall), packed_deficit(pack_gems(power), pack_gems(cost)))
+            self.assertEqual(not any(shortfall), packed_covers(pack_gems(power), pack_gems(cost)))
+
+    def test_card_packing(self):
+        catalog = CardCatalog.get()
+        for entry, frozen in zip(catalog.entries, catalog.cards):
+            card = Card(list(entry))
+            self.assertEqual(list(card.cost), unpack_gems(card.packed_cost))
+            self.assertEqual(card.packed_cost, frozen.packed_cost)
+
+    def test_player_packing(self):
+        player = Player(0)
+        player.tokens = [randint(0, 5) for _ in range(6)]
+        player.cards = [Card(choice(Game.load_cards())) for _ in range(randint(0, 25))]
+        self.assertEqual(player.buying_power[:5], unpack_gems(player.packed_buying_power))
+        self.assertEqual(player.card_power, unpack_gems(player.cards.packed))
+
+
 class PlayerTest(unittest.TestCase):
     def setUp(self):
         self.all_cards = []
@@ -267,6 +411,26 @@ class PlayerTest(unittest.TestCase):
         # overwriting original values
         self.assertIsNot(self.player_instance.tokens, self.player_instance.buying_power)
 
+    def test_card_counts(self):
+        """
+        running counts of owned cards have to follow every way the card collection can be changed
+        """
+        player = self.player_instance
+        player.cards.append(Card(choice(self.regular_cards)))
+        player.cards += [Card(choice(self.regular_cards)) for _ in range(randint(1, 4))]
+        player.cards.extend(self.aristocrats[:2])
+        player.cards.insert(0, Card(choice(self.regular_cards)))
+        player.cards.pop()
+        player.cards.remove(player.cards[0])
+        player.cards[0] = Card(choice(self.regular_cards))
+        del player.cards[:1]
+        self.assertEqual(self.card_power_function(player.cards)[:5], player.card_power)
+        self.assertEqual(sum(player.cards.counts), len(player.cards))
+        copied = deepcopy(player)
+        self.assertEqual(player.cards.counts, copied.cards.counts)
+        player.cards = []
+        self.assertEqual([0] * 5, player.card_power)
+
     def test_can_buy(self):
         # preparing proper card + player instance to test for proper buy
         # we calculate card power and buy power separately to verify
@@ -423,6 +587,19 @@ class PlayerTest(unittest.TestCase):
             self.player_instance.reserve(card_ar)
         self.assertRaises(GameError, self.player_instance.buy_reserve, desired_card=0)
 
+    def test_bought_card_does_not_discount_itself(self):
+        # the card joins the player's cards only after it is paid for, so its own color is paid in full
+        entry = choice([e for e in self.regular_cards if e[4 + Card.COLOR_IDS[e[0]][1]] > 0])
+        for buy in (self.player_instance.buy_card, lambda card: self.player_instance.buy_reserve(0)):
+            card = Card(entry)
+            self.player_instance.cards = []
+            self.player_instance.tokens = list(card.cost) + [0]
+            self.player_instance.reserved = (card, None, None)
+            bought, paid = buy(card)
+            self.assertTrue(bought)
+            self.assertEqual(list(card.cost) + [0], paid)
+            self.assertEqual([0] * 6, self.player_instance.tokens)
+
     def test_can_invite(self):
         """
         aristocrat-only test
@@ -628,9 +805,6 @@ class GameTest(unittest.TestCase):
         c1 = self.game_instance.l1_deck[-1]
         c2 = self.game_instance.l2_deck[-1]
         c3 = self.game_instance.l3_deck[-1]
-        c1.marker = 1
-        c2.marker = 2
-        c3.marker = 3
         self.game_instance.open_cards[0][first_row] = None
         self.game_instance.open_cards[1][second_row] = None
         self.game_instance.open_cards[2][third_row] = None
@@ -639,9 +813,9 @@ class GameTest(unittest.TestCase):
         # all empty spots get replaced
         for row in self.game_instance.open_cards:
             self.assertNotIn(None, row)
-        assert hasattr(self.game_instance.open_cards[0][first_row], 'marker')
-        assert hasattr(self.game_instance.open_cards[1][second_row], 'marker')
-        assert hasattr(self.game_instance.open_cards[2][third_row], 'marker')
+        self.assertIs(c1, self.game_instance.open_cards[0][first_row])
+        self.assertIs(c2, self.game_instance.open_cards[1][second_row])
+        self.assertIs(c3, self.game_instance.open_cards[2][third_row])
 
         # attempt to force raise (that should be ignored) at empty libraries,
         # it is not mistake to allow continuing, when decks are empty
@@ -957,7 +1131,7 @@ class CrossClassTests(unittest.TestCase):
             card, chosen_slot = self.game_instance.player_select(p_id=0)
         self.assertEqual(chosen_card[0], chosen_slot[0])
         self.assertEqual(chosen_card[1], chosen_slot[1])
-        self.assertTrue(isinstance(card, Card))
+        self.assertTrue(isinstance(card, CardBase))
 
         # regular case with library top
         reserve_row = chosen_card[0]
@@ -965,7 +1139,7 @@ class CrossClassTests(unittest.TestCase):
             card, chosen_slot = self.game_instance.player_select(p_id=0)
         self.assertEqual(chosen_card[0], chosen_slot[0])
         self.assertEqual(4, chosen_slot[1])
-        self.assertIsInstance(card, Card)
+        self.assertIsInstance(card, CardBase)
         if reserve_row == 0:
             print('row 1')
             self.assertIs(card, self.game_instance.l1_deck.pop())
@@ -1033,28 +1207,1159 @@ class CrossClassTests(unittest.TestCase):
         # select a column based on 'chosen card [1]' and grab a card from that column for each row
         chosen_card = randint(0, 2), randint(0, 3)
         print('reserve', chosen_card)
+        reserved_cards = []
         for i in range(3):
             with SimpleStdOutInRedirect(StringIO(f"{i}\n{chosen_card[1]}")) as _:
                 card, chosen_slot = self.game_instance.player_select(p_id=0)
-                card.marker = i
+                reserved_cards.append(card)
                 self.assertEqual(card, self.game_instance.open_cards[i][chosen_card[1]])
                 self.game_instance.player_reserve(card, chosen_slot, p_id=0)
                 self.assertEqual(None, self.game_instance.open_cards[i][chosen_card[1]])
             with SimpleStdOutInRedirect(StringIO(f"{i}\n5")) as _:
                 card_reserved, _ = self.game_instance.player_select(p_id=0)
-                assert hasattr(card_reserved, 'marker')
+                self.assertTrue(any(card_reserved is c for c in reserved_cards))
         # raising due to overpopulation in reserved
         self.game_instance.replace_empty()
         with SimpleStdOutInRedirect(StringIO(f'{chosen_card[0]}\n{chosen_card[1]}')) as _:
-            players_reservations = deepcopy(self.game_instance.players[0].reserved)
+            players_reservations = self.game_instance.players[0].reserved
             card, chosen_slot = self.game_instance.player_select(p_id=0)
-            card.marker = 4
             self.assertEqual(card, self.game_instance.open_cards[chosen_card[0]][chosen_card[1]])
             self.assertRaises(GameError, self.game_instance.player_reserve, card=card, desired_card=chosen_slot, p_id=0)
             # making sure 3-card tuple stayed the same even after raising
             for reserved, actual in zip(players_reservations, self.game_instance.players[0].reserved):
-                self.assertEqual(reserved.marker, actual.marker)
-                self.assertNotEqual(4, actual.marker)
+                self.assertIs(reserved, actual)
+                self.assertIsNot(card, actual)
+
+
+@unittest.skipIf(np is None, "numpy is needed for the batched engine")
+class BatchGameTest(unittest.TestCase):
+    """
+    every batched action is compared against the same action done with the scalar 'Game' on each of the games
+    """
+    def setUp(self):
+        self.player_count = randint(2, 4)
+        self.games = []
+        for _ in range(24):
+            game = Game(self.player_count)
+            game.full_setup()
+            for deck in [game.l1_deck, game.l2_deck, game.l3_deck]:
+                shuffle(deck)
+            for p_id in range(self.player_count):
+                for color in range(6):
+                    with suppress(GameError):
+                        for _ in range(randint(0, 2)):
+                            game.give_token(color, p_id)
+            self.games.append(game)
+        self.batch = BatchGame.from_games(self.games)
+        self.p_ids = np.array([randint(0, self.player_count - 1) for _ in self.games])
+
+    def scalar_step(self, action):
+        """
+        applies action to every scalar game, restoring the game when it raised halfway through
+        """
+        for index, game in enumerate(self.games):
+            before = deepcopy(game)
+            try:
+                action(game, index)
+            except (GameError, ValueError, IndexError):
+                self.games[index] = before
+
+    @staticmethod
+    def selected(game: Game, p_id: int, position: tuple):
+        game.players[p_id].check_selection(game.open_cards, game.deck_sizes, position)
+        if position[1] == 4:
+            return getattr(game, f"l{position[0] + 1}_deck")[-1], position
+        if position[1] == 5:
+            return game.players[p_id].reserved[position[0]], position
+        return game.open_cards[position[0]][position[1]], position
+
+    def assertSameGames(self):
+        self.assertTrue(self.batch.same_state(BatchGame.from_games(self.games)).all())
+
+    def test_setup(self):
+        batch = BatchGame(50, self.player_count, seed=randint(0, 1000))
+        self.assertTrue((batch.deck_sizes == [36, 26, 16]).all())
+        self.assertTrue((batch.open_cards != EMPTY).all())
+        self.assertEqual(self.player_count + 1, batch.nobles.shape[1])
+        for n in range(batch.n_games):
+            row_cards = [batch.decks[n, r, :batch.deck_sizes[n, r]].tolist() + batch.open_cards[n, r].tolist()
+                         for r in range(3)]
+            self.assertEqual(list(range(0, 40)), sorted(row_cards[0]))
+            self.assertEqual(list(range(40, 70)), sorted(row_cards[1]))
+            self.assertEqual(list(range(70, 90)), sorted(row_cards[2]))
+
+    def test_draws(self):
+        colors = np.array([(sorted(set(randint(0, 4) for _ in range(3))) + [EMPTY] * 3)[:3] for _ in self.games])
+        self.batch.player_draw_3(colors, self.p_ids)
+        self.scalar_step(lambda g, i: g.player_draw_3([c for c in colors[i] if c != EMPTY], int(self.p_ids[i])))
+        self.assertSameGames()
+        colors = np.array([randint(0, 4) for _ in self.games])
+        self.batch.player_draw_2_same(colors, self.p_ids)
+        self.scalar_step(lambda g, i: g.player_draw_2_same(int(colors[i]), int(self.p_ids[i])))
+        self.assertSameGames()
+
+    def test_reserve_buy_replace(self):
+        for _ in range(6):
+            rows = np.array([randint(0, 2) for _ in self.games])
+            slots = np.array([randint(0, 4) for _ in self.games])
+
+            def reserve(g, i):
+                card, position = self.selected(g, int(self.p_ids[i]), (int(rows[i]), int(slots[i])))
+                g.player_reserve(card, position, int(self.p_ids[i]))
+            self.batch.player_reserve(rows, slots, self.p_ids)
+            self.scalar_step(reserve)
+            self.assertSameGames()
+
+            slots = np.array([choice([0, 1, 2, 3, 5]) for _ in self.games])
+
+            def buy(g, i):
+                card, position = self.selected(g, int(self.p_ids[i]), (int(rows[i]), int(slots[i])))
+                g.player_buys(card, position, int(self.p_ids[i]))
+            self.batch.player_buys(rows, slots, self.p_ids)
+            self.scalar_step(buy)
+            self.assertSameGames()
+
+            self.batch.replace_empty()
+            self.scalar_step(lambda g, i: g.replace_empty())
+            self.assertSameGames()
+
+
+class LegalActionsTest(unittest.TestCase):
+    def setUp(self):
+        self.player_count = randint(2, 4)
+        self.game_instance = Game(self.player_count)
+        self.game_instance.full_setup()
+        # random mid-game looking state - tokens spread around, some cards reserved and some slots empty
+        for p_id in range(self.player_count):
+            for color in range(6):
+                for _ in range(randint(0, 2)):
+                    # leaving space for gold from reservations below the token limit
+                    if sum(self.game_instance.players[p_id].tokens) < Game.TOKEN_LIMIT - 3:
+                        with suppress(GameError):
+                            self.game_instance.give_token(color, p_id)
+            for _ in range(randint(0, 3)):
+                row, slot = randint(0, 2), randint(0, 3)
+                if (card := self.game_instance.open_cards[row][slot]) is not None:
+                    self.game_instance.player_reserve(card, (row, slot), p_id)
+        for _ in range(randint(0, 2)):
+            self.game_instance.l1_deck.pop()
+            self.game_instance.open_cards[randint(0, 2)][randint(0, 3)] = None
+
+    @staticmethod
+    def scalar_legal(game: Game, p_id: int, action: int) -> bool:
+        """
+        tries the action with regular 'Game' methods on a copy of the game, legal means nothing was raised
+        and something has changed
+        """
+        game = deepcopy(game)
+        kind, args = Action.decode(action)
+        player = game.players[p_id]
+        try:
+            if kind == "draw":
+                game.player_draw_3(list(args), p_id)
+            elif kind == "draw_2_same":
+                game.player_draw_2_same(args[0], p_id)
+            elif kind in ["return", "pass"]:
+                # tokens over the limit and having nothing to do are not the case in this setup
+                return False
+            else:
+                player.check_selection(game.open_cards, game.deck_sizes, args)
+                if args[1] == 4:
+                    card = game.decks[args[0]][-1]
+                elif args[1] == 5:
+                    card = player.reserved[args[0]]
+                else:
+                    card = game.open_cards[args[0]][args[1]]
+                if kind == "buy":
+                    owned = len(player.cards)
+                    game.player_buys(card, args, p_id)
+                    return len(player.cards) > owned
+                game.player_reserve(card, args, p_id)
+        except GameError:
+            return False
+        return True
+
+    def test_action_space(self):
+        decoded = [Action.decode(a) for a in range(Action.COUNT)]
+        self.assertEqual(Action.COUNT, len(set(decoded)))
+        self.assertEqual(("return", (5,)), Action.decode(Action.PASS - 1))
+        self.assertEqual(("pass", ()), Action.decode(Action.PASS))
+        self.assertRaises(GameError, Action.decode, Action.COUNT)
+        self.assertRaises(GameError, Action.decode, -1)
+        self.assertEqual([3, 7, Action.COUNT - 1], Action.from_mask(1 << 3 | 1 << 7 | 1 << (Action.COUNT - 1)))
+
+    def test_against_scalar_rules(self):
+        for p_id in range(self.player_count):
+            state = deepcopy(self.game_instance)
+            legal = set(self.game_instance.legal_actions(p_id))
+            self.assertEqual(self.game_instance.legal_mask(p_id), sum(1 << a for a in legal))
+            available = sum(1 for color in range(5) if self.game_instance.tokens[color] > 0)
+            for action in range(Action.COUNT):
+                kind, args = Action.decode(action)
+                if kind == "draw" and len(args) < min(3, available):
+                    # drawing less than 3 colors is only legal when there is nothing more to draw
+                    self.assertNotIn(action, legal)
+                    continue
+                self.assertEqual(self.scalar_legal(self.game_instance, p_id, action), action in legal,
+                                 f"action {action} {kind} {args}")
+            # generating actions doesn't change anything
+            self.assertEqual(state.tokens, self.game_instance.tokens)
+            self.assertEqual(state.open_cards, self.game_instance.open_cards)
+
+    def test_few_colors_and_no_gold(self):
+        self.game_instance.tokens = [0, 3, 0, 1, 0, 0]
+        self.game_instance.players[0].reserved = (None, None, None)
+        self.game_instance.open_cards[0][0] = self.game_instance.l1_deck.pop()
+        legal = self.game_instance.legal_actions(0)
+        self.assertIn(Action.DRAW_IDS[(1, 3)], legal)
+        self.assertIn(Action.DRAW_2_SAME + 1, legal)
+        self.assertNotIn(Action.DRAW_IDS[(1,)], legal)
+        self.assertIn(Action.RESERVE, legal)
+        gold = self.game_instance.players[0].tokens[5]
+        card = self.game_instance.open_cards[0][0]
+        self.game_instance.player_reserve(card, (0, 0), 0)
+        self.assertEqual(gold, self.game_instance.players[0].tokens[5])
+        self.assertIn(card, self.game_instance.players[0].reserved)
+
+
+class ApplyUndoTest(unittest.TestCase):
+    def setUp(self):
+        self.player_count = randint(2, 4)
+        self.game_instance = Game(self.player_count)
+        self.game_instance.full_setup()
+
+    @staticmethod
+    def state(game: Game):
+        """
+        everything that can change during the game, cards compared by identity
+        """
+        return (
+            list(game.tokens), game.current_player,
+            [[id(c) for c in row] for row in game.open_cards],
+            [[id(c) for c in deck] for deck in game.decks],
+            [(list(p.tokens), [id(c) for c in p.cards], [id(c) for c in p.reserved], list(p.cards.counts))
+             for p in game.players],
+        )
+
+    def test_apply_undo_playout(self):
+        states, records = [], []
+        for _ in range(60):
+            legal = self.game_instance.legal_actions(self.game_instance.current_player)
+            if not legal:
+                break
+            # buying is preferred, so the playout gets past drawing tokens
+            buys = [a for a in legal if Action.BUY <= a < Action.RESERVE]
+            states.append(self.state(self.game_instance))
+            records.append(self.game_instance.apply(choice(buys or legal)))
+        self.assertTrue(any(Action.BUY <= r[0] < Action.RESERVE for r in records))
+        while records:
+            self.game_instance.undo(records.pop())
+            self.assertEqual(states.pop(), self.state(self.game_instance))
+
+    def test_apply_moves(self):
+        p_id = self.game_instance.current_player
+        card = self.game_instance.open_cards[1][2]
+        top = self.game_instance.l2_deck[-1]
+        record = self.game_instance.apply(Action.RESERVE + 1 * 4 + 2)
+        self.assertEqual(card, self.game_instance.players[p_id].reserved[0])
+        self.assertIs(top, self.game_instance.open_cards[1][2])
+        self.assertEqual(1, self.game_instance.players[p_id].tokens[5])
+        self.assertEqual((p_id + 1) % self.player_count, self.game_instance.current_player)
+        self.game_instance.undo(record)
+        self.assertIs(card, self.game_instance.open_cards[1][2])
+        self.assertIs(top, self.game_instance.l2_deck[-1])
+        self.assertEqual(p_id, self.game_instance.current_player)
+        self.assertRaises(GameError, self.game_instance.apply, Action.BUY_RESERVED)
+
+
+class ZobristTest(unittest.TestCase):
+    def setUp(self):
+        self.player_count = randint(2, 4)
+        self.game_instance = Game(self.player_count)
+        self.game_instance.full_setup()
+
+    def assertHashUpToDate(self, game: Game):
+        incremental = game.zobrist
+        self.assertEqual(game.rehash(), incremental)
+
+    def test_incremental_updates(self):
+        records = []
+        hashes = [self.game_instance.zobrist]
+        for _ in range(50):
+            legal = self.game_instance.legal_actions(self.game_instance.current_player)
+            buys = [a for a in legal if Action.BUY <= a < Action.RESERVE]
+            records.append(self.game_instance.apply(choice(buys or legal)))
+            self.assertHashUpToDate(self.game_instance)
+            hashes.append(self.game_instance.zobrist)
+        self.assertEqual(len(hashes), len(set(hashes)))
+        while records:
+            self.game_instance.undo(records.pop())
+            hashes.pop()
+            self.assertEqual(hashes[-1], self.game_instance.zobrist)
+        self.assertHashUpToDate(self.game_instance)
+
+    def test_game_methods(self):
+        game = self.game_instance
+        with suppress(GameError):
+            game.take_token(0, 1)
+        game.player_draw_3([0, 1, 2], 1)
+        game.take_token(1, 1)
+        game.player_draw_2_same(3, 0)
+        self.assertHashUpToDate(game)
+        game.player_reserve(game.l3_deck[-1], (2, 4), 1)
+        game.player_reserve(game.open_cards[2][1], (2, 1), 1)
+        game.replace_empty()
+        self.assertHashUpToDate(game)
+        game.players[1].tokens = [7] * 6
+        game.rehash()
+        game.player_buys(game.players[1].reserved[1], (1, 5), 1)
+        game.player_buys(game.open_cards[0][3], (0, 3), 1)
+        self.assertHashUpToDate(game)
+        # cards made by hand have no catalog id and aren't part of the hash
+        noble = game.open_cards[3][0]
+        for color_id, c in enumerate(noble.cost):
+            game.players[0].cards += [Card([Card.COLOR_CODES[color_id]] + [1] * 8) for _ in range(c)]
+        with SimpleStdOutInRedirect(StringIO("")):
+            self.assertIs(noble, game.player_aristocrat_inviting(0))
+        self.assertHashUpToDate(game)
+
+    def test_transposition(self):
+        first, second = deepcopy(self.game_instance), deepcopy(self.game_instance)
+        moves = [Action.DRAW_IDS[(0, 1, 2)]] + [Action.DRAW_IDS[(2, 3, 4)]] * (self.player_count - 1) + \
+                [Action.DRAW_IDS[(1, 3, 4)]]
+        for action in moves:
+            first.apply(action)
+        for action in [moves[-1]] + moves[1:-1] + [moves[0]]:
+            second.apply(action)
+        self.assertEqual(first.zobrist, second.zobrist)
+        self.assertNotEqual(self.game_instance.zobrist, first.zobrist)
+
+
+class StrategyTest(unittest.TestCase):
+    class Scripted(Strategy):
+        def __init__(self, positions):
+            self.positions = list(positions)
+
+        def select_position(self, player, open_cards, deck_sizes):
+            return self.positions.pop(0)
+
+    class AsyncScripted(AsyncStrategy):
+        def __init__(self, positions):
+            self.positions = list(positions)
+
+        async def select_position(self, player, open_cards, deck_sizes):
+            await asyncio.sleep(0)
+            return self.positions.pop(0)
+
+    def setUp(self):
+        self.player_count = randint(2, 4)
+        self.game_instance = Game(self.player_count)
+
+    def test_sync_strategy(self):
+        position = randint(0, 2), randint(0, 3)
+        strategies = [self.Scripted([position, (0, 5)]) for _ in range(self.player_count)]
+        self.game_instance.full_setup(strategies)
+        card, selected = self.game_instance.player_select(p_id=0)
+        self.assertIs(self.game_instance.open_cards[position[0]][position[1]], card)
+        self.assertEqual(position, selected)
+        # selections are still validated
+        self.assertRaises(GameError, self.game_instance.player_select, p_id=0)
+        self.assertRaises(GameError, self.game_instance.setup_players, strategies[:1])
+
+    def test_async_strategy(self):
+        strategies = [self.AsyncScripted([(2, 4)]) for _ in range(self.player_count)]
+        self.game_instance.full_setup(strategies)
+        card, selected = asyncio.run(self.game_instance.player_select_async(p_id=1))
+        self.assertIs(self.game_instance.l3_deck[-1], card)
+        self.assertEqual((2, 4), selected)
+        self.assertRaises(GameError, self.game_instance.player_select, p_id=0)
+
+    def test_random_strategy(self):
+        strategies = [RandomStrategy(seed) for seed in range(self.player_count)]
+        self.game_instance.full_setup(strategies)
+        for p_id in range(self.player_count):
+            card, selected = self.game_instance.player_select(p_id)
+            self.assertIsInstance(card, FrozenCard)
+            self.assertIn(strategies[p_id].choose_action(self.game_instance, p_id),
+                          self.game_instance.legal_actions(p_id))
+
+
+class SeededSetupTest(unittest.TestCase):
+    def setUp(self):
+        self.player_count = randint(2, 4)
+        self.seed = randint(0, 2 ** 32)
+
+    def deal(self, seed):
+        game = Game(self.player_count, seed=seed)
+        game.full_setup()
+        return game
+
+    def test_same_seed_same_game(self):
+        game, again = self.deal(self.seed), self.deal(self.seed)
+        self.assertEqual(game.zobrist, again.zobrist)
+        self.assertEqual(game.decks, again.decks)
+        self.assertEqual(game.nobles, again.nobles)
+        other = self.deal(self.seed + 1)
+        self.assertNotEqual(game.decks, other.decks)
+
+    def test_drawn_seed(self):
+        game, other = self.deal(None), self.deal(None)
+        self.assertIsInstance(game.seed, int)
+        self.assertNotEqual(game.seed, other.seed)
+        self.assertEqual(game.decks, self.deal(game.seed).decks)
+        self.assertEqual(game.seed, Game.from_bytes(game.to_bytes(), verbose=False).seed)
+
+    def test_shuffle_dek(self):
+        deck = list(range(40))
+        shuffled = Game.shuffle_dek(list(deck), Random(self.seed))
+        self.assertEqual(deck, sorted(shuffled))
+        self.assertEqual(shuffled, Game.shuffle_dek(list(deck), Random(self.seed)))
+
+    @unittest.skipIf(np is None, "numpy is needed for the batched engine")
+    def test_deck_permutations(self):
+        permutations = deck_permutations(16, self.seed)
+        for tier, ids in zip(permutations, CardCatalog.get().tiers):
+            self.assertEqual((16, len(ids)), tier.shape)
+            self.assertTrue((np.sort(tier, axis=1) == np.array(ids)).all())
+        batch = BatchGame(16, self.player_count, seed=self.seed)
+        games = []
+        for n in range(16):
+            game = Game(self.player_count)
+            game.full_setup(order=game_order(permutations, n))
+            games.append(game)
+        self.assertTrue(batch.same_state(BatchGame.from_games(games)).all())
+        # cards dealt to the table don't stay behind the top of the deck
+        self.assertTrue((batch.decks == BatchGame.from_games(games).decks).all())
+
+
+class TurnLoopTest(unittest.TestCase):
+    def setUp(self):
+        self.player_count = randint(2, 4)
+        self.game_instance = Game(self.player_count, verbose=False)
+        self.game_instance.full_setup([RandomStrategy(randint(0, 10000)) for _ in range(self.player_count)])
+
+    def test_silent_full_game(self):
+        with SimpleStdOutInRedirect(StringIO("")) as out:
+            winners = self.game_instance.play()
+            self.assertEqual("", out.getvalue())
+        self.assertTrue(self.game_instance.finished)
+        self.assertTrue(winners)
+        # game ends only after the full round
+        self.assertEqual(0, self.game_instance.current_player)
+        scores = self.game_instance.scores
+        self.assertGreaterEqual(max(scores), Game.WINNING_POINTS)
+        for p_id in winners:
+            self.assertEqual(max(scores), scores[p_id])
+        for player, score in zip(self.game_instance.players, scores):
+            self.assertEqual(sum(card.value for card in player.cards), score)
+            self.assertLessEqual(sum(player.tokens), Game.TOKEN_LIMIT)
+        self.assertEqual(0, self.game_instance.legal_mask(0))
+
+    def test_console_and_unfit_strategies(self):
+        # console player types action ids, anything unlisted is asked again
+        game = Game(2, verbose=False, seed=randint(0, 1000))
+        with SimpleStdOutInRedirect(StringIO("abc\n99\n0\n0\n")) as out:
+            game.play(max_actions=2)
+            self.assertIn("try again", out.getvalue())
+        self.assertEqual([1, 1, 1, 0, 0, 0], game.players[0].tokens)
+        self.assertEqual([1, 1, 1, 0, 0, 0], game.players[1].tokens)
+        # strategies that can't choose actions are turned away before anything is dealt
+        for unfit in (AsyncStrategy(), Strategy()):
+            game = Game(2, verbose=False)
+            self.assertRaises(GameError, game.play, [RandomStrategy(0), unfit])
+            self.assertEqual([], game.players)
+
+    def test_undo_whole_game(self):
+        start = self.game_instance.zobrist
+        records = []
+        while not self.game_instance.finished:
+            p_id = self.game_instance.current_player
+            records.append(self.game_instance.apply(self.game_instance.players[p_id].strategy.choose_action(
+                self.game_instance, p_id)))
+        self.assertEqual(self.game_instance.zobrist, self.game_instance.rehash())
+        while records:
+            self.game_instance.undo(records.pop())
+        self.assertEqual(start, self.game_instance.zobrist)
+        self.assertEqual(start, self.game_instance.rehash())
+        self.assertEqual([0] * self.player_count, self.game_instance.scores)
+
+    def test_token_limit(self):
+        game = self.game_instance
+        game.players[0].tokens = [2, 2, 2, 2, 2, 0]
+        game.rehash()
+        game.apply(Action.DRAW_IDS[(0, 1, 2)])
+        self.assertEqual(0, game.current_player)
+        self.assertEqual([Action.RETURN_TOKEN + color for color in range(5)], game.legal_actions(0))
+        game.apply(Action.RETURN_TOKEN + 3)
+        game.apply(Action.RETURN_TOKEN + 4)
+        self.assertEqual(0, game.current_player)
+        game.apply(Action.RETURN_TOKEN + 4)
+        self.assertEqual(1, game.current_player)
+        self.assertEqual([3, 3, 3, 1, 0, 0], game.players[0].tokens)
+
+    def test_noble_visit(self):
+        game = self.game_instance
+        noble = game.open_cards[3][-1]
+        for color_id, c in enumerate(noble.cost):
+            game.players[0].cards += [Card([Card.COLOR_CODES[color_id]] + [1] * 8) for _ in range(c)]
+        points = game.players[0].points
+        record = game.apply(Action.DRAW_IDS[(0, 1, 2)])
+        self.assertIs(noble, game.players[0].cards[-1])
+        self.assertIsNone(game.open_cards[3][-1])
+        self.assertEqual(points + noble.value, game.players[0].points)
+        game.undo(record)
+        self.assertIs(noble, game.open_cards[3][-1])
+        self.assertEqual(points, game.players[0].points)
+
+    def test_pass(self):
+        game = self.game_instance
+        game.tokens = [0] * 6
+        game.players[0].reserved = tuple(game.open_cards[0][:3])
+        self.assertEqual([Action.PASS], game.legal_actions(0))
+        game.apply(Action.PASS)
+        self.assertEqual(1, game.current_player)
+
+
+class TournamentTest(unittest.TestCase):
+    def setUp(self):
+        self.tournament = Tournament({"a": RandomStrategy, "b": RandomStrategy, "c": RandomStrategy},
+                                     player_count=2, games_per_table=3, seed=randint(0, 1000))
+
+    def test_wilson_interval(self):
+        low, high = wilson_interval(50, 100)
+        self.assertAlmostEqual(0.5, (low + high) / 2)
+        self.assertLess(low, 0.5)
+        self.assertEqual((0.0, 1.0), wilson_interval(0, 0))
+        self.assertEqual(0.0, wilson_interval(0, 10)[0])
+        self.assertLess(wilson_interval(450, 1000)[1] - wilson_interval(450, 1000)[0],
+                        wilson_interval(45, 100)[1] - wilson_interval(45, 100)[0])
+
+    def test_round_robin(self):
+        results = sorted(self.tournament.run(workers=0))
+        # 3 tables, 2 seat orders each
+        self.assertEqual(18, len(results))
+        self.assertEqual({"a": 12, "b": 12, "c": 12}, self.tournament.games)
+        self.assertAlmostEqual(18 - self.tournament.unfinished, sum(self.tournament.wins.values()))
+        pooled = Tournament(self.tournament.entrants, 2, 3, self.tournament.seed)
+        self.assertEqual(results, sorted(pooled.run(workers=2, chunk_size=4)))
+        self.assertEqual(self.tournament.standings(), pooled.standings())
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.file = path.join(self.directory.name, "games.log")
+        self.player_count = randint(2, 4)
+        self.final = []
+        with ReplayWriter(self.file) as log:
+            for seed in range(5):
+                self.final.append(self.play(log, seed))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def play(self, log, seed):
+        game = Game(self.player_count, verbose=False, seed=seed)
+        game.full_setup([RandomStrategy(seed * 4 + i) for i in range(self.player_count)])
+        log.play(game)
+        return game.zobrist, game.scores, game.finished
+
+    def test_replay(self):
+        reader = ReplayReader(self.file)
+        self.assertEqual(5, len(reader))
+        replayed = [load_game(record) for record in reader.records()]
+        self.assertEqual(self.final, [(game.zobrist, game.scores, game.finished) for game in replayed])
+        turns = [record.index for record, _ in reader.replay(3)]
+        self.assertEqual(3, turns[0])
+        self.assertEqual({3, 4}, set(turns))
+
+    def test_seek(self):
+        reader = ReplayReader(self.file)
+        record = next(reader.records(2))
+        self.assertEqual((2, 2), (record.index, record.seed))
+        self.assertEqual([], list(reader.records(5)))
+        with ReplayWriter(self.file) as log:
+            unseeded = Game(2)
+            unseeded.seed = None
+            self.assertRaises(GameError, log.start, unseeded)
+            for seed in (-3, 2 ** 64, "text"):
+                self.assertRaises(GameError, log.start, Game(2, seed=seed))
+            self.final.append(self.play(log, 5))
+        # nothing of the refused games got to the log
+        self.assertEqual(6, len(ReplayReader(self.file)))
+        self.assertEqual(self.final[-1][0], load_game(next(ReplayReader(self.file).records(5))).zobrist)
+
+    def test_crashed_writer(self):
+        with open(self.file, "ab") as log:
+            log.write(HEADER.pack(GAME_TAG, self.player_count, 99, 0) + STEP.pack(0, 1))
+        with ReplayWriter(self.file) as log:
+            self.final.append(self.play(log, 5))
+        reader = ReplayReader(self.file)
+        self.assertEqual(7, len(reader))
+        records = list(reader.records(5))
+        self.assertEqual([(99, False), (5, True)], [(record.seed, record.finished) for record in records[:2]])
+        self.assertEqual(self.final[-1][0], load_game(records[-1]).zobrist)
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.player_count = randint(2, 4)
+        self.game_instance = Game(self.player_count, verbose=False, seed=randint(0, 1000))
+        self.game_instance.full_setup([RandomStrategy(i) for i in range(self.player_count)])
+        for _ in range(randint(0, 80)):
+            p_id = self.game_instance.current_player
+            if self.game_instance.finished:
+                break
+            self.game_instance.apply(self.game_instance.players[p_id].strategy.choose_action(
+                self.game_instance, p_id))
+
+    def test_round_trip(self):
+        game = self.game_instance
+        data = game.to_bytes()
+        restored = Game.from_bytes(data, [RandomStrategy(i) for i in range(self.player_count)], verbose=False)
+        self.assertEqual(data, restored.to_bytes())
+        self.assertEqual(game.zobrist, restored.zobrist)
+        self.assertEqual((game.current_player, game.finished, game.seed),
+                         (restored.current_player, restored.finished, restored.seed))
+        self.assertEqual(game.tokens, restored.tokens)
+        self.assertEqual(game.decks, restored.decks)
+        self.assertEqual(game.open_cards, restored.open_cards)
+        for player, copied in zip(game.players, restored.players):
+            self.assertEqual(player.tokens, copied.tokens)
+            self.assertEqual(player.reserved, copied.reserved)
+            self.assertEqual(list(player.cards), list(copied.cards))
+            self.assertEqual(player.points, copied.points)
+        self.assertLess(len(data) * 10, len(dumps(game)))
+        # restored game goes on the same way
+        for action in game.legal_actions(game.current_player)[:1]:
+            game.apply(action)
+            restored.apply(action)
+            self.assertEqual(game.zobrist, restored.zobrist)
+
+    def test_improper_snapshot(self):
+        self.assertRaises(GameError, Game.from_bytes, b"XXXX" + self.game_instance.to_bytes()[4:])
+        self.game_instance.players[0].cards.append(Card(Game.load_cards()[0]))
+        self.assertRaises(GameError, self.game_instance.to_bytes)
+        # seeds the header can't hold
+        for seed in (-5, 2 ** 70, "text"):
+            game = Game(2, verbose=False, seed=seed)
+            game.full_setup()
+            self.assertRaises(GameError, game.to_bytes)
+            self.assertRaises(GameError, SessionStore(max_games=1).put, "a", game)
+        game = Game(2, verbose=False, seed=2 ** 64 - 1)
+        game.full_setup()
+        self.assertEqual(2 ** 64 - 1, Game.from_bytes(game.to_bytes(), verbose=False).seed)
+
+    def test_damaged_snapshot(self):
+        data = self.game_instance.to_bytes()
+        for size in range(len(data)):
+            self.assertRaises(GameError, Game.from_bytes, data[:size], verbose=False)
+        self.assertRaises(GameError, Game.from_bytes, data + bytes(1), verbose=False)
+        header = Game.SNAPSHOT_HEADER.size + Game.SNAPSHOT_HASH.size
+        # first reserve slot of the first player, after the bank and the player's tokens
+        self.assertRaises(GameError, Game.from_bytes, data[:header + 12] + bytes([200]) + data[header + 13:],
+                          verbose=False)
+        # version 2 had no hash, the game is hashed when restored
+        old = data[:4] + bytes([2]) + data[5:Game.SNAPSHOT_HEADER.size] + data[header:]
+        self.assertEqual(self.game_instance.zobrist, Game.from_bytes(old, verbose=False).zobrist)
+
+
+class ServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = GameServer()
+        await self.server.start()
+        self.clients = [await Client.connect(self.server.host, self.server.port) for _ in range(2)]
+        self.session = (await self.clients[0].request("create", players=2, seed=7))["session"]
+        for seat, client in enumerate(self.clients):
+            self.assertEqual(seat, (await client.request("join", session=self.session))["seat"])
+
+    async def asyncTearDown(self):
+        for client in self.clients:
+            await client.close()
+        await self.server.close()
+
+    async def test_moves(self):
+        first, second = self.clients
+        self.assertFalse((await second.request("draw", colors=[0, 1, 2]))["ok"])
+        response = await first.request("draw", colors=[2, 1, 0])
+        self.assertTrue(response["ok"])
+        self.assertEqual([1, 1, 1, 0, 0, 0], response["state"]["players"][0]["tokens"])
+        self.assertEqual(1, response["state"]["current_player"])
+        self.assertFalse((await second.request("draw_2_same", color=9))["ok"])
+        self.assertFalse((await second.request("buy", row=0, slot=5))["ok"])
+        reserved = (await second.request("reserve", row=0, slot=4))["state"]["players"][1]["reserved"]
+        state = (await first.request("state"))["state"]
+        self.assertEqual([["draw", [0, 1, 2]], ["reserve", [0, 4]]],
+                         [message["action"] for message in second.events + first.events])
+        game = Game(2, verbose=False, seed=7)
+        game.full_setup()
+        game.apply(Action.DRAW_IDS[(0, 1, 2)])
+        game.apply(Action.RESERVE_DECK)
+        self.assertEqual(game.tokens, state["tokens"])
+        self.assertEqual([card.id for card in game.players[1].reserved if card], reserved[:1])
+        # the other seat knows only the level of the card reserved from the top of the deck
+        self.assertEqual([{"level": 1}, None, None], state["players"][1]["reserved"])
+        self.assertEqual(state["players"], first.events[-1]["state"]["players"])
+
+    async def test_sessions(self):
+        third = await Client.connect(self.server.host, self.server.port)
+        self.clients.append(third)
+        self.assertEqual("session is full", (await third.request("join", session=self.session))["error"])
+        self.assertFalse((await third.request("state"))["ok"])
+        self.assertFalse((await third.request("create", players=7))["ok"])
+        self.server.sessions[self.session].game.finished = True
+        for client in self.clients[:2]:
+            self.assertTrue((await client.request("leave"))["ok"])
+        self.assertEqual({}, self.server.sessions)
+
+    async def test_idle_sessions(self):
+        third = await Client.connect(self.server.host, self.server.port)
+        self.clients.append(third)
+        unjoined = (await third.request("create", players=2))["session"]
+        for client in self.clients[:2]:
+            self.assertTrue((await client.request("leave"))["ok"])
+        # unfinished session waits for its players to come back for a while
+        self.assertEqual({self.session, unjoined}, set(self.server.sessions))
+        self.assertEqual(0, (await self.clients[0].request("join", session=self.session))["seat"])
+        self.assertTrue((await self.clients[0].request("leave"))["ok"])
+        self.server.idle_timeout = 0
+        created = (await third.request("create", players=2))["session"]
+        self.assertEqual([created], list(self.server.sessions))
+        self.assertEqual(1, len(self.server.store))
+
+
+class SessionStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.store = SessionStore(self.directory.name, max_games=2)
+        self.games = {}
+        for s_id in "abc":
+            self.games[s_id] = Game(randint(2, 4), verbose=False, seed=randint(0, 1000))
+            self.games[s_id].full_setup()
+            self.store.put(s_id, self.games[s_id])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_eviction(self):
+        self.assertEqual({"hits": 0, "misses": 0, "evictions": 1, "in_memory": 2, "on_disk": 1}, self.store.stats())
+        self.assertTrue(path.exists(path.join(self.directory.name, "a.snap")))
+        self.assertIs(self.games["b"], self.store.get("b"))
+        restored = self.store.get("a")
+        self.assertIsNot(self.games["a"], restored)
+        self.assertEqual(self.games["a"].to_bytes(), restored.to_bytes())
+        # 'c' was used least recently
+        self.assertEqual({"hits": 1, "misses": 1, "evictions": 2, "in_memory": 2, "on_disk": 1}, self.store.stats())
+        self.assertIsNot(self.games["c"], self.store.get("c"))
+        self.assertEqual(3, len(self.store))
+        self.store.pop("b")
+        self.store.pop("a")
+        self.assertNotIn("a", self.store)
+        self.assertRaises(KeyError, self.store.get, "a")
+        self.assertFalse(path.exists(path.join(self.directory.name, "b.snap")))
+
+    def test_memory_budget(self):
+        self.assertEqual(3, SessionStore(self.directory.name, max_bytes=3 * 7 * 1024).max_games)
+
+    def test_close(self):
+        self.store.close()
+        self.assertEqual(0, len(self.store))
+        self.assertEqual([], listdir(self.directory.name))
+        with SessionStore(max_games=1) as store:
+            for s_id in "ab":
+                store.put(s_id, self.games[s_id])
+            directory = store.directory
+            self.assertTrue(path.exists(path.join(directory, "a.snap")))
+        self.assertFalse(path.exists(directory))
+
+    def test_smallest_store(self):
+        for max_games in (0, -1):
+            self.assertRaises(ValueError, SessionStore, self.directory.name, max_games=max_games)
+        store = SessionStore(self.directory.name, max_games=1)
+        for s_id in "ab":
+            store.put(s_id, self.games[s_id].clone())
+        for s_id in "abab":
+            game = store.get(s_id)
+            self.assertIs(game, store.get(s_id))
+            game.apply(game.legal_actions(game.current_player)[0])
+            self.assertEqual(game.to_bytes(), store.get(s_id).to_bytes())
+
+
+class BenchTest(unittest.TestCase):
+    def test_quick_run(self):
+        results = bench.run(["Player.can_buy", "Game.replace_empty"], scale=0.01)
+        self.assertEqual(["Player.can_buy", "Game.replace_empty"], list(results))
+        for result in results.values():
+            self.assertGreater(result["ops_per_sec"], 0)
+            self.assertLessEqual(result["p50_us"], result["p90_us"])
+            self.assertLessEqual(result["p90_us"], result["p99_us"])
+
+    def test_compare(self):
+        results = {"a": {"p50_us": 2.0}, "b": {"p50_us": 1.0}}
+        changes = bench.compare(results, {"a": {"p50_us": 1.0}, "b": {"p50_us": 1.0}, "c": {"p50_us": 1.0}})
+        self.assertEqual({"a": -0.5, "b": 0.0}, changes)
+        self.assertIn("REGRESSION", bench.report({name: dict(r, ops_per_sec=1, p90_us=2, p99_us=2)
+                                                  for name, r in results.items()}, changes).split("\n")[1])
+
+
+class InstrumentTest(unittest.TestCase):
+    def setUp(self):
+        self.game_instance = Game(3, verbose=False, seed=randint(0, 1000))
+        self.game_instance.full_setup([RandomStrategy(i) for i in range(3)])
+
+    def test_counts(self):
+        apply, can_buy = Game.apply, Player.can_buy
+        actions = []
+        with instrumented() as stats:
+            stats.reset()
+            self.assertIsNot(apply, Game.apply)
+            self.game_instance.play(on_action=lambda p_id, action: actions.append(action))
+        self.assertIs(apply, Game.apply)
+        self.assertIs(can_buy, Player.can_buy)
+        self.assertEqual(len(actions), stats.stats["Game.apply"][0])
+        self.assertEqual(1, stats.stats["Game.play"][0])
+        kinds = {Action.decode(action)[0] for action in actions}
+        self.assertEqual(len(actions), sum(stats.stats[f"Game.apply[{kind}]"][0] for kind in kinds))
+        self.assertGreaterEqual(stats.stats["Game.play"][1], stats.stats["Game.apply"][1])
+        events = stats.chrome_trace()["traceEvents"]
+        self.assertEqual(sum(calls for name, (calls, _, _) in stats.stats.items() if "[" not in name), len(events))
+        self.assertEqual({"X"}, {event["ph"] for event in events})
+        self.assertIn("Game.apply", stats.summary())
+
+    def test_selected_methods(self):
+        with instrumented(methods=["give_token"]) as stats:
+            stats.reset()
+            self.game_instance.apply(Action.DRAW_IDS[(0, 1, 2)])
+        self.assertEqual({"Game.give_token": 3}, {name: entry[0] for name, entry in stats.stats.items()})
+
+
+class RenderTest(unittest.TestCase):
+    def setUp(self):
+        self.game_instance = Game(randint(2, 4), verbose=False, seed=randint(0, 1000))
+        self.game_instance.full_setup()
+        self.renderer = BoardRenderer()
+
+    def test_card_cache(self):
+        card = self.game_instance.open_cards[0][0]
+        self.assertIs(card.render(), card.render())
+        self.assertEqual(card._draw(False), card.render())
+        self.assertEqual(card._draw(True), card.print_short())
+        self.assertEqual(tuple(card.render().split("\n")), card.render_lines())
+        copied = Card([card.gem, card.color_id, card.value, card.level, *card.cost])
+        self.assertEqual(card.render(), str(copied))
+        copied.cost = [9, 9, 9, 9, 9]
+        self.assertIn(" 9 rub", copied.render())
+
+    def test_board(self):
+        board = self.renderer.render(self.game_instance).split("\n")
+        for row in range(3):
+            for card in self.game_instance.open_cards[row]:
+                self.assertTrue(any(card.render_lines()[1] in line for line in board))
+        for player in self.game_instance.players:
+            self.assertTrue(any(f"player {player.id}" in line for line in board))
+        short = BoardRenderer(short=True).render(self.game_instance)
+        self.assertIn(self.game_instance.open_cards[1][2].print_short(), short)
+
+    def test_diff(self):
+        self.assertTrue(self.renderer.diff(self.game_instance).startswith("\x1b[2J"))
+        self.assertEqual("", self.renderer.diff(self.game_instance))
+        card = self.game_instance.open_cards[0][1]
+        self.game_instance.open_cards[0][1] = None
+        update = self.renderer.diff(self.game_instance)
+        # only the emptied slot is redrawn, one escape sequence per line plus the final cursor move
+        self.assertEqual(11, update.count("\x1b["))
+        self.assertNotIn(card.render_lines()[1], update)
+        self.game_instance.open_cards[0][1] = card
+        self.assertIn(card.render_lines()[1], self.renderer.diff(self.game_instance))
+
+
+class AffordabilityTest(unittest.TestCase):
+    def setUp(self):
+        self.player_count = randint(2, 4)
+        self.game_instance = Game(self.player_count, verbose=False, seed=randint(0, 1000))
+        self.game_instance.full_setup([RandomStrategy(i) for i in range(self.player_count)])
+
+    def brute_force(self, p_id):
+        player = self.game_instance.players[p_id]
+        positions = [(row, slot) for row in range(3) for slot in range(4)
+                     if self.game_instance.open_cards[row][slot] is not None]
+        positions += [(slot, 5) for slot, card in enumerate(player.reserved) if card is not None]
+        result = {}
+        for row, slot in positions:
+            card = player.reserved[row] if slot == 5 else self.game_instance.open_cards[row][slot]
+            affordable, gold = player.can_buy(card)
+            if affordable:
+                result[(row, slot)] = gold
+        return result
+
+    def test_random_walk(self):
+        game = self.game_instance
+        records = []
+        while not game.finished and len(records) < 150:
+            for p_id in range(self.player_count):
+                self.assertEqual(self.brute_force(p_id), game.affordable(p_id))
+            p_id = game.current_player
+            records.append(game.apply(game.players[p_id].strategy.choose_action(game, p_id)))
+        while records:
+            game.undo(records.pop())
+            self.assertEqual(self.brute_force(game.current_player), game.affordable(game.current_player))
+
+    def test_state_changed_by_hand(self):
+        game = self.game_instance
+        game.affordable(0)
+        game.players[0].tokens = [7, 7, 7, 7, 7, 0]
+        self.assertEqual(12, len(game.affordable(0)))
+        game.open_cards[1][2] = None
+        self.assertNotIn((1, 2), game.affordable(0))
+        game.players[0].reserved = (game.l3_deck[-1], None, None)
+        self.assertIn((0, 5), game.affordable(0))
+
+
+class NobleTrackingTest(unittest.TestCase):
+    def setUp(self):
+        self.player_count = randint(2, 4)
+        self.game_instance = Game(self.player_count, verbose=False, seed=randint(0, 1000))
+        self.game_instance.full_setup([RandomStrategy(i) for i in range(self.player_count)])
+
+    def brute_force(self, p_id):
+        power = self.game_instance.players[p_id].card_power
+        return [None if noble is None else [max(cost - have, 0) for cost, have in zip(noble.cost, power)]
+                for noble in self.game_instance.open_cards[3]]
+
+    def test_random_walk(self):
+        game = self.game_instance
+        while not game.finished and game.players[0].points < 10:
+            p_id = game.current_player
+            game.apply(game.players[p_id].strategy.choose_action(game, p_id))
+            for player in range(self.player_count):
+                deficits = self.brute_force(player)
+                self.assertEqual(deficits, game.noble_deficits(player))
+                self.assertEqual([None if d is None else sum(d) for d in deficits], game.noble_distances()[player])
+
+    def test_invite_without_output(self):
+        game = Game(2, seed=randint(0, 1000))
+        game.full_setup()
+        noble = game.open_cards[3][1]
+        for color_id, c in enumerate(noble.cost):
+            game.players[1].cards += [Card([Card.COLOR_CODES[color_id]] + [1] * 8) for _ in range(c)]
+        self.assertEqual(0, game.noble_distances()[1][1])
+        game.players[1].verbose = False
+        with SimpleStdOutInRedirect(StringIO("")) as out:
+            self.assertIs(noble, game.player_aristocrat_inviting(1))
+            self.assertEqual("", out.getvalue())
+        self.assertIsNone(game.noble_distances()[1][1])
+        self.assertIsNone(game.player_aristocrat_inviting(0))
+
+
+class CloneTest(unittest.TestCase):
+    def setUp(self):
+        self.player_count = randint(2, 4)
+        self.game_instance = Game(self.player_count, verbose=False, seed=randint(0, 1000))
+        self.game_instance.full_setup([RandomStrategy(i) for i in range(self.player_count)])
+        for _ in range(randint(0, 40)):
+            p_id = self.game_instance.current_player
+            self.game_instance.apply(self.game_instance.players[p_id].strategy.choose_action(
+                self.game_instance, p_id))
+
+    def test_clone(self):
+        game = self.game_instance
+        before = game.to_bytes()
+        clone = game.clone()
+        self.assertEqual(before, clone.to_bytes())
+        self.assertEqual(game.zobrist, clone.zobrist)
+        self.assertIs(game.open_cards[0][0], clone.open_cards[0][0])
+        for p_id in range(self.player_count):
+            self.assertEqual(game.legal_mask(p_id), clone.legal_mask(p_id))
+            self.assertEqual(game.players[p_id].cards.counts, clone.players[p_id].cards.counts)
+        # playing the clone to the end leaves the original untouched
+        clone.play(max_actions=2000)
+        self.assertEqual(before, game.to_bytes())
+        self.assertEqual(game.zobrist, game.rehash())
+        self.assertEqual(clone.zobrist, clone.rehash())
+        for p_id in range(self.player_count):
+            self.assertEqual(Game.from_bytes(before, verbose=False).legal_mask(p_id), game.legal_mask(p_id))
+
+
+class PaymentTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = Random(randint(0, 1000))
+        self.cards = CardCatalog.get().cards
+        self.cases = []
+        for _ in range(200):
+            player = Player(0, verbose=False)
+            player.tokens = [self.rng.randint(0, 4) for _ in range(5)] + [self.rng.randint(0, 5)]
+            player.cards = [self.cards[self.rng.randrange(90)] for _ in range(self.rng.randint(0, 8))]
+            weights = [self.rng.choice([0, 1, 2, 3]) for _ in range(6)]
+            self.cases.append((player, self.cards[self.rng.randrange(90)], weights))
+
+    def test_payments(self):
+        for player, card, weights in self.cases:
+            payments = list(player.payments(card))
+            self.assertEqual(player.can_buy(card)[0], bool(payments))
+            for payment in payments:
+                player.check_payment(card, payment)
+            if payments:
+                # the greedy payment is one of them, and the best one is the cheapest of them
+                greedy = Player.pay_tokens(copy(player), player.can_buy(card), card)
+                self.assertIn(greedy, payments)
+                self.assertEqual(greedy, player.best_payment(card))
+                best = player.best_payment(card, weights)
+                self.assertIn(best, payments)
+                self.assertEqual(min(sum(w * p for w, p in zip(weights, payment)) for payment in payments),
+                                 sum(w * p for w, p in zip(weights, best)))
+            else:
+                self.assertIsNone(player.best_payment(card, weights))
+
+    def test_buying_with_payment(self):
+        game = Game(2, verbose=False, seed=randint(0, 1000))
+        game.full_setup()
+        player = game.players[0]
+        player.tokens = [4, 4, 4, 4, 4, 5]
+        card = game.open_cards[0][0]
+        payment = list(player.payments(card))[-1]
+        self.assertRaises(GameError, player.check_payment, card, [1, 0, 0, 0, 0, 0])
+        before = game.to_bytes()
+        record = game.apply(Action.encode("buy", (0, 0)))
+        game.undo(record)
+        self.assertEqual(before, game.to_bytes())
+        # the strategy of the player can ask for paying with gold wherever it can
+        player.strategy = Strategy()
+        player.strategy.payment_weights = (1, 1, 1, 1, 1, 0)
+        game.apply(Action.encode("buy", (0, 0)))
+        self.assertEqual([4] * 5 + [5 - sum(payment)], player.tokens)
+        self.assertEqual([0] * 5, payment[:5])
+
+    @unittest.skipIf(np is None, "numpy is needed for the batched payments")
+    def test_batched(self):
+        tokens = np.array([player.tokens for player, _, _ in self.cases])
+        power = np.array([player.cards.counts[:5] for player, _, _ in self.cases])
+        costs = np.array([card.cost for _, card, _ in self.cases])
+        weights = np.array([weights for _, _, weights in self.cases])
+        for batch_weights in (None, weights, weights[0]):
+            payments, affordable = best_payments(tokens, power, costs, batch_weights)
+            for n, (player, card, case_weights) in enumerate(self.cases):
+                scalar = player.best_payment(card, None if batch_weights is None else
+                                             case_weights if batch_weights is weights else weights[0])
+                self.assertEqual(scalar is not None, affordable[n])
+                self.assertEqual(scalar or [0] * 6, payments[n].tolist())
+
+
+class MCTSTest(unittest.TestCase):
+    def setUp(self):
+        self.seed = randint(0, 1000)
+        self.game_instance = Game(2, verbose=False, seed=self.seed)
+        self.game_instance.full_setup([RandomStrategy(self.seed), RandomStrategy(self.seed + 1)])
+
+    def test_choose_action(self):
+        game = self.game_instance
+        before = game.to_bytes()
+        bot = MCTSStrategy(self.seed, iterations=100)
+        action = bot.choose_action(game, game.current_player)
+        # search runs on a clone, the game itself stays untouched
+        self.assertEqual(before, game.to_bytes())
+        self.assertTrue(game.legal_mask(game.current_player) >> action & 1)
+        root = bot.table[game.zobrist]
+        self.assertEqual(100, root.total)
+        self.assertEqual(100, sum(root.visits))
+        self.assertEqual(max(root.visits), root.visits[root.actions.index(action)])
+
+    def test_tree_reuse(self):
+        game = self.game_instance
+        bot = MCTSStrategy(self.seed, iterations=300)
+        game.apply(bot.choose_action(game, 0))
+        # answer of the opponent the search looked at the most
+        reply = bot.table[game.zobrist]
+        game.apply(reply.actions[max(range(len(reply.actions)), key=reply.visits.__getitem__)])
+        # the position was expanded by the previous search and its node is picked up again
+        root = bot.table.get(game.zobrist)
+        self.assertIsNotNone(root)
+        known = root.total
+        bot.choose_action(game, 0)
+        self.assertIs(root, bot.table[game.zobrist])
+        self.assertEqual(known + 300, root.total)
+
+    def test_bounded_table(self):
+        game = self.game_instance
+        bot = MCTSStrategy(self.seed, iterations=20, max_nodes=60)
+        game.players[0].strategy = bot
+        sizes = []
+        game.play(max_actions=300, on_action=lambda p_id, action: sizes.append(len(bot.table)))
+        self.assertLessEqual(max(sizes), 60)
+        # nodes dropped from the table are recycled rather than allocated again
+        self.assertLess(len(bot._free), 60)
+        self.assertEqual(len(bot.table), len({id(node) for node in bot.table.values()}))
+
+
+class ISMCTSTest(unittest.TestCase):
+    def setUp(self):
+        self.seed = randint(0, 1000)
+        self.game_instance = Game(2, verbose=False, seed=self.seed)
+        self.game_instance.full_setup([RandomStrategy(self.seed), RandomStrategy(self.seed + 1)])
+        game = self.game_instance
+        # both players reserve from the top of a deck, the first one twice
+        self.records = [game.apply(Action.encode("reserve", (randint(0, 2), 4))) for _ in range(3)]
+
+    def test_blind_reserve(self):
+        game = self.game_instance
+        first, second = game.players
+        self.assertEqual([0, 1], [slot for slot, _ in first.hidden])
+        self.assertEqual([0], [slot for slot, _ in second.hidden])
+        restored = Game.from_bytes(game.to_bytes(), verbose=False)
+        self.assertEqual([card.id for _, card in first.hidden], [card.id for _, card in restored.players[0].hidden])
+        for record in reversed(self.records):
+            game.undo(record)
+        self.assertEqual([], first.hidden + second.hidden)
+        self.assertEqual(frozenset(), first.blind | second.blind)
+
+    def test_determinization(self):
+        game = self.game_instance
+        observer = game.current_player
+        hidden = game.players[1 - observer].hidden
+        bot = ISMCTSStrategy(self.seed)
+        bot.observer = observer
+        worlds = Determinizer(self.seed).sample(game, observer, 30)
+        dealt = set()
+        for world in worlds:
+            self.assertEqual(world.zobrist, world.rehash())
+            self.assertEqual(bot.key(game), bot.key(world))
+            self.assertEqual(game.open_cards, world.open_cards)
+            self.assertEqual(game.deck_sizes, world.deck_sizes)
+            self.assertEqual(game.players[observer].reserved, world.players[observer].reserved)
+            world_hidden = world.players[1 - observer].hidden
+            self.assertEqual([(slot, card.level) for slot, card in hidden],
+                             [(slot, card.level) for slot, card in world_hidden])
+            for row in range(3):
+                unseen = sorted(card.id for card in game.decks[row] + [c for _, c in hidden if c.level == row + 1])
+                self.assertEqual(unseen, sorted(card.id for card in world.decks[row] +
+                                                [c for _, c in world_hidden if c.level == row + 1]))
+            dealt.add(tuple(card.id for card in world.l1_deck))
+        self.assertGreater(len(dealt), 1)
+
+    def test_no_peeking(self):
+        game = self.game_instance
+        observer = game.current_player
+        # the same information set - other card in the opponent's blind reserve, decks in other order
+        other = game.clone()
+        opponent = other.players[1 - observer]
+        slot, card = opponent.hidden[0]
+        deck = other.decks[card.level - 1]
+        swap = deck.index(choice(deck))
+        reserved = list(opponent.reserved)
+        reserved[slot], deck[swap] = deck[swap], card
+        opponent.reserved = tuple(reserved)
+        opponent.blind = opponent.blind - {card.id} | {reserved[slot].id}
+        for d in other.decks:
+            shuffle(d)
+        other.rehash()
+        self.assertNotEqual(game.zobrist, other.zobrist)
+        bots = [ISMCTSStrategy(self.seed, iterations=60, determinizations=5) for _ in range(2)]
+        before = game.to_bytes()
+        actions = [bot.choose_action(g, observer) for bot, g in zip(bots, (game, other))]
+        self.assertEqual(before, game.to_bytes())
+        self.assertEqual(actions[0], actions[1])
+        roots = [bot.table[bot.key(g)] for bot, g in zip(bots, (game, other))]
+        self.assertEqual(roots[0].actions, roots[1].actions)
+        self.assertEqual(roots[0].visits, roots[1].visits)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,171 @@
+"""
+round-robin self-play tournament between bots, games are spread over a process pool
+
+every entrant is a name and a factory making a fresh strategy from seed (e.g. 'RandomStrategy' class itself).
+all of the games are silent ('verbose=False') and dealt from deterministic seeds, so a tournament run
+with the same 'seed' gives the same results no matter how many workers played it
+"""
+import os
+import sys
+import argparse
+from math import sqrt
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from main import CARDS_FILE, CardCatalog, Game, RandomStrategy, Strategy
+from mcts import MCTSStrategy
+from ismcts import ISMCTSStrategy
+
+STRATEGIES: Dict[str, Callable[[int], Strategy]] = {
+    "random": RandomStrategy,
+    "mcts": MCTSStrategy,
+    "ismcts": ISMCTSStrategy,
+}
+
+
+class GameResult(NamedTuple):
+    index: int
+    seed: int
+    seats: Tuple[str, ...]
+    winners: Tuple[int, ...]
+    scores: Tuple[int, ...]
+    finished: bool
+
+
+def wilson_interval(wins: float, games: int, z: float = 1.96) -> Tuple[float, float]:
+    """
+    Wilson score interval of the win rate, behaves well also for rates close to 0 or 1 and few games
+    :param z: normal quantile, 1.96 for 95% confidence
+    """
+    if games == 0:
+        return 0.0, 1.0
+    rate = wins / games
+    denominator = 1 + z * z / games
+    centre = (rate + z * z / (2 * games)) / denominator
+    margin = z * sqrt(rate * (1 - rate) / games + z * z / (4 * games * games)) / denominator
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+def _init_worker(cards_file: str):
+    # cards are parsed once per worker process instead of once per game
+    CardCatalog.get(cards_file)
+
+
+def play_game(index: int, seed: int, seats: Sequence[str],
+              factories: Sequence[Callable[[int], Strategy]], max_actions: int = 10000) -> GameResult:
+    game = Game(len(seats), verbose=False, seed=seed)
+    game.full_setup([factory(seed * len(seats) + seat) for seat, factory in enumerate(factories)])
+    winners = game.play(max_actions=max_actions)
+    return GameResult(index, seed, tuple(seats), tuple(winners), tuple(game.scores), game.finished)
+
+
+def _play_chunk(tasks: List[tuple]) -> List[GameResult]:
+    return [play_game(*task) for task in tasks]
+
+
+class Tournament:
+    def __init__(self, entrants: Dict[str, Callable[[int], Strategy]], player_count: int = 2,
+                 games_per_table: int = 10, seed: int = 0, max_actions: int = 10000):
+        """
+        every set of 'player_count' entrants sits at the table in each of its seat rotations
+        :param games_per_table: games played with one seat order
+        """
+        if len(entrants) < player_count:
+            raise ValueError("not enough entrants to fill the table")
+        self.entrants = dict(entrants)
+        self.player_count = player_count
+        self.games_per_table = games_per_table
+        self.seed = seed
+        self.max_actions = max_actions
+        self.wins = {name: 0.0 for name in self.entrants}
+        self.games = {name: 0 for name in self.entrants}
+        self.unfinished = 0
+
+    def tasks(self) -> List[tuple]:
+        tasks = []
+        for table in combinations(self.entrants, self.player_count):
+            for shift in range(self.player_count):
+                seats = table[shift:] + table[:shift]
+                factories = [self.entrants[name] for name in seats]
+                for _ in range(self.games_per_table):
+                    index = len(tasks)
+                    tasks.append((index, self.seed + index, seats, factories, self.max_actions))
+        return tasks
+
+    def record(self, result: GameResult):
+        for name in result.seats:
+            self.games[name] += 1
+        if not result.finished:
+            self.unfinished += 1
+            return
+        # tied winners split the win
+        for p_id in result.winners:
+            self.wins[result.seats[p_id]] += 1 / len(result.winners)
+
+    def run(self, workers: Optional[int] = None, chunk_size: Optional[int] = None) -> Iterator[GameResult]:
+        """
+        plays all of the games, yielding results in order of completion
+        :param workers: number of processes, all of the cores by default; 0 plays in this process
+        :param chunk_size: games sent to the worker at once, by default about 4 chunks per worker
+        """
+        tasks = self.tasks()
+        if workers == 0:
+            CardCatalog.get()
+            for task in tasks:
+                result = play_game(*task)
+                self.record(result)
+                yield result
+            return
+        workers = workers or os.cpu_count() or 1
+        chunk_size = chunk_size or max(1, len(tasks) // (workers * 4))
+        chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(CARDS_FILE,)) as pool:
+            for future in as_completed([pool.submit(_play_chunk, chunk) for chunk in chunks]):
+                for result in future.result():
+                    self.record(result)
+                    yield result
+
+    def standings(self) -> List[Tuple[str, float, int, float, float]]:
+        """
+        :return: (name, wins, games, ci low, ci high) sorted from the best win rate
+        """
+        table = []
+        for name in self.entrants:
+            games = self.games[name]
+            low, high = wilson_interval(self.wins[name], games)
+            table.append((name, self.wins[name], games, low, high))
+        return sorted(table, key=lambda row: row[1] / row[2] if row[2] else 0, reverse=True)
+
+    def report(self) -> str:
+        lines = [f"{'entrant':<16}{'wins':>8}{'games':>7}{'rate':>8}   95% CI"]
+        for name, wins, games, low, high in self.standings():
+            rate = wins / games if games else 0
+            lines.append(f"{name:<16}{wins:>8.1f}{games:>7}{rate:>8.3f}   [{low:.3f}, {high:.3f}]")
+        if self.unfinished:
+            lines.append(f"{self.unfinished} games hit the action limit and count as lost for everyone")
+        return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="round-robin bot tournament")
+    parser.add_argument("-e", "--entrant", action="append", choices=sorted(STRATEGIES),
+                        help="strategy taking part, repeat for more entrants (the same one may play itself)")
+    parser.add_argument("-p", "--players", type=int, default=2)
+    parser.add_argument("-g", "--games", type=int, default=100, help="games per seat order of every table")
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+    names = args.entrant or ["random"] * args.players
+    entrants = {f"{name}#{i}": STRATEGIES[name] for i, name in enumerate(names)}
+    tournament = Tournament(entrants, args.players, args.games, args.seed)
+    total = len(tournament.tasks())
+    for done, _ in enumerate(tournament.run(args.workers), 1):
+        if done % 100 == 0 or done == total:
+            print(f"\r{done}/{total} games", end="", file=sys.stderr)
+    print(file=sys.stderr)
+    print(tournament.report())
+
+
+if __name__ == '__main__':
+    main()